@@ -0,0 +1,111 @@
+"""
+Fachada asíncrona sobre Database para usar desde los handlers de asyncio
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class _StreamError:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class AsyncDatabase:
+    """Versión awaitable de cada método público de Database.
+
+    Las llamadas se ejecutan en un ThreadPoolExecutor acotado, así una consulta
+    lenta solo ocupa uno de sus hilos y el event loop sigue atendiendo otros
+    chats. `max_concurrency` limita las consultas simultáneas y `max_streams` los
+    recorridos de stream() a la vez; conviene que entre los dos no superen el tamaño
+    máximo del pool de conexiones.
+    """
+
+    def __init__(self, db: Database, max_concurrency: int = None, max_streams: int = None):
+        self.sync = db
+        self.max_concurrency = max_concurrency or int(os.getenv('DB_MAX_CONCURRENCY', 8))
+        self.max_streams = max_streams or int(os.getenv('DB_MAX_STREAMS', 2))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix='db'
+        )
+        # Los productores de stream() esperan a su consumidor, que a su vez usa el executor
+        # de arriba: si compartieran hilos, varios recorridos a la vez lo bloquearían entero
+        self._stream_executor = ThreadPoolExecutor(
+            max_workers=self.max_streams,
+            thread_name_prefix='db-stream'
+        )
+        logger.info(
+            f'Acceso asíncrono a BD con concurrencia máxima {self.max_concurrency} '
+            f'y {self.max_streams} recorridos a la vez'
+        )
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+
+        # Se guarda para no reconstruir el wrapper en cada llamada
+        setattr(self, name, method)
+        return method
+
+    async def stream(self, name: str, *args, maxsize: int = 100, **kwargs):
+        """Itera de forma asíncrona un método generador de Database (p. ej. iter_due_plants_by_user).
+
+        El generador corre entero en un único hilo, que es quien posee la conexión, y
+        entrega los elementos por una cola acotada: si el consumidor va más lento, el
+        productor espera en lugar de acumular filas en memoria. Ese hilo es de un executor
+        propio de los recorridos, así el consumidor puede seguir haciendo consultas
+        mientras tanto.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in getattr(self.sync, name)(*args, **kwargs):
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            except Exception as e:
+                asyncio.run_coroutine_threadsafe(queue.put(_StreamError(e)), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+        producer = loop.run_in_executor(self._stream_executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, _StreamError):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            # Vaciar la cola para que el productor no se quede bloqueado en put()
+            while not producer.done():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.01)
+            await producer
+
+    def close(self):
+        self._stream_executor.shutdown(wait=True)
+        self._executor.shutdown(wait=True)
+        self.sync.close()
@@ -0,0 +1,116 @@
+"""
+Compara los perfiles de SQLite (y el escritor con commits agrupados) con una carga mixta:
+varios hilos registrando riegos mientras otros leen las plantas pendientes.
+
+Uso: python benchmark_sqlite.py [--seconds 10] [--writers 8] [--readers 8] [--users 200]
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+CONFIGURATIONS = [
+    ('default', {'SQLITE_PROFILE': 'default', 'SQLITE_WRITER': '0'}),
+    ('wal', {'SQLITE_PROFILE': 'wal', 'SQLITE_WRITER': '0'}),
+    ('wal + escritor', {'SQLITE_PROFILE': 'wal', 'SQLITE_WRITER': '1'}),
+]
+
+
+def run(name: str, env: dict, args, workdir: str) -> dict:
+    os.environ.update(env)
+    # Sin caché para que las lecturas lleguen a la base de datos
+    os.environ['PLANT_CACHE_SIZE'] = '0'
+    from database import Database
+
+    db = Database(os.path.join(workdir, f'{name.replace(" ", "_")}.db'))
+    plant_ids = [
+        db.add_plant(user_id, f'Planta {i}', random.randint(1, 14))
+        for user_id in range(1, args.users + 1)
+        for i in range(args.plants)
+    ]
+
+    stop = threading.Event()
+    writes, errors, read_latencies = [0], [0], []
+    lock = threading.Lock()
+
+    def writer():
+        done = 0
+        while not stop.is_set():
+            try:
+                db.record_watering(random.choice(plant_ids))
+                done += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            writes[0] += done
+
+    def reader():
+        latencies = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                db.get_due_plants(random.randint(1, args.users))
+                latencies.append(time.perf_counter() - start)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            read_latencies.extend(latencies)
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    db.close()
+
+    read_latencies.sort()
+    return {
+        'writes_per_second': writes[0] / args.seconds,
+        'reads_per_second': len(read_latencies) / args.seconds,
+        'read_p50_ms': statistics.median(read_latencies) * 1000 if read_latencies else 0.0,
+        'read_p99_ms': read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else 0.0,
+        'locked_errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--plants', type=int, default=10, help='plantas por usuario')
+    parser.add_argument('--dir', help='directorio de las bases de prueba (por defecto uno temporal)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.pop('DATABASE_URL', None)
+    workdir = args.dir or tempfile.mkdtemp(prefix='bench_sqlite_')
+
+    print(f'{args.writers} escritores, {args.readers} lectores, {args.seconds}s por perfil en {workdir}\n')
+    print(f'{"perfil":<16}{"escrituras/s":>14}{"lecturas/s":>12}{"p50 ms":>9}{"p99 ms":>9}{"locked":>8}')
+    try:
+        for name, env in CONFIGURATIONS:
+            result = run(name, env, args, workdir)
+            print(
+                f'{name:<16}{result["writes_per_second"]:>14.0f}{result["reads_per_second"]:>12.0f}'
+                f'{result["read_p50_ms"]:>9.2f}{result["read_p99_ms"]:>9.2f}{result["locked_errors"]:>8}'
+            )
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,16 @@
 import os
 import logging
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
 from threading import Thread
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import asyncio
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from telegram import (
+    Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto,
+    BotCommand,
+)
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -17,6 +21,11 @@ from telegram.ext import (
     filters,
 )
 from database import Database
+from async_database import AsyncDatabase
+from scheduler import ReminderScheduler, parse_notification_time
+from notifier import SendPipeline
+from bot_lock import ShardLeaseManager
+from change_listener import ChangeListener
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -25,12 +34,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 PLANT_NAME, PLANT_DAYS, PLANT_TYPE, SELECTING_PLANT, PHOTO_PLANT, GROUP_NAME, GROUP_ASSIGN = range(7)
+HISTORY_PAGE_SIZE = 20
+PHOTO_PAGE_SIZE = 10  # máximo de fotos de un send_media_group
+
+def days_until(next_due: datetime) -> int:
+    """Días que faltan para el próximo riego (0 = hoy, negativo = atrasado)"""
+    return (next_due - datetime.now()).days
 
 class PlantBot:
     def __init__(self, token: str):
         self.token = token
-        self.db = Database()
+        self.db = AsyncDatabase(Database())
         self.application = Application.builder().token(token).build()
+        self.notifier = SendPipeline(self.application.bot, self.db)
+        self.scheduler = ReminderScheduler(self.db, self.send_reminder, flush=self.notifier.finish_run)
+        self.leases = ShardLeaseManager(self.db, on_change=self._on_shards_changed)
+        self.change_listener = ChangeListener(self.db.sync)
         self._setup_handlers()
         self.notification_task = None
     
@@ -41,6 +60,7 @@ class PlantBot:
             BotCommand("agregar", "Agregar una nueva planta"),
             BotCommand("plantas", "Ver todas tus plantas"),
             BotCommand("regar", "Registrar que regaste una planta"),
+            BotCommand("regar_grupo", "Regar todas las plantas de un grupo"),
             BotCommand("pendientes", "Ver plantas que necesitan riego"),
             BotCommand("historial", "Ver historial de riegos"),
             BotCommand("foto", "Agregar foto a una planta"),
@@ -100,6 +120,7 @@ class PlantBot:
         self.application.add_handler(CommandHandler('historial', self.watering_history))
         self.application.add_handler(CommandHandler('eliminar', self.delete_plant))
         self.application.add_handler(CommandHandler('pendientes', self.pending_plants))
+        self.application.add_handler(CommandHandler('regar_grupo', self.water_group))
         self.application.add_handler(CommandHandler('fotos', self.view_photos))
         self.application.add_handler(CommandHandler('grupos', self.list_groups))
         self.application.add_handler(CommandHandler('estadisticas', self.show_stats))
@@ -117,7 +138,7 @@ class PlantBot:
         try:
             # Test de conexión a base de datos
             logger.info('Probando conexión a base de datos...')
-            test_plants = self.db.get_user_plants(user.id)
+            test_plants = await self.db.get_user_plants(user.id)
             logger.info(f'Conexión a BD exitosa. Usuario tiene {len(test_plants)} plantas')
             
             await update.message.reply_text(
@@ -143,7 +164,8 @@ class PlantBot:
             '/eliminar \\- Eliminar una planta\n\n'
             '*Riego:*\n'
             '/regar \\- Registrar que regaste una planta\n'
-            '/historial \\- Ver historial de riegos\n'
+            '/regar\\_grupo \\- Regar todas las plantas de un grupo\n'
+            '/historial \\- Ver historial de riegos \\(o /historial <planta\\>\\)\n'
             '/pendientes \\- Ver plantas que necesitan riego\n\n'
             '*Fotos:*\n'
             '/foto \\- Agregar foto a una planta\n'
@@ -226,8 +248,9 @@ class PlantBot:
         user_id = update.effective_user.id
         
         logger.info(f'Agregando planta: user_id={user_id}, name={plant_name}, days={days}, type={plant_type}')
-        plant_id = self.db.add_plant(user_id, plant_name, days, plant_type)
+        plant_id = await self.db.add_plant(user_id, plant_name, days, plant_type)
         logger.info(f'Planta agregada con ID: {plant_id}')
+        await self.scheduler.refresh_user(user_id)
         
         # Descripción del tipo
         type_descriptions = {
@@ -252,7 +275,7 @@ class PlantBot:
         try:
             user_id = update.effective_user.id
             logger.info(f'Listando plantas para user_id={user_id}')
-            plants = self.db.get_user_plants(user_id)
+            plants = await self.db.get_user_plants(user_id)
             logger.info(f'Encontradas {len(plants)} plantas para user_id={user_id}')
             
             if not plants:
@@ -280,27 +303,21 @@ class PlantBot:
             
             message = '🌿 *Tus plantas:*\n\n'
             for plant in plants:
-                plant_id, name, days, last_watered, plant_type = plant
-                plant_type = plant_type or 'moderada'  # Default si es None
+                name, days = plant.name, plant.watering_frequency_days
+                plant_type = plant.plant_type or 'moderada'  # Default si es None
                 emoji = type_emojis.get(plant_type, '🌿')
                 care_tip = care_tips.get(plant_type, '')
                 
-                if last_watered:
-                    if isinstance(last_watered, str):
-                        last_date = datetime.fromisoformat(last_watered)
-                    else:
-                        last_date = last_watered
+                if plant.last_watered_at:
+                    days_ago = (datetime.now() - plant.last_watered_at).days
+                    remaining = days_until(plant.next_due_at)
                     
-                    days_ago = (datetime.now() - last_date).days
-                    next_water = last_date + timedelta(days=days)
-                    days_until = (next_water - datetime.now()).days
-                    
-                    if days_until < 0:
-                        status = f'⚠️ Necesita riego (hace {abs(days_until)} días)'
-                    elif days_until == 0:
+                    if remaining < 0:
+                        status = f'⚠️ Necesita riego (hace {abs(remaining)} días)'
+                    elif remaining == 0:
                         status = '💧 Necesita riego hoy'
                     else:
-                        status = f'✅ Próximo riego en {days_until} día(s)'
+                        status = f'✅ Próximo riego en {remaining} día(s)'
                     
                     message += f'{emoji} *{name}*\n'
                     message += f'   Frecuencia: cada {days} día(s)\n'
@@ -327,7 +344,7 @@ class PlantBot:
     
     async def water_plant_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        plants = self.db.get_user_plants(user_id)
+        plants = await self.db.get_user_plants(user_id)
         
         if not plants:
             await update.message.reply_text(
@@ -336,7 +353,7 @@ class PlantBot:
             )
             return ConversationHandler.END
         
-        keyboard = [[plant[1]] for plant in plants]
+        keyboard = [[plant.name] for plant in plants]
         keyboard.append(['Cancelar'])
         
         await update.message.reply_text(
@@ -356,57 +373,30 @@ class PlantBot:
         user_id = update.effective_user.id
         plant_name = update.message.text
         
-        plant = self.db.get_plant_by_name(user_id, plant_name)
-        if not plant:
+        # Búsqueda, ajuste de frecuencia y registro en una sola transacción
+        result = await self.db.water_plant(user_id, plant_name)
+        if not result:
             await update.message.reply_text(
                 'No encontré esa planta. Intenta de nuevo.',
                 reply_markup=ReplyKeyboardRemove()
             )
             return ConversationHandler.END
         
-        plant_id = plant[0]
-        current_frequency = plant[2]
-        
-        # Obtener último riego para calcular días reales
-        plants_data = self.db.get_user_plants(user_id)
-        last_watered = None
-        for p in plants_data:
-            if p[0] == plant_id:
-                last_watered = p[3]
-                break
-        
-        # Calcular días reales desde último riego
-        actual_days = None
-        frequency_adjusted = False
-        adjustment_message = ""
-        
-        if last_watered:
-            if isinstance(last_watered, str):
-                last_date = datetime.fromisoformat(last_watered)
-            else:
-                last_date = last_watered
-            
-            actual_days = (datetime.now() - last_date).days
-            
-            # Si los días reales difieren del intervalo configurado, ajustar
-            if actual_days > 0 and actual_days != current_frequency:
-                logger.info(f'Ajustando frecuencia de "{plant_name}": {current_frequency} → {actual_days} días')
-                self.db.update_plant_frequency(plant_id, actual_days)
-                frequency_adjusted = True
-                adjustment_message = f'\n📊 Frecuencia ajustada: {current_frequency} → {actual_days} día(s)'
+        await self.scheduler.refresh_user(user_id)
         
-        # Registrar el riego
-        self.db.record_watering(plant_id)
+        actual_days = result['actual_days']
+        if result['frequency_adjusted']:
+            logger.info(f'Ajustando frecuencia de "{plant_name}": {result["previous_frequency"]} → {actual_days} días')
         
         # Mensaje de confirmación
         message = f'✅ ¡Riego registrado para "{plant_name}"!'
         if actual_days:
             message += f'\n⏱️ Han pasado {actual_days} día(s) desde el último riego'
-        if frequency_adjusted:
-            message += adjustment_message
+        if result['frequency_adjusted']:
+            message += f'\n📊 Frecuencia ajustada: {result["previous_frequency"]} → {actual_days} día(s)'
             message += f'\n💡 Próximo riego recomendado: en {actual_days} día(s)'
         else:
-            message += f'\n💡 Próximo riego recomendado: en {current_frequency} día(s)'
+            message += f'\n💡 Próximo riego recomendado: en {result["frequency"]} día(s)'
         
         await update.message.reply_text(
             message,
@@ -416,70 +406,128 @@ class PlantBot:
     
     async def watering_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        history = self.db.get_watering_history(user_id, limit=20)
+        plant_id = 0
+        if context.args:
+            plant_name = ' '.join(context.args)
+            plant = await self.db.get_plant_by_name(user_id, plant_name)
+            if not plant:
+                await update.message.reply_text(f'No encontré la planta "{plant_name}".')
+                return
+            plant_id = plant.id
         
-        if not history:
+        page = await self.db.get_watering_history_page(user_id, HISTORY_PAGE_SIZE, plant_id=plant_id or None)
+        if not page['rows']:
             await update.message.reply_text('📊 No hay historial de riegos aún.')
             return
         
+        message, reply_markup = self._history_page(page, plant_id)
+        await update.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
+    
+    @staticmethod
+    def _history_page(page: dict, plant_id: int):
+        """Texto de una página del historial y sus botones ◀ ▶. Cada botón lleva el cursor
+        (id y fecha del riego del borde) para pedir la página siguiente por índice."""
         message = '📊 *Historial de riegos:*\n\n'
-        for record in history:
-            plant_name, watered_at = record
-            if isinstance(watered_at, str):
-                date = datetime.fromisoformat(watered_at)
-            else:
-                date = watered_at
-            formatted_date = date.strftime('%d/%m/%Y %H:%M')
-            message += f'💧 {plant_name} - {formatted_date}\n'
-        
-        await update.message.reply_text(message, parse_mode='Markdown')
+        for watering in page['rows']:
+            message += f'💧 {watering.plant_name} - {watering.watered_at:%d/%m/%Y %H:%M}\n'
+        
+        buttons = []
+        if page['newer']:
+            watered_at, watering_id = page['newer']
+            buttons.append(InlineKeyboardButton(
+                '◀', callback_data=f'hist_n_{plant_id}_{watering_id}_{watered_at.isoformat()}'
+            ))
+        if page['older']:
+            watered_at, watering_id = page['older']
+            buttons.append(InlineKeyboardButton(
+                '▶', callback_data=f'hist_o_{plant_id}_{watering_id}_{watered_at.isoformat()}'
+            ))
+        return message, InlineKeyboardMarkup([buttons]) if buttons else None
     
     async def pending_plants(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        plants = self.db.get_user_plants(user_id)
-        
-        if not plants:
-            await update.message.reply_text('🌵 No tienes plantas registradas.')
-            return
-        
-        pending = []
-        for plant in plants:
-            plant_id, name, days, last_watered, plant_type = plant
-            
-            if not last_watered:
-                pending.append((name, -1))
-            else:
-                if isinstance(last_watered, str):
-                    last_date = datetime.fromisoformat(last_watered)
-                else:
-                    last_date = last_watered
-                next_water = last_date + timedelta(days=days)
-                days_until = (next_water - datetime.now()).days
-                
-                if days_until <= 0:
-                    pending.append((name, days_until))
+        pending = await self.db.get_due_plants(user_id)
         
         if not pending:
+            if not await self.db.get_user_plants(user_id):
+                await update.message.reply_text('🌵 No tienes plantas registradas.')
+                return
             await update.message.reply_text(
                 '✅ ¡Todas tus plantas están al día con el riego! 🌿'
             )
             return
         
         message = '⚠️ *Plantas que necesitan riego:*\n\n'
-        for name, days_overdue in sorted(pending, key=lambda x: x[1]):
-            if days_overdue == -1:
-                message += f'🌱 {name} - Nunca regada\n'
+        for plant in pending:
+            days_overdue = days_until(plant.next_due_at)
+            if not plant.last_watered_at:
+                message += f'🌱 {plant.name} - Nunca regada\n'
             elif days_overdue == 0:
-                message += f'🌱 {name} - Necesita riego hoy\n'
+                message += f'🌱 {plant.name} - Necesita riego hoy\n'
             else:
-                message += f'🌱 {name} - Hace {abs(days_overdue)} día(s)\n'
+                message += f'🌱 {plant.name} - Hace {abs(days_overdue)} día(s)\n'
         
         message += '\nUsa /regar para registrar un riego.'
-        await update.message.reply_text(message, parse_mode='Markdown')
+        keyboard = [[InlineKeyboardButton(f'💧 Regar todas ({len(pending)})', callback_data='water_pending')]]
+        await update.message.reply_text(
+            message,
+            parse_mode='Markdown',
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    async def water_group(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        groups = await self.db.get_user_groups(user_id)
+        
+        if not groups:
+            await update.message.reply_text(
+                '📍 No tienes grupos creados.\n'
+                'Usa /crear_grupo para crear uno.'
+            )
+            return
+        
+        if context.args:
+            name = ' '.join(context.args)
+            group = next((g for g in groups if g.name.lower() == name.lower()), None)
+            if not group:
+                await update.message.reply_text(f'No encontré el grupo "{name}".')
+                return
+            await update.message.reply_text(await self._water_group_plants(user_id, group.id, group.name))
+            return
+        
+        keyboard = [
+            [InlineKeyboardButton(f'📦 {name} ({plant_count})', callback_data=f'water_group_{group_id}')]
+            for group_id, name, plant_count in groups
+        ]
+        await update.message.reply_text(
+            '💧 ¿Qué grupo regaste?',
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    async def _water_group_plants(self, user_id: int, group_id: int, group_name: str) -> str:
+        plants = await self.db.get_plants_by_group(group_id)
+        if not plants:
+            return f'📦 El grupo "{group_name}" no tiene plantas.'
+        return await self._water_many(user_id, [plant.id for plant in plants], f'del grupo "{group_name}"')
+    
+    async def _water_many(self, user_id: int, plant_ids, label: str) -> str:
+        """Registra el riego de varias plantas con una sola operación y devuelve el resumen"""
+        results = await self.db.record_waterings(plant_ids, user_id=user_id)
+        if not results:
+            return 'No hay plantas que regar.'
+        await self.scheduler.refresh_user(user_id)
+        
+        message = f'✅ ¡Riego registrado para {len(results)} planta(s) {label}!\n\n'
+        for result in sorted(results, key=lambda r: r['name']):
+            message += f'💧 {result["name"]}'
+            if result['frequency_adjusted']:
+                message += f' (frecuencia {result["previous_frequency"]} → {result["frequency"]} día(s))'
+            message += '\n'
+        return message
     
     async def add_photo_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        plants = self.db.get_user_plants(user_id)
+        plants = await self.db.get_user_plants(user_id)
         
         if not plants:
             await update.message.reply_text(
@@ -488,7 +536,7 @@ class PlantBot:
             )
             return ConversationHandler.END
         
-        keyboard = [[plant[1]] for plant in plants]
+        keyboard = [[plant.name] for plant in plants]
         keyboard.append(['Cancelar'])
         
         await update.message.reply_text(
@@ -508,7 +556,7 @@ class PlantBot:
         user_id = update.effective_user.id
         plant_name = update.message.text
         
-        plant = self.db.get_plant_by_name(user_id, plant_name)
+        plant = await self.db.get_plant_by_name(user_id, plant_name)
         if not plant:
             await update.message.reply_text(
                 'No encontré esa planta.',
@@ -516,7 +564,7 @@ class PlantBot:
             )
             return ConversationHandler.END
         
-        context.user_data['photo_plant_id'] = plant[0]
+        context.user_data['photo_plant_id'] = plant.id
         context.user_data['photo_plant_name'] = plant_name
         
         await update.message.reply_text(
@@ -539,7 +587,7 @@ class PlantBot:
         file_id = photo.file_id
         caption = update.message.caption
         
-        self.db.add_plant_photo(plant_id, file_id, caption)
+        await self.db.add_plant_photo(plant_id, file_id, caption)
         
         await update.message.reply_text(
             f'✅ ¡Foto agregada a "{plant_name}"!\n'
@@ -550,18 +598,16 @@ class PlantBot:
     
     async def view_photos(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        plants = self.db.get_user_plants(user_id)
+        plants = await self.db.get_user_plants(user_id)
         
         if not plants:
             await update.message.reply_text('🌵 No tienes plantas registradas.')
             return
         
-        keyboard = []
-        for plant in plants:
-            plant_id, name, _, _, _ = plant
-            photos = self.db.get_plant_photos(plant_id)
-            if photos:
-                keyboard.append([InlineKeyboardButton(f"📸 {name} ({len(photos)} fotos)", callback_data=f"photos_{plant_id}")])
+        keyboard = [
+            [InlineKeyboardButton(f"📸 {name} ({photo_count} fotos)", callback_data=f"photos_{plant_id}")]
+            for plant_id, name, photo_count in await self.db.get_photo_counts(user_id)
+        ]
         
         if not keyboard:
             await update.message.reply_text(
@@ -589,7 +635,7 @@ class PlantBot:
         group_name = update.message.text
         user_id = update.effective_user.id
         
-        self.db.create_group(user_id, group_name)
+        await self.db.create_group(user_id, group_name)
         
         await update.message.reply_text(
             f'✅ Grupo "{group_name}" creado!\n'
@@ -601,7 +647,7 @@ class PlantBot:
     
     async def list_groups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        groups = self.db.get_user_groups(user_id)
+        groups = await self.db.get_user_groups(user_id)
         
         if not groups:
             await update.message.reply_text(
@@ -612,14 +658,13 @@ class PlantBot:
         
         message = '📍 *Tus grupos:*\n\n'
         for group in groups:
-            group_id, name, plant_count = group
-            message += f'📦 *{name}* - {plant_count} planta(s)\n'
+            message += f'📦 *{group.name}* - {group.plant_count} planta(s)\n'
         
         await update.message.reply_text(message, parse_mode='Markdown')
     
     async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        stats = self.db.get_watering_stats(user_id)
+        stats = await self.db.get_watering_stats(user_id)
         
         message = '📊 *Tus estadísticas:*\n\n'
         message += f'🌱 Total de plantas: *{stats["total_plants"]}*\n'
@@ -637,21 +682,45 @@ class PlantBot:
     
     async def toggle_notifications(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        settings = self.db.get_user_settings(user_id)
+        settings = await self.db.get_user_settings(user_id)
         
         if settings:
-            enabled, time = settings
+            enabled, time, timezone = settings
             new_state = not enabled
         else:
             new_state = True
-            time = '09:00'
+            time, timezone = '09:00', 'UTC'
+        
+        # /notificaciones HH:MM [Zona/Horaria] activa los recordatorios a esa hora
+        if context.args:
+            try:
+                time = parse_notification_time(context.args[0]).strftime('%H:%M')
+            except ValueError:
+                await update.message.reply_text(
+                    'Formato de hora no válido. Ejemplo:\n'
+                    '/notificaciones 08:30 Europe/Madrid'
+                )
+                return
+            if len(context.args) > 1:
+                timezone = context.args[1]
+                try:
+                    ZoneInfo(timezone)
+                except (ZoneInfoNotFoundError, ValueError):
+                    await update.message.reply_text(
+                        f'No conozco la zona horaria "{timezone}".\n'
+                        'Usa un nombre como Europe/Madrid o America/Mexico_City.'
+                    )
+                    return
+            new_state = True
         
-        self.db.update_notification_settings(user_id, new_state, time)
+        await self.db.update_notification_settings(user_id, new_state, time, timezone)
+        await self.scheduler.refresh_user(user_id)
         
         if new_state:
             await update.message.reply_text(
                 f'🔔 Notificaciones activadas!\n'
-                f'Recibirás recordatorios a las {time} cuando tus plantas necesiten riego.'
+                f'Recibirás recordatorios a las {time} ({timezone}) cuando tus plantas necesiten riego.\n'
+                'Para cambiar la hora: /notificaciones 08:30 Europe/Madrid'
             )
         else:
             await update.message.reply_text(
@@ -662,26 +731,77 @@ class PlantBot:
         query = update.callback_query
         await query.answer()
         
-        if query.data.startswith('photos_'):
-            plant_id = int(query.data.split('_')[1])
-            photos = self.db.get_plant_photos(plant_id)
-            
-            for photo in photos[:5]:
-                _, file_id, caption, uploaded_at = photo
-                if isinstance(uploaded_at, str):
-                    date = datetime.fromisoformat(uploaded_at).strftime('%d/%m/%Y')
-                else:
-                    date = uploaded_at.strftime('%d/%m/%Y')
-                caption_text = f"📅 {date}\n{caption}" if caption else f"📅 {date}"
-                
-                await query.message.reply_photo(
-                    photo=file_id,
-                    caption=caption_text
-                )
+        if query.data == 'water_pending':
+            user_id = update.effective_user.id
+            pending = await self.db.get_due_plants(user_id)
+            message = await self._water_many(user_id, [plant.id for plant in pending], 'pendientes')
+            await query.edit_message_reply_markup(reply_markup=None)
+            await query.message.reply_text(message)
+        
+        elif query.data.startswith('water_group_'):
+            user_id = update.effective_user.id
+            group_id = int(query.data.split('_')[2])
+            groups = {group.id: group.name for group in await self.db.get_user_groups(user_id)}
+            if group_id in groups:
+                await query.edit_message_text(await self._water_group_plants(user_id, group_id, groups[group_id]))
+        
+        elif query.data.startswith('hist_'):
+            user_id = update.effective_user.id
+            _, direction, plant_id, watering_id, watered_at = query.data.split('_', 4)
+            plant_id = int(plant_id)
+            cursor = (datetime.fromisoformat(watered_at), int(watering_id))
+            page = await self.db.get_watering_history_page(
+                user_id, HISTORY_PAGE_SIZE, plant_id=plant_id or None,
+                before=cursor if direction == 'o' else None,
+                after=cursor if direction == 'n' else None,
+            )
+            if page['rows']:
+                message, reply_markup = self._history_page(page, plant_id)
+                await query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
+            else:
+                await query.edit_message_reply_markup(reply_markup=None)
+        
+        elif query.data.startswith('photos_'):
+            # photos_<planta>[_<desplazamiento>]
+            parts = query.data.split('_')
+            plant_id = int(parts[1])
+            offset = int(parts[2]) if len(parts) > 2 else 0
+            await self._send_photo_page(query.message, plant_id, offset)
+    
+    async def _send_photo_page(self, message, plant_id: int, offset: int):
+        """Envía una página de fotos como un solo álbum y, si hay más, un mensaje con ◀ ▶"""
+        photos = await self.db.get_plant_photos(plant_id, limit=PHOTO_PAGE_SIZE + 1, offset=offset)
+        has_more = len(photos) > PHOTO_PAGE_SIZE
+        photos = photos[:PHOTO_PAGE_SIZE]
+        if not photos:
+            return
+        
+        media = []
+        for photo in photos:
+            date = photo.uploaded_at.strftime('%d/%m/%Y')
+            caption_text = f"📅 {date}\n{photo.caption}" if photo.caption else f"📅 {date}"
+            media.append(InputMediaPhoto(media=photo.file_id, caption=caption_text))
+        
+        # Un álbum necesita al menos dos fotos
+        if len(media) == 1:
+            await message.reply_photo(photo=media[0].media, caption=media[0].caption)
+        else:
+            await message.reply_media_group(media=media)
+        
+        buttons = []
+        if offset:
+            buttons.append(InlineKeyboardButton('◀', callback_data=f'photos_{plant_id}_{max(offset - PHOTO_PAGE_SIZE, 0)}'))
+        if has_more:
+            buttons.append(InlineKeyboardButton('▶', callback_data=f'photos_{plant_id}_{offset + PHOTO_PAGE_SIZE}'))
+        if buttons:
+            await message.reply_text(
+                f'📸 Fotos {offset + 1}–{offset + len(photos)}',
+                reply_markup=InlineKeyboardMarkup([buttons])
+            )
     
     async def delete_plant(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        plants = self.db.get_user_plants(user_id)
+        plants = await self.db.get_user_plants(user_id)
         
         if not plants:
             await update.message.reply_text('🌵 No tienes plantas para eliminar.')
@@ -689,7 +809,7 @@ class PlantBot:
         
         message = '🗑️ Para eliminar una planta, usa:\n/eliminar <nombre>\n\n*Tus plantas:*\n'
         for plant in plants:
-            message += f'• {plant[1]}\n'
+            message += f'• {plant.name}\n'
         
         args = context.args
         if not args:
@@ -697,13 +817,14 @@ class PlantBot:
             return
         
         plant_name = ' '.join(args)
-        plant = self.db.get_plant_by_name(user_id, plant_name)
+        plant = await self.db.get_plant_by_name(user_id, plant_name)
         
         if not plant:
             await update.message.reply_text(f'No encontré la planta "{plant_name}".')
             return
         
-        self.db.delete_plant(plant[0])
+        await self.db.delete_plant(plant.id)
+        await self.scheduler.refresh_user(user_id)
         await update.message.reply_text(f'✅ Planta "{plant_name}" eliminada.')
     
     
@@ -715,51 +836,50 @@ class PlantBot:
         context.user_data.clear()
         return ConversationHandler.END
     
+    async def send_reminder(self, user_id: int, plants) -> asyncio.Task:
+        message = '🔔 *Recordatorio de riego:*\n\n'
+        message += 'Las siguientes plantas necesitan riego:\n'
+        for plant in plants:
+            message += f'💧 {plant.name}\n'
+        message += '\nUsa /regar para registrar el riego.'
+        
+        return await self.notifier.submit(user_id, message, parse_mode='Markdown')
+    
+    async def _on_shards_changed(self, shards):
+        self.scheduler.set_shards(self.leases.shard_count, shards)
+    
     async def send_notifications(self):
+        # Sin shards concedidos no se avisa a nadie hasta la primera vuelta de concesiones
+        self.scheduler.set_shards(self.leases.shard_count, ())
+        # Los cambios de otros procesos también mueven los recordatorios de esta instancia
+        loop = asyncio.get_running_loop()
+        self.db.sync.add_change_callback(
+            lambda scope, user_id: loop.call_soon_threadsafe(self.scheduler.notify_change, user_id)
+        )
+        lease_task = asyncio.create_task(self.leases.run())
+        try:
+            while True:
+                try:
+                    await self.scheduler.run()
+                except Exception as e:
+                    logger.error(f'Error in notification loop: {e}')
+                    await asyncio.sleep(60)
+        finally:
+            lease_task.cancel()
+            await self.leases.release()
+    
+    async def maintain_database(self):
+        interval = float(os.getenv('SQLITE_MAINTENANCE_INTERVAL', 3600))
         while True:
+            await asyncio.sleep(interval)
             try:
-                await asyncio.sleep(3600)
-                
-                users = self.db.get_all_users_for_notifications()
-                
-                for user_id in users:
-                    plants = self.db.get_user_plants(user_id)
-                    pending = []
-                    
-                    for plant in plants:
-                        plant_id, name, days, last_watered, plant_type = plant
-                        
-                        if not last_watered:
-                            pending.append(name)
-                        else:
-                            if isinstance(last_watered, str):
-                                last_date = datetime.fromisoformat(last_watered)
-                            else:
-                                last_date = last_watered
-                            next_water = last_date + timedelta(days=days)
-                            days_until = (next_water - datetime.now()).days
-                            
-                            if days_until <= 0:
-                                pending.append(name)
-                    
-                    if pending:
-                        message = '🔔 *Recordatorio de riego:*\n\n'
-                        message += 'Las siguientes plantas necesitan riego:\n'
-                        for name in pending:
-                            message += f'💧 {name}\n'
-                        message += '\nUsa /regar para registrar el riego.'
-                        
-                        try:
-                            await self.application.bot.send_message(
-                                chat_id=user_id,
-                                text=message,
-                                parse_mode='Markdown'
-                            )
-                        except Exception as e:
-                            logger.error(f'Error sending notification to {user_id}: {e}')
-                
+                await self.db.maintain()
             except Exception as e:
-                logger.error(f'Error in notification loop: {e}')
+                logger.error(f'Error en el mantenimiento de la base de datos: {e}')
+    
+    def start_change_listener(self):
+        if self.db.publish_changes:
+            self.change_listener.start()
     
     def run(self):
         logger.info('='*60)
@@ -777,9 +897,16 @@ class PlantBot:
             loop.run_until_complete(self.setup_commands())
             logger.info('✓ Comandos del bot configurados exitosamente')
             
-            logger.info('Iniciando tarea de notificaciones...')
-            self.notification_task = loop.create_task(self.send_notifications())
-            logger.info('✓ Tarea de notificaciones iniciada')
+            self.start_change_listener()
+            if not self.db.sync.use_postgres:
+                loop.create_task(self.maintain_database())
+            
+            if os.getenv('BOT_NOTIFICATIONS', '1') != '0':
+                logger.info('Iniciando tarea de notificaciones...')
+                self.notification_task = loop.create_task(self.send_notifications())
+                logger.info('✓ Tarea de notificaciones iniciada')
+            else:
+                logger.info('Notificaciones delegadas en notification_worker.py')
             
             logger.info('='*60)
             logger.info('BOT LISTO Y ESPERANDO MENSAJES')
@@ -825,7 +952,9 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             'uptime_seconds': int(uptime_seconds),
             'uptime_minutes': round(uptime_seconds / 60, 1),
             'last_message': HealthCheckHandler.last_message_time.isoformat() if HealthCheckHandler.last_message_time else 'none',
-            'database': 'connected' if HealthCheckHandler.bot_instance else 'unknown'
+            'database': 'connected' if HealthCheckHandler.bot_instance else 'unknown',
+            'db_pool': HealthCheckHandler.bot_instance.db.sync.pool_stats() if HealthCheckHandler.bot_instance else None,
+            'plant_cache': HealthCheckHandler.bot_instance.db.sync.cache_stats() if HealthCheckHandler.bot_instance else None
         }
         self.wfile.write(json.dumps(response).encode())
         
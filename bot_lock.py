@@ -1,5 +1,7 @@
 import os
 import time
+import socket
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,3 +41,74 @@ class BotLock:
                 logger.info(f'Lock liberado para PID {self.pid}')
         except Exception as e:
             logger.error(f'Error liberando lock: {e}')
+
+
+class ShardLeaseManager:
+    """Reparte los shards de notificaciones (`user_id % shard_count`) entre las
+    instancias vivas mediante concesiones con caducidad guardadas en la BD.
+
+    Cada instancia renueva su latido y sus concesiones cada `ttl / 3` segundos.
+    El reparto es equitativo según el orden de los ids de los workers vivos: al
+    entrar uno nuevo los demás sueltan los shards que les sobran, y si uno muere
+    sus concesiones caducan y los demás las recogen en la siguiente vuelta.
+    """
+
+    def __init__(self, db, shard_count: int = None, ttl: float = None, owner: str = None, on_change=None):
+        self.db = db
+        self.shard_count = shard_count or int(os.getenv('NOTIFICATION_SHARDS', 1))
+        self.ttl = ttl or float(os.getenv('SHARD_LEASE_TTL', 30))
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self.on_change = on_change
+        self.owned = frozenset()
+
+    def _target(self, workers) -> int:
+        workers = sorted(set(workers) | {self.owner})
+        quota, extra = divmod(self.shard_count, len(workers))
+        return quota + (1 if workers.index(self.owner) < extra else 0)
+
+    async def sync(self) -> frozenset:
+        """Una vuelta del protocolo: latido, renovación, cesión de sobrantes y toma de libres"""
+        workers = await self.db.heartbeat_worker(self.owner, self.ttl)
+        target = self._target(workers)
+        holders = {shard: owner for shard, owner, _ in await self.db.get_shard_leases()}
+
+        mine = sorted(shard for shard, owner in holders.items() if owner == self.owner and shard < self.shard_count)
+        surplus = mine[target:]
+        if surplus:
+            await self.db.release_shard_leases(self.owner, surplus)
+
+        owned = set()
+        for shard in mine[:target]:
+            if await self.db.acquire_shard_lease(shard, self.owner, self.ttl):
+                owned.add(shard)
+        for shard in range(self.shard_count):
+            if len(owned) >= target:
+                break
+            if shard not in holders and await self.db.acquire_shard_lease(shard, self.owner, self.ttl):
+                owned.add(shard)
+
+        owned = frozenset(owned)
+        if owned != self.owned:
+            logger.info(
+                f'Shards de notificaciones de {self.owner}: {sorted(owned)} de {self.shard_count} '
+                f'({len(workers)} workers vivos)'
+            )
+            self.owned = owned
+            if self.on_change is not None:
+                await self.on_change(owned)
+        return owned
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f'Error renovando concesiones de shards: {e}')
+            await asyncio.sleep(self.ttl / 3)
+
+    async def release(self):
+        try:
+            await self.db.release_shard_leases(self.owner)
+        except Exception as e:
+            logger.error(f'Error liberando concesiones de shards: {e}')
+        self.owned = frozenset()
@@ -0,0 +1,106 @@
+"""
+Escucha los cambios hechos por otros procesos y vacía las entradas afectadas de la caché local
+"""
+import logging
+import os
+import select
+import threading
+from datetime import datetime
+
+from database import CHANGE_LOG_RETENTION, CHANGES_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+CHANGE_BATCH_SIZE = 1000
+
+
+class ChangeListener:
+    """Hilo en segundo plano que aplica a `db` los cambios anunciados por otros procesos.
+
+    En PostgreSQL abre una conexión propia fuera del pool con LISTEN sobre
+    CHANGES_CHANNEL (con pgbouncer en modo transacción LISTEN no funciona: usa
+    CACHE_LISTEN_URL para apuntar al puerto de sesión). En SQLite sondea
+    change_log cada `poll_interval` segundos. Si se pierde la conexión se
+    vacían las cachés, porque pudo perderse algún aviso mientras tanto.
+    """
+
+    def __init__(self, db, poll_interval: float = None):
+        self.db = db
+        self.poll_interval = poll_interval or float(os.getenv('CACHE_POLL_INTERVAL', 5))
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'events': 0, 'reconnects': 0}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        target = self._listen_postgres if self.db.use_postgres else self._poll_sqlite
+        self._thread = threading.Thread(target=target, name='change-listener', daemon=True)
+        self._thread.start()
+        logger.info('Escucha de cambios de otros procesos iniciada')
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _apply(self, origin: str, scope: str, target: str):
+        self.stats['events'] += 1
+        self.db.apply_change(origin, scope, target)
+
+    def _listen_postgres(self):
+        url = os.getenv('CACHE_LISTEN_URL') or self.db.database_url
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.db.psycopg2.connect(url)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f'LISTEN {CHANGES_CHANNEL}')
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            origin, scope, target = notify.payload.split(':')
+                        except ValueError:
+                            logger.warning(f'Aviso de cambio con formato desconocido: {notify.payload}')
+                            continue
+                        self._apply(origin, scope, target)
+            except Exception as e:
+                logger.error(f'Error escuchando cambios en PostgreSQL: {e}')
+                self.stats['reconnects'] += 1
+                self.db.clear_caches()
+                self._stop.wait(self.poll_interval)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _poll_sqlite(self):
+        last_id = None
+        last_purge = datetime.now()
+        while not self._stop.is_set():
+            try:
+                if last_id is None:
+                    last_id = self.db.get_change_cursor()
+                while True:
+                    changes = self.db.get_changes_since(last_id, CHANGE_BATCH_SIZE)
+                    for change_id, origin, scope, target in changes:
+                        self._apply(origin, scope, target)
+                        last_id = change_id
+                    if len(changes) < CHANGE_BATCH_SIZE:
+                        break
+                if datetime.now() - last_purge > CHANGE_LOG_RETENTION:
+                    self.db.purge_change_log(datetime.now() - CHANGE_LOG_RETENTION)
+                    last_purge = datetime.now()
+            except Exception as e:
+                logger.error(f'Error sondeando change_log: {e}')
+                self.stats['reconnects'] += 1
+                self.db.clear_caches()
+            self._stop.wait(self.poll_interval)
@@ -0,0 +1,342 @@
+"""
+Comprueba los planes de todas las sentencias del backend sobre un conjunto de datos
+sembrado: falla si alguna recorre una tabla entera o necesita ordenar en un B-tree temporal,
+o si hay una sentencia sin caso en build_cases (p. ej. una consulta nueva).
+
+Uso:
+  python check_query_plans.py                      # SQLite en un fichero temporal
+  DATABASE_URL=... python check_query_plans.py     # PostgreSQL (todo dentro de una transacción que se deshace)
+  python -m pytest                                 # lo mismo desde tests/test_query_plans.py
+
+En PostgreSQL se desactivan enable_seqscan y enable_sort: con pocas filas el planificador
+prefiere un Seq Scan aunque haya índice, así solo aparecen cuando no hay alternativa.
+Sale con código 1 si algún plan no es aceptable.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from database import Database
+
+# Consultas en las que un recorrido completo o una ordenación es inherente y está acotada.
+# Clave: nombre del caso; valor: motivo
+ALLOWED = {
+    'BUSIEST_WEEKDAY': 'agrupa por una expresión del día; acotado a los días activos del usuario',
+    'RECOUNT_USER_STATS': 'DISTINCT sobre una expresión; solo al reconstruir, borrar una planta o deshacer un riego',
+    'RECENT_NOTIFICATIONS': 'solo en cada reconstrucción; el registro se purga y se queda pequeño',
+    'GET_PHOTO_COUNTS': 'PostgreSQL agrupa por la clave primaria y luego ordena por nombre; '
+                        'solo las plantas con fotos de un usuario',
+    'DUE_PLANTS': 'todas las plantas vencidas de todos los usuarios; los recordatorios usan DUE_PLANTS_BY_USER',
+    'DUE_PLANTS_NOTIFIABLE': 'todas las plantas vencidas de todos los usuarios; los recordatorios usan DUE_PLANTS_BY_USER',
+    'REBUILD_USER_STATS': 'los mismos recuentos que RECOUNT_USER_STATS, de un solo usuario',
+    'REBUILD_WATERING_DAILY': 'agrupa por el día de cada riego; un usuario, solo al reconstruir watering_daily',
+    'WATERING_DAILY_FROM_LOG': 'agrupa por el día de cada riego; un usuario, solo en user_stats.py --check',
+    'BACKFILL_WATERING_DAILY': 'agrupa por el día de cada riego; un lote de plantas, solo al migrar',
+    'STATS_USERS': 'recorre todos los usuarios a propósito (user_stats.py)',
+    'SCHEMA_VERSION': 'schema_version tiene una sola fila',
+    'INIT_SCHEMA_VERSION': 'schema_version tiene una sola fila',
+    'SET_SCHEMA_VERSION': 'schema_version tiene una sola fila',
+    'LIVE_WORKERS': 'una fila por proceso de envío vivo',
+    'PURGE_WORKERS': 'una fila por proceso de envío vivo',
+    'SHARD_LEASES': 'una fila por shard (NOTIFICATION_SHARDS)',
+    'RELEASE_ALL_SHARDS': 'una fila por shard (NOTIFICATION_SHARDS)',
+}
+
+# Sentencias sin plan de consulta que comprobar. Clave: nombre; valor: motivo
+NO_PLAN = {
+    'CREATE_SCHEMA_VERSION': 'DDL',
+}
+
+
+def build_cases(backend, sample: dict) -> dict:
+    """Parámetros de ejemplo de cada sentencia del backend, por nombre"""
+    now = datetime.now()
+    ts = backend.timestamp
+    user_id, plant_id, group_id = sample['user_id'], sample['plant_id'], sample['group_id']
+    user_ids = backend.id_list(sample['user_ids'])
+    plant_ids = backend.id_list([plant_id])
+    today = now.date().isoformat()
+    tomorrow = ts(now + timedelta(days=1))
+    # cursor (fecha, id) y desde/hasta
+    history = (ts(now - timedelta(days=30)), 1, ts(now - timedelta(days=365)))
+    id_range = (plant_id - 1, plant_id + 100)
+
+    def batch(*row):
+        # En PostgreSQL los lotes van por execute_values (VALUES %s): una tupla es una fila
+        return (row,) if backend.name == 'postgres' else row
+
+    cases = {
+        'GET_USER_PLANTS': (user_id,),
+        'GET_PLANT_BY_NAME': (user_id, sample['plant_name']),
+        'GET_PLANT_OWNER': (plant_id,),
+        'GET_PLANTS_NEEDING_WATER': (user_id,),
+        'INSERT_PLANT': (user_id, 'Nueva', 3, 'moderada', ts(now), ts(now)),
+        'DELETE_PLANT': (plant_id,),
+        'UPDATE_PLANT_FREQUENCY': (5, plant_id),
+        'RECOMPUTE_NEXT_DUE': (plant_id,),
+        'SET_PLANT_GROUP': (group_id, plant_id),
+        'SET_PLANT_PHOTO': ('file', plant_id),
+        'LOCK_PLANT_BY_NAME': (user_id, sample['plant_name']),
+        'LOCK_PLANT_BY_ID': (user_id, plant_id),
+        'LOCK_PLANTS': (plant_ids,),
+        'LOCK_USER_PLANTS': (plant_ids, user_id),
+        'INSERT_WATERING': (plant_id, user_id, ts(now)),
+        'INSERT_WATERINGS': batch(plant_id, user_id, ts(now)),
+        'APPLY_WATERING': (3, ts(now), ts(now), plant_id),
+        'APPLY_WATERINGS': batch(3, ts(now), ts(now), plant_id),
+        'UPDATE_WATERING_SUMMARY': (ts(now), ts(now), plant_id),
+        'LAST_WATERING': (plant_id,),
+        'DELETE_WATERING': (1,),
+        'DELETE_PLANT_WATERINGS': (plant_id,),
+        'UNDO_WATERING_SUMMARY': (plant_id, plant_id),
+        'HISTORY_OLDER': (user_id,) + history + (21,),
+        'HISTORY_NEWER': (user_id,) + history + (21,),
+        'HISTORY_OLDER_FOR_PLANT': (plant_id, user_id) + history + (21,),
+        'HISTORY_NEWER_FOR_PLANT': (plant_id, user_id) + history + (21,),
+        'DUE_PLANTS': (tomorrow,),
+        'DUE_PLANTS_FOR_USER': (tomorrow, user_id),
+        'DUE_PLANTS_NOTIFIABLE': (tomorrow,),
+        'DUE_PLANTS_NOTIFIABLE_FOR_USER': (tomorrow, user_id),
+        'NEXT_DUE_FOR_USER': (user_id,),
+        'NEXT_DUE_FOR_USERS': (user_ids,),
+        'NEXT_DUE_BY_USER': (),
+        'NEXT_DUE_FOR_SHARDS': (4, backend.id_list([1])),
+        'DUE_PLANTS_BY_USER': (tomorrow,),
+        'DUE_PLANTS_BY_USERS': (tomorrow, user_ids),
+        'INSERT_PHOTO': (plant_id, 'file', None, ts(now)),
+        'GET_PLANT_PHOTOS': (plant_id,),
+        'GET_PLANT_PHOTOS_PAGE': (plant_id, 11, 10),
+        'GET_PHOTO_COUNTS': (user_id,),
+        'INSERT_GROUP': (user_id, 'Grupo nuevo', ts(now)),
+        'GET_USER_GROUPS': (user_id,),
+        'GET_PLANTS_BY_GROUP': (group_id,),
+        'GET_USER_SETTINGS': (user_id,),
+        'UPSERT_NOTIFICATION_SETTINGS': (user_id, 1, '09:00', 'UTC', 'UTC'),
+        'CLAIM_NOTIFICATION': (user_id, today, 'hash', ts(now)),
+        'RELEASE_NOTIFICATION': (user_id, today, 'hash'),
+        'RECENT_NOTIFICATIONS': (ts(now - timedelta(hours=1)),),
+        'PURGE_NOTIFICATION_LOG': (ts(now - timedelta(days=30)),),
+        'NOTIFIABLE_USERS': (),
+        'HEARTBEAT_WORKER': ('worker', ts(now)),
+        'LIVE_WORKERS': (),
+        'PURGE_WORKERS': (ts(now),),
+        'REMOVE_WORKER': ('worker',),
+        'ACQUIRE_SHARD_LEASE': (1, 'worker', ts(now), ts(now)),
+        'SHARD_LEASES': (ts(now),),
+        'RELEASE_SHARDS': ('worker', backend.id_list([1])),
+        'RELEASE_ALL_SHARDS': ('worker',),
+        'GET_USER_STATS': (user_id,),
+        'BUMP_USER_PLANTS': (user_id, plant_id),
+        'BUMP_USER_WATERINGS': (today, plant_id),
+        'RECOUNT_USER_STATS': (user_id,),
+        'REBUILD_USER_STATS': (user_id,),
+        'STORED_USER_STATS': (user_id,),
+        'STATS_USERS': (),
+        'PLANT_COUNTS': (user_id,),
+        'REBUILD_PLANT_COUNTS': (user_id,),
+        'BUMP_WATERING_DAILY': (today, plant_id),
+        'UNDO_WATERING_DAILY': (user_id, plant_id, 1),
+        'PURGE_EMPTY_WATERING_DAILY': (user_id, plant_id),
+        'DELETE_PLANT_WATERING_DAILY': (user_id, plant_id),
+        'DELETE_USER_WATERING_DAILY': (user_id,),
+        'REBUILD_WATERING_DAILY': (user_id,),
+        'WATERING_DAILY_FROM_LOG': (user_id,),
+        'WATERING_DAILY_FOR_USER': (user_id,),
+        'DAILY_WATERINGS_SINCE': (user_id, (now - timedelta(days=364)).date().isoformat()),
+        'ACTIVE_DAYS': (user_id,),
+        'BUSIEST_WEEKDAY': (user_id,),
+        'BACKFILL_WATERING_SUMMARY': id_range,
+        'BACKFILL_NEXT_DUE': id_range,
+        'BACKFILL_WATERING_USER': id_range,
+        'BACKFILL_WATERING_DAILY': id_range,
+        'SCHEMA_VERSION': (),
+        'INIT_SCHEMA_VERSION': (),
+        'SET_SCHEMA_VERSION': (11, 11),
+        # Solo SQLite
+        'INSERT_CHANGE': ('origen', 'plants', str(user_id), ts(now)),
+        'CHANGE_CURSOR': (),
+        'CHANGES_SINCE': (1, 1000),
+        'PURGE_CHANGE_LOG': (ts(now - timedelta(hours=1)),),
+        # Solo PostgreSQL
+        'COLUMN_EXISTS': ('plants', 'next_due_at'),
+        'NOTIFY_CHANGE': ('canal', 'origen:plants:1'),
+        'LOCK_SCHEMA': (1,),
+        'UNLOCK_SCHEMA': (1,),
+    }
+    return cases
+
+
+def insert_rows(backend, cursor, table: str, columns: tuple, rows: list):
+    if backend.name == 'postgres':
+        statement = f'INSERT INTO {table} ({", ".join(columns)}) VALUES %s'
+    else:
+        statement = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    backend.execute_batch(cursor, statement, rows)
+
+
+def seed(backend, cursor, users: int, plants_per_user: int, waterings_per_plant: int) -> dict:
+    """Siembra usuarios con plantas, riegos, fotos y grupos; devuelve valores de ejemplo"""
+    rng = random.Random(42)
+    now = datetime.now()
+    ts = backend.timestamp
+    plants, waterings, photos, groups, settings, notifications = [], [], [], [], [], []
+    plant_id = group_id = 0
+    base = 10 ** 9  # ids propios para no chocar con datos que ya hubiera
+    for user in range(1, users + 1):
+        user_id = base + user
+        settings.append((user_id, 1 if user % 5 else 0, '09:00', 'UTC'))
+        notifications.append((user_id, 'bucket', f'hash{user}', ts(now - timedelta(hours=rng.randint(0, 72)))))
+        user_groups = []
+        for g in range(2):
+            group_id += 1
+            user_groups.append(base + group_id)
+            groups.append((base + group_id, user_id, f'Grupo {g}'))
+        for p in range(plants_per_user):
+            plant_id += 1
+            frequency = rng.randint(1, 14)
+            last = now - timedelta(days=rng.randint(0, 20))
+            plants.append((
+                base + plant_id, user_id, f'Planta {p}', frequency, ts(last), waterings_per_plant,
+                ts(last + timedelta(days=frequency)), rng.choice(user_groups)
+            ))
+            for w in range(waterings_per_plant):
+                waterings.append((base + plant_id, user_id, ts(last - timedelta(days=w * frequency))))
+            photos.append((base + plant_id, f'file{plant_id}', None, ts(last)))
+
+    insert_rows(backend, cursor, 'plants', (
+        'id', 'user_id', 'name', 'watering_frequency_days', 'last_watered_at', 'watering_count',
+        'next_due_at', 'group_id'
+    ), plants)
+    insert_rows(backend, cursor, 'watering_log', ('plant_id', 'user_id', 'watered_at'), waterings)
+    insert_rows(backend, cursor, 'plant_photos', ('plant_id', 'file_id', 'caption', 'uploaded_at'), photos)
+    insert_rows(backend, cursor, 'plant_groups', ('id', 'user_id', 'name'), groups)
+    insert_rows(backend, cursor, 'user_settings', ('user_id', 'notifications_enabled', 'notification_time', 'timezone'),
+                settings)
+    insert_rows(backend, cursor, 'notification_log', ('user_id', 'due_bucket', 'plant_hash', 'sent_at'), notifications)
+    cursor.execute(backend.BACKFILL_WATERING_DAILY, (base, base + plant_id))
+    cursor.execute('ANALYZE')
+    return {
+        'user_id': base + 1,
+        'user_ids': [base + 1, base + 2, base + 3],
+        'plant_id': base + 1,
+        'plant_name': 'Planta 0',
+        'group_id': base + 1,
+    }
+
+
+def sqlite_problems(cursor, statement: str, params) -> tuple:
+    cursor.execute(f'EXPLAIN QUERY PLAN {statement}', params)
+    details = [row[-1] for row in cursor.fetchall()]
+    problems = []
+    for detail in details:
+        # SCAN sin SEARCH es un recorrido completo (también de un índice); json_each es la lista de ids
+        if detail.startswith('SCAN ') and 'json_each' not in detail and 'CONSTANT ROW' not in detail:
+            problems.append(detail)
+        elif 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return details, problems
+
+
+def postgres_problems(cursor, statement: str, params) -> tuple:
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {statement}', params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    details, problems = [], []
+
+    def walk(node, depth=0):
+        relation = node.get('Relation Name') or node.get('Index Name') or ''
+        line = f'{"  " * depth}{node["Node Type"]} {relation}'.rstrip()
+        details.append(line)
+        if node['Node Type'] in ('Seq Scan', 'Sort'):
+            problems.append(line.strip())
+        for child in node.get('Plans', []):
+            walk(child, depth + 1)
+
+    walk(plan[0]['Plan'])
+    return details, problems
+
+
+def check_plans(db, users: int = 500, plants: int = 10, waterings: int = 20, verbose: bool = False) -> list:
+    """Siembra `db` dentro de una transacción que se deshace, muestra el plan de cada
+    sentencia del backend y devuelve los nombres de las que no pasan"""
+    backend = db.backend
+    failures = []
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        sample = seed(backend, cursor, users, plants, waterings)
+        if backend.name == 'postgres':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+            explain = postgres_problems
+        else:
+            explain = sqlite_problems
+
+        print(f'Planes de consulta en {backend.name} ({users} usuarios, {plants} plantas cada uno)\n')
+        cases = build_cases(backend, sample)
+        for name in backend.statement_names():
+            if name in NO_PLAN:
+                continue
+            if name not in cases:
+                failures.append(name)
+                print(f'{"FALLA":<10}{name}')
+                print(f'{"":<12}sin caso en build_cases')
+                continue
+            details, problems = explain(cursor, getattr(backend, name), cases[name])
+            if not problems:
+                status = 'ok'
+            elif name in ALLOWED:
+                status = 'permitido'
+            else:
+                status = 'FALLA'
+                failures.append(name)
+            print(f'{status:<10}{name}')
+            if problems and status == 'permitido':
+                print(f'{"":<10}({ALLOWED[name]})')
+            if status == 'FALLA' or verbose:
+                for line in details:
+                    print(f'{"":<12}{line}')
+    finally:
+        # Nada de lo sembrado llega a guardarse
+        conn.rollback()
+        conn.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--plants', type=int, default=10, help='plantas por usuario')
+    parser.add_argument('--waterings', type=int, default=20, help='riegos por planta')
+    parser.add_argument('--verbose', action='store_true', help='muestra todos los planes')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    workdir = None
+    if os.getenv('DATABASE_URL'):
+        db = Database()
+    else:
+        workdir = tempfile.mkdtemp(prefix='query_plans_')
+        db = Database(os.path.join(workdir, 'plans.db'))
+
+    try:
+        failures = check_plans(db, args.users, args.plants, args.waterings, args.verbose)
+    finally:
+        db.close()
+        if workdir:
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            os.rmdir(workdir)
+
+    print(f'\n{len(failures)} consultas sin caso, con recorridos completos u ordenaciones temporales')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
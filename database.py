@@ -1,12 +1,25 @@
-import sqlite3
 import os
 import logging
-from datetime import datetime
-from typing import List, Tuple, Optional
-from urllib.parse import urlparse
+import uuid
+from contextlib import contextmanager
+from itertools import groupby
+from operator import attrgetter
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import migrations
+import user_stats
+from cache import MISSING, LRUCache
+from db_backends import CHANGES_CHANNEL, SQLITE_PROFILES, create_backend  # noqa: F401
+from records import Group, Photo, Plant, Settings, Watering
+from sqlite_writer import SQLiteWriter
 
 logger = logging.getLogger(__name__)
 
+# Filas de change_log que se conservan (SQLite); las purga maintain()
+CHANGE_LOG_RETENTION = timedelta(hours=1)
+
+
 class Database:
     def __init__(self, db_path: str = 'plants.db'):
         self.database_url = os.getenv('DATABASE_URL')
@@ -14,13 +27,34 @@ class Database:
         
         if self.use_postgres:
             logger.info(f'Usando PostgreSQL. URL: {self.database_url[:50]}...')
-            import psycopg2
-            from psycopg2.extras import RealDictCursor
-            self.psycopg2 = psycopg2
-            self.RealDictCursor = RealDictCursor
         else:
             logger.info(f'Usando SQLite. Path: {db_path}')
             self.db_path = db_path
+        # Todo el SQL de cada motor vive en su backend (db_backends.py)
+        self.backend = create_backend(self.database_url, db_path)
+        if self.use_postgres:
+            self.psycopg2 = self.backend.psycopg2
+        else:
+            self.sqlite_pragmas = self.backend.pragmas
+        
+        self.pool = self.backend.create_pool()
+        self.writer = self._create_writer()
+        # Identifica los cambios propios entre los que llegan de otros procesos
+        self.instance_id = uuid.uuid4().hex[:12]
+        # Sin invalidación entre procesos no hace falta anunciar los cambios
+        self.publish_changes = os.getenv('CACHE_INVALIDATION', '1') != '0'
+        self._change_callbacks = []
+        # Listas de plantas por usuario; cada escritura invalida la del dueño de la planta
+        self.plant_cache = LRUCache(
+            max_entries=int(os.getenv('PLANT_CACHE_SIZE', 1000)),
+            max_bytes=int(os.getenv('PLANT_CACHE_MAX_BYTES', 4 * 1024 * 1024)),
+            ttl=float(os.getenv('PLANT_CACHE_TTL', 60)),
+        )
+        self.settings_cache = LRUCache(
+            max_entries=int(os.getenv('SETTINGS_CACHE_SIZE', 5000)),
+            max_bytes=int(os.getenv('SETTINGS_CACHE_MAX_BYTES', 1024 * 1024)),
+            ttl=float(os.getenv('SETTINGS_CACHE_TTL', 60)),
+        )
         
         try:
             self._init_db()
@@ -29,516 +63,693 @@ class Database:
             logger.error(f'ERROR al inicializar base de datos: {e}', exc_info=True)
             raise
     
+    def _create_writer(self) -> Optional[SQLiteWriter]:
+        """Con SQLITE_WRITER=1 todas las escrituras frecuentes pasan por un único hilo que
+        las confirma por lotes (solo SQLite)"""
+        if self.use_postgres or os.getenv('SQLITE_WRITER', '0') != '1':
+            return None
+        writer = SQLiteWriter(
+            self.backend.connect,
+            max_batch=int(os.getenv('SQLITE_WRITER_MAX_BATCH', 100)),
+            max_delay=float(os.getenv('SQLITE_WRITER_MAX_DELAY', 0.005)),
+        )
+        logger.info(f'Escritor SQLite con commits agrupados: lotes de hasta {writer.max_batch}')
+        return writer
+    
+    def _write(self, operation):
+        """Ejecuta `operation(cursor)` en una transacción de escritura y devuelve su resultado.
+        
+        En SQLite la transacción empieza con BEGIN IMMEDIATE para tomar el bloqueo de
+        escritura desde el principio; con el escritor activo la operación se encola y
+        se confirma junto con las demás del lote."""
+        if self.writer is not None:
+            return self.writer.execute(operation)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            self.backend.begin_write(cursor)
+            result = operation(cursor)
+            conn.commit()
+        return result
+    
     def _get_connection(self):
-        if self.use_postgres:
-            return self.psycopg2.connect(self.database_url)
+        return self.backend.connect()
+    
+    @contextmanager
+    def _connection(self):
+        """Presta una conexión del pool; si falla la propia conexión se descarta en vez de reutilizarla"""
+        conn = self.pool.getconn()
+        discard = False
+        try:
+            yield conn
+        except Exception as e:
+            discard = self.backend.is_connection_error(e)
+            raise
+        finally:
+            # También se devuelve si un generador se abandona a medias (GeneratorExit)
+            self.pool.putconn(conn, discard=discard)
+    
+    def _fetchall(self, statement: str, params=()) -> List[Tuple]:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(statement, params)
+            result = cursor.fetchall()
+        return result
+    
+    def _fetchone(self, statement: str, params=()) -> Optional[Tuple]:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(statement, params)
+            result = cursor.fetchone()
+        return result
+    
+    def pool_stats(self) -> dict:
+        stats = self.pool.stats()
+        if self.writer is not None:
+            stats['writer'] = self.writer.stats()
+        return stats
+    
+    def cache_stats(self) -> dict:
+        return {'plants': self.plant_cache.stats(), 'settings': self.settings_cache.stats()}
+    
+    def _plant(self, row) -> Plant:
+        plant_id, user_id, name, frequency, last_watered, next_due, plant_type = row
+        return Plant(plant_id, user_id, name, frequency,
+                     self._from_db_time(last_watered), self._from_db_time(next_due), plant_type)
+    
+    def _plants(self, rows) -> List[Plant]:
+        return [self._plant(row) for row in rows]
+    
+    def _plant_owner(self, cursor, plant_id: int) -> Optional[int]:
+        cursor.execute(self.backend.GET_PLANT_OWNER, (plant_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    def _invalidate_plants(self, *user_ids: Optional[int]):
+        self.plant_cache.invalidate(*(user_id for user_id in user_ids if user_id is not None))
+    
+    def _publish_change(self, cursor, scope: str, user_id: Optional[int] = None):
+        """Anuncia a los demás procesos un cambio de `scope` ('plants' o 'settings') de un
+        usuario (o de todos con None). Va en la misma transacción que la escritura: en
+        PostgreSQL el NOTIFY solo se entrega si se confirma, y en SQLite la fila de
+        change_log la recoge el sondeo de los demás procesos."""
+        if not self.publish_changes:
+            return
+        target = '*' if user_id is None else str(user_id)
+        self.backend.publish_change(cursor, self.instance_id, scope, target)
+    
+    def add_change_callback(self, callback):
+        """`callback(scope, user_id)` se llama (desde el hilo del listener) con cada cambio
+        hecho por otro proceso; user_id es None si afecta a todos"""
+        self._change_callbacks.append(callback)
+    
+    def apply_change(self, origin: str, scope: str, target: str):
+        """Descarta de las cachés locales lo afectado por un cambio anunciado"""
+        if origin == self.instance_id:
+            return
+        user_id = None if target == '*' else int(target)
+        cache = self.settings_cache if scope == 'settings' else self.plant_cache
+        if user_id is None:
+            cache.clear()
         else:
-            return sqlite3.connect(self.db_path)
+            cache.invalidate(user_id)
+        for callback in self._change_callbacks:
+            try:
+                callback(scope, user_id)
+            except Exception as e:
+                logger.error(f'Error en callback de cambios: {e}')
     
-    def _init_db(self):
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def clear_caches(self):
+        self.plant_cache.clear()
+        self.settings_cache.clear()
+    
+    def get_change_cursor(self) -> int:
+        """Último id de change_log (SQLite); los cambios anteriores ya no interesan"""
+        return self._fetchone(self.backend.CHANGE_CURSOR)[0]
+    
+    def get_changes_since(self, last_id: int, limit: int = 1000) -> List[Tuple]:
+        """(id, origin, scope, user_id) de change_log posteriores a `last_id` (SQLite)"""
+        return self._fetchall(self.backend.CHANGES_SINCE, (last_id, limit))
+    
+    def purge_change_log(self, before: datetime) -> int:
+        def operation(cursor):
+            cursor.execute(self.backend.PURGE_CHANGE_LOG, (self._db_time(before),))
+            return cursor.rowcount
         
+        return self._write(operation)
+    
+    def maintain(self):
+        """Mantenimiento periódico de SQLite: PRAGMA optimize actualiza las estadísticas
+        del planificador de consultas, el checkpoint evita que el WAL crezca sin límite y
+        la purga de change_log, que la tabla crezca aunque no haya nadie sondeándola"""
         if self.use_postgres:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS plants (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    name TEXT NOT NULL,
-                    watering_frequency_days INTEGER NOT NULL,
-                    plant_type TEXT DEFAULT 'moderada',
-                    seasonal_adjustment BOOLEAN DEFAULT TRUE,
-                    custom_dryness_level INTEGER DEFAULT 50,
-                    group_id INTEGER,
-                    photo_file_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS watering_log (
-                    id SERIAL PRIMARY KEY,
-                    plant_id INTEGER NOT NULL,
-                    watered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_plants_user_id 
-                ON plants(user_id)
-            ''')
-            
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_watering_log_plant_id 
-                ON watering_log(plant_id)
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS plant_photos (
-                    id SERIAL PRIMARY KEY,
-                    plant_id INTEGER NOT NULL,
-                    file_id TEXT NOT NULL,
-                    caption TEXT,
-                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS plant_groups (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    name TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id BIGINT PRIMARY KEY,
-                    notifications_enabled INTEGER DEFAULT 1,
-                    notification_time TEXT DEFAULT '09:00',
-                    timezone TEXT DEFAULT 'UTC'
-                )
-            ''')
-        else:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS plants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    watering_frequency_days INTEGER NOT NULL,
-                    plant_type TEXT DEFAULT 'moderada',
-                    seasonal_adjustment INTEGER DEFAULT 1,
-                    custom_dryness_level INTEGER DEFAULT 50,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS watering_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    plant_id INTEGER NOT NULL,
-                    watered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_plants_user_id 
-                ON plants(user_id)
-            ''')
-            
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_watering_log_plant_id 
-                ON watering_log(plant_id)
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS plant_photos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    plant_id INTEGER NOT NULL,
-                    file_id TEXT NOT NULL,
-                    caption TEXT,
-                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS plant_groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id INTEGER PRIMARY KEY,
-                    notifications_enabled INTEGER DEFAULT 1,
-                    notification_time TEXT DEFAULT '09:00',
-                    timezone TEXT DEFAULT 'UTC'
-                )
-            ''')
-            
-            try:
-                cursor.execute('ALTER TABLE plants ADD COLUMN group_id INTEGER')
-            except sqlite3.OperationalError:
-                pass
-            
-            try:
-                cursor.execute('ALTER TABLE plants ADD COLUMN photo_file_id TEXT')
-            except sqlite3.OperationalError:
-                pass
-            
-            try:
-                cursor.execute("ALTER TABLE plants ADD COLUMN plant_type TEXT DEFAULT 'moderada'")
-            except sqlite3.OperationalError:
-                pass
-            
-            try:
-                cursor.execute('ALTER TABLE plants ADD COLUMN seasonal_adjustment INTEGER DEFAULT 1')
-            except sqlite3.OperationalError:
-                pass
-            
+            return
+        deleted = self.purge_change_log(datetime.now() - CHANGE_LOG_RETENTION)
+        if deleted:
+            logger.info(f'Purgadas {deleted} filas antiguas de change_log')
+        with self._connection() as conn:
+            self.backend.maintain(conn)
+    
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            # El mantenimiento de abajo escribe ya sin el hilo escritor
+            self.writer = None
+        if not self.use_postgres:
             try:
-                cursor.execute('ALTER TABLE plants ADD COLUMN custom_dryness_level INTEGER DEFAULT 50')
-            except sqlite3.OperationalError:
-                pass
-        
-        conn.commit()
-        conn.close()
+                self.maintain()
+            except Exception as e:
+                logger.warning(f'Error en el mantenimiento de SQLite al cerrar: {e}')
+        self.pool.close()
+    
+    def _init_db(self):
+        """Aplica las migraciones pendientes; con el esquema al día es una sola consulta"""
+        with self._connection() as conn:
+            version = migrations.migrate(self.backend, conn)
+        logger.info(f'Esquema en la versión {version}')
+    
+    def backfill_watering_summary(self):
+        """Recalcula last_watered_at, watering_count y next_due_at de todas las plantas a partir de watering_log"""
+        with self._connection() as conn:
+            migrations.backfill_in_batches(self.backend, conn, self.backend.BACKFILL_WATERING_SUMMARY)
+            migrations.backfill_in_batches(self.backend, conn, self.backend.BACKFILL_NEXT_DUE)
+            cursor = conn.cursor()
+            self._publish_change(cursor, 'plants')
+            conn.commit()
+        self.plant_cache.clear()
     
     def add_plant(self, user_id: int, name: str, watering_frequency_days: int, plant_type: str = 'moderada') -> int:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute(
-                'INSERT INTO plants (user_id, name, watering_frequency_days, plant_type) VALUES (%s, %s, %s, %s) RETURNING id',
-                (user_id, name, watering_frequency_days, plant_type)
-            )
-            plant_id = cursor.fetchone()[0]
-        else:
-            cursor.execute(
-                'INSERT INTO plants (user_id, name, watering_frequency_days, plant_type) VALUES (?, ?, ?, ?)',
-                (user_id, name, watering_frequency_days, plant_type)
+        def operation(cursor):
+            # Una planta nueva se considera pendiente de riego desde el primer momento
+            now = self._db_time(datetime.now())
+            plant_id = self.backend.insert(
+                cursor, self.backend.INSERT_PLANT,
+                (user_id, name, watering_frequency_days, plant_type, now, now)
             )
-            plant_id = cursor.lastrowid
+            cursor.execute(self.backend.BUMP_USER_PLANTS, (user_id, plant_id))
+            self._publish_change(cursor, 'plants', user_id)
+            return plant_id
         
-        conn.commit()
-        conn.close()
+        plant_id = self._write(operation)
+        self._invalidate_plants(user_id)
         return plant_id
     
-    def get_user_plants(self, user_id: int) -> List[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT 
-                p.id, 
-                p.name, 
-                p.watering_frequency_days,
-                (SELECT watered_at FROM watering_log 
-                 WHERE plant_id = p.id 
-                 ORDER BY watered_at DESC LIMIT 1) as last_watered,
-                p.plant_type
-            FROM plants p
-            WHERE p.user_id = {placeholder}
-            ORDER BY p.name
-        ''', (user_id,))
-        
-        result = cursor.fetchall()
-        conn.close()
+    def get_user_plants(self, user_id: int) -> List[Plant]:
+        cached = self.plant_cache.get(user_id)
+        if cached is not MISSING:
+            return list(cached)
+        
+        generation = self.plant_cache.generation()
+        result = self._plants(self._fetchall(self.backend.GET_USER_PLANTS, (user_id,)))
+        self.plant_cache.set(user_id, tuple(result), generation)
         return result
     
-    def get_plant_by_name(self, user_id: int, name: str) -> Optional[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT id, name, watering_frequency_days
-            FROM plants
-            WHERE user_id = {placeholder} AND name = {placeholder}
-        ''', (user_id, name))
-        
-        result = cursor.fetchone()
-        conn.close()
-        return result
+    def get_plant_by_name(self, user_id: int, name: str) -> Optional[Plant]:
+        row = self._fetchone(self.backend.GET_PLANT_BY_NAME, (user_id, name))
+        return self._plant(row) if row else None
     
     def update_plant_frequency(self, plant_id: int, new_frequency: int):
         """Actualiza la frecuencia de riego de una planta basándose en el comportamiento real"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(
-            f'UPDATE plants SET watering_frequency_days = {placeholder} WHERE id = {placeholder}',
-            (new_frequency, plant_id)
-        )
-        
-        conn.commit()
-        conn.close()
+        def operation(cursor):
+            cursor.execute(self.backend.UPDATE_PLANT_FREQUENCY, (new_frequency, plant_id))
+            cursor.execute(self.backend.RECOMPUTE_NEXT_DUE, (plant_id,))
+            owner = self._plant_owner(cursor, plant_id)
+            self._publish_change(cursor, 'plants', owner)
+            return owner
+        
+        owner = self._write(operation)
+        self._invalidate_plants(owner)
         logger.info(f'Frecuencia actualizada para plant_id={plant_id} a {new_frequency} días')
     
     def record_watering(self, plant_id: int) -> int:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute(
-                'INSERT INTO watering_log (plant_id, watered_at) VALUES (%s, %s) RETURNING id',
-                (plant_id, datetime.now())
+        def operation(cursor):
+            now = datetime.now()
+            watered_at = self._db_time(now)
+            owner = self._plant_owner(cursor, plant_id)
+            watering_id = self.backend.insert(cursor, self.backend.INSERT_WATERING, (plant_id, owner, watered_at))
+            cursor.execute(self.backend.UPDATE_WATERING_SUMMARY, (watered_at, watered_at, plant_id))
+            cursor.execute(self.backend.BUMP_USER_WATERINGS, (now.date().isoformat(), plant_id))
+            cursor.execute(self.backend.BUMP_WATERING_DAILY, (now.date().isoformat(), plant_id))
+            self._publish_change(cursor, 'plants', owner)
+            return watering_id, owner
+        
+        watering_id, owner = self._write(operation)
+        self._invalidate_plants(owner)
+        return watering_id
+    
+    @staticmethod
+    def _observed_frequency(last_watered: Optional[datetime], frequency: int, now: datetime) -> Tuple[Optional[int], int]:
+        """(días reales desde el último riego, frecuencia ajustada a ellos si difieren)"""
+        if not last_watered:
+            return None, frequency
+        actual_days = (now - last_watered).days
+        if actual_days > 0 and actual_days != frequency:
+            return actual_days, actual_days
+        return actual_days, frequency
+    
+    def water_plant(self, user_id: int, name_or_id) -> Optional[dict]:
+        """Registra el riego de una planta del usuario (por nombre o id) en una sola transacción:
+        bloquea la fila, ajusta la frecuencia a los días reales desde el último riego si difieren,
+        inserta el riego y actualiza el resumen. Devuelve None si la planta no existe."""
+        def operation(cursor):
+            if isinstance(name_or_id, int):
+                cursor.execute(self.backend.LOCK_PLANT_BY_ID, (user_id, name_or_id))
+            else:
+                cursor.execute(self.backend.LOCK_PLANT_BY_NAME, (user_id, name_or_id))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            plant_id, name, frequency, last_watered = row
+            now = datetime.now()
+            actual_days, new_frequency = self._observed_frequency(self._from_db_time(last_watered), frequency, now)
+            next_due = now + timedelta(days=new_frequency)
+            
+            watering_id = self.backend.insert(
+                cursor, self.backend.INSERT_WATERING, (plant_id, user_id, self._db_time(now))
             )
-            watering_id = cursor.fetchone()[0]
-        else:
             cursor.execute(
-                'INSERT INTO watering_log (plant_id, watered_at) VALUES (?, ?)',
-                (plant_id, datetime.now().isoformat())
+                self.backend.APPLY_WATERING,
+                (new_frequency, self._db_time(now), self._db_time(next_due), plant_id)
             )
-            watering_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
-        return watering_id
-    
-    def get_watering_history(self, user_id: int, limit: int = 20) -> List[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT p.name, w.watered_at
-            FROM watering_log w
-            JOIN plants p ON w.plant_id = p.id
-            WHERE p.user_id = {placeholder}
-            ORDER BY w.watered_at DESC
-            LIMIT {placeholder}
-        ''', (user_id, limit))
-        
-        result = cursor.fetchall()
-        conn.close()
+            cursor.execute(self.backend.BUMP_USER_WATERINGS, (now.date().isoformat(), plant_id))
+            cursor.execute(self.backend.BUMP_WATERING_DAILY, (now.date().isoformat(), plant_id))
+            self._publish_change(cursor, 'plants', user_id)
+            return {
+                'plant_id': plant_id,
+                'name': name,
+                'watering_id': watering_id,
+                'watered_at': now,
+                'actual_days': actual_days,
+                'previous_frequency': frequency,
+                'frequency': new_frequency,
+                'frequency_adjusted': new_frequency != frequency,
+                'next_due_at': next_due,
+            }
+        
+        result = self._write(operation)
+        if result is not None:
+            self._invalidate_plants(user_id)
         return result
     
+    def record_waterings(self, plant_ids: Sequence[int], user_id: Optional[int] = None) -> List[dict]:
+        """Riega varias plantas a la vez (de `user_id` si se indica) en una transacción: un
+        INSERT de varias filas en watering_log y una sola actualización de las plantas, con
+        el mismo ajuste de frecuencia que water_plant. Devuelve un dict por planta regada."""
+        plant_ids = sorted(set(plant_ids))
+        if not plant_ids:
+            return []
+        
+        def operation(cursor):
+            ids = self.backend.id_list(plant_ids)
+            if user_id is not None:
+                cursor.execute(self.backend.LOCK_USER_PLANTS, (ids, user_id))
+            else:
+                cursor.execute(self.backend.LOCK_PLANTS, (ids,))
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+            
+            now = datetime.now()
+            watered_at = self._db_time(now)
+            results = []
+            for plant_id, owner, name, frequency, last_watered in rows:
+                actual_days, new_frequency = self._observed_frequency(self._from_db_time(last_watered), frequency, now)
+                results.append({
+                    'plant_id': plant_id,
+                    'user_id': owner,
+                    'name': name,
+                    'watered_at': now,
+                    'actual_days': actual_days,
+                    'previous_frequency': frequency,
+                    'frequency': new_frequency,
+                    'frequency_adjusted': new_frequency != frequency,
+                    'next_due_at': now + timedelta(days=new_frequency),
+                })
+            
+            self.backend.execute_batch(
+                cursor, self.backend.INSERT_WATERINGS,
+                [(r['plant_id'], r['user_id'], watered_at) for r in results]
+            )
+            self.backend.execute_batch(
+                cursor, self.backend.APPLY_WATERINGS,
+                [(r['frequency'], watered_at, self._db_time(r['next_due_at']), r['plant_id']) for r in results]
+            )
+            days = [(now.date().isoformat(), r['plant_id']) for r in results]
+            cursor.executemany(self.backend.BUMP_USER_WATERINGS, days)
+            cursor.executemany(self.backend.BUMP_WATERING_DAILY, days)
+            for owner in sorted({r['user_id'] for r in results}):
+                self._publish_change(cursor, 'plants', owner)
+            return results
+        
+        results = self._write(operation)
+        self._invalidate_plants(*{r['user_id'] for r in results})
+        return results
+    
+    def undo_last_watering(self, plant_id: int) -> bool:
+        """Elimina el último riego de una planta y recalcula su resumen en la misma transacción"""
+        def operation(cursor):
+            cursor.execute(self.backend.LAST_WATERING, (plant_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False, None
+            
+            owner = self._plant_owner(cursor, plant_id)
+            cursor.execute(self.backend.UNDO_WATERING_DAILY, (owner, plant_id, row[0]))
+            cursor.execute(self.backend.PURGE_EMPTY_WATERING_DAILY, (owner, plant_id))
+            cursor.execute(self.backend.DELETE_WATERING, (row[0],))
+            cursor.execute(self.backend.UNDO_WATERING_SUMMARY, (plant_id, plant_id))
+            cursor.execute(self.backend.RECOMPUTE_NEXT_DUE, (plant_id,))
+            # Puede quitar un día activo o cambiar la planta más regada: se recuenta el usuario
+            cursor.execute(self.backend.REBUILD_USER_STATS, (owner,))
+            self._publish_change(cursor, 'plants', owner)
+            return True, owner
+        
+        undone, owner = self._write(operation)
+        if undone:
+            self._invalidate_plants(owner)
+        return undone
+    
+    def get_watering_history(self, user_id: int, limit: int = 20) -> List[Watering]:
+        return self.get_watering_history_page(user_id, limit)['rows']
+    
+    def get_watering_history_page(self, user_id: int, limit: int = 20, plant_id: Optional[int] = None,
+                                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                  before: Optional[Tuple] = None, after: Optional[Tuple] = None) -> dict:
+        """Una página del historial, de más reciente a más antiguo, paginada por cursor.
+        
+        `before`/`after` son cursores (watered_at, id) de una página anterior: `before` pide
+        los riegos más antiguos que él y `after` los más recientes. Devuelve {'rows':
+        [Watering], 'older': cursor o None, 'newer': cursor o None}; un cursor a None indica que no hay más en esa dirección. `since`/`until` acotan por fecha
+        (until excluida) y `plant_id` limita a una planta.
+        """
+        since = self._db_time(since or datetime.min)
+        until = self._db_time(until or datetime.max)
+        key = (user_id,) if plant_id is None else (plant_id, user_id)
+        if after is not None:
+            statement = self.backend.HISTORY_NEWER if plant_id is None else self.backend.HISTORY_NEWER_FOR_PLANT
+            rows = self._fetchall(statement, key + self._history_cursor(after) + (until, limit + 1))
+            has_newer, rows = len(rows) > limit, rows[:limit][::-1]
+            has_older = True
+        else:
+            # Sin cursor se empieza por el final del rango: (until, 0) va justo después de él
+            statement = self.backend.HISTORY_OLDER if plant_id is None else self.backend.HISTORY_OLDER_FOR_PLANT
+            cursor = self._history_cursor(before) if before is not None else (until, 0)
+            rows = self._fetchall(statement, key + cursor + (since, limit + 1))
+            has_older, rows = len(rows) > limit, rows[:limit]
+            has_newer = before is not None
+        rows = [Watering(watering_id, name, self._from_db_time(watered_at)) for watering_id, name, watered_at in rows]
+        return {
+            'rows': rows,
+            'older': (rows[-1].watered_at, rows[-1].id) if rows and has_older else None,
+            'newer': (rows[0].watered_at, rows[0].id) if rows and has_newer else None,
+        }
+    
+    def _history_cursor(self, cursor: Tuple) -> Tuple:
+        watered_at, watering_id = cursor
+        return self._db_time(watered_at), watering_id
+    
     def delete_plant(self, plant_id: int):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'DELETE FROM watering_log WHERE plant_id = {placeholder}', (plant_id,))
-        cursor.execute(f'DELETE FROM plants WHERE id = {placeholder}', (plant_id,))
-        
-        conn.commit()
-        conn.close()
+        def operation(cursor):
+            owner = self._plant_owner(cursor, plant_id)
+            cursor.execute(self.backend.DELETE_PLANT_WATERINGS, (plant_id,))
+            cursor.execute(self.backend.DELETE_PLANT, (plant_id,))
+            if owner is not None:
+                cursor.execute(self.backend.DELETE_PLANT_WATERING_DAILY, (owner, plant_id))
+                cursor.execute(self.backend.REBUILD_USER_STATS, (owner,))
+            self._publish_change(cursor, 'plants', owner)
+            return owner
+        
+        owner = self._write(operation)
+        self._invalidate_plants(owner)
     
-    def get_plants_needing_water(self, user_id: int) -> List[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT 
-                p.id,
-                p.name,
-                p.watering_frequency_days,
-                (SELECT watered_at FROM watering_log 
-                 WHERE plant_id = p.id 
-                 ORDER BY watered_at DESC LIMIT 1) as last_watered
-            FROM plants p
-            WHERE p.user_id = {placeholder}
-        ''', (user_id,))
-        
-        result = cursor.fetchall()
-        conn.close()
-        return result
+    def get_plants_needing_water(self, user_id: int) -> List[Plant]:
+        return self._plants(self._fetchall(self.backend.GET_PLANTS_NEEDING_WATER, (user_id,)))
     
-    def add_plant_photo(self, plant_id: int, file_id: str, caption: str = None) -> int:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute(
-                'INSERT INTO plant_photos (plant_id, file_id, caption) VALUES (%s, %s, %s) RETURNING id',
-                (plant_id, file_id, caption)
-            )
-            photo_id = cursor.fetchone()[0]
-            cursor.execute(
-                'UPDATE plants SET photo_file_id = %s WHERE id = %s',
-                (file_id, plant_id)
-            )
+    def get_due_plants(self, user_id: Optional[int] = None, notifiable_only: bool = False) -> List[Plant]:
+        """Plantas vencidas o que tocan hoy (vencen en menos de 24h) de un usuario o de todos,
+        ordenadas por usuario y vencimiento. Con notifiable_only solo incluye usuarios con
+        las notificaciones activadas.
+        """
+        horizon = self._db_time(datetime.now() + timedelta(days=1))
+        if notifiable_only:
+            statement = self.backend.DUE_PLANTS_NOTIFIABLE if user_id is None else self.backend.DUE_PLANTS_NOTIFIABLE_FOR_USER
         else:
-            cursor.execute(
-                'INSERT INTO plant_photos (plant_id, file_id, caption) VALUES (?, ?, ?)',
-                (plant_id, file_id, caption)
+            statement = self.backend.DUE_PLANTS if user_id is None else self.backend.DUE_PLANTS_FOR_USER
+        params = (horizon,) if user_id is None else (horizon, user_id)
+        return self._plants(self._fetchall(statement, params))
+    
+    def get_next_due_by_user(self, user_id: Optional[int] = None, user_ids: Optional[Sequence[int]] = None,
+                             shard_count: Optional[int] = None, shards: Optional[Sequence[int]] = None) -> List[Tuple]:
+        """(user_id, próximo vencimiento, notification_time, timezone) de cada usuario con
+        notificaciones activadas y alguna planta; con `shard_count` solo los usuarios cuyo
+        `user_id % shard_count` está en `shards`"""
+        if user_id is not None:
+            rows = self._fetchall(self.backend.NEXT_DUE_FOR_USER, (user_id,))
+        elif user_ids is not None:
+            rows = self._fetchall(self.backend.NEXT_DUE_FOR_USERS, (self.backend.id_list(user_ids),))
+        elif shard_count is not None:
+            rows = self._fetchall(
+                self.backend.NEXT_DUE_FOR_SHARDS,
+                (int(shard_count), self.backend.id_list(shards or []))
             )
-            photo_id = cursor.lastrowid
-            cursor.execute(
-                'UPDATE plants SET photo_file_id = ? WHERE id = ?',
-                (file_id, plant_id)
+        else:
+            rows = self._fetchall(self.backend.NEXT_DUE_BY_USER)
+        return [(user, self._from_db_time(next_due), time, timezone) for user, next_due, time, timezone in rows]
+    
+    def iter_due_plants_by_user(self, user_ids: Optional[Sequence[int]] = None,
+                                batch_size: int = 1000) -> Iterator[Tuple[int, List[Plant]]]:
+        """Recorre en una sola consulta las plantas pendientes de todos los usuarios con
+        notificaciones activadas (o de `user_ids`), agrupadas por usuario.
+        
+        Genera (user_id, plantas) con las mismas filas que get_due_plants. En PostgreSQL
+        usa un cursor de servidor y en SQLite itera el cursor por lotes, así la memoria
+        no crece con el número de usuarios. La conexión queda ocupada hasta agotar el
+        generador.
+        """
+        with self._connection() as conn:
+            horizon = self._db_time(datetime.now() + timedelta(days=1))
+            cursor = self.backend.stream_cursor(conn, 'due_plants_by_user', batch_size)
+            if user_ids is None:
+                cursor.execute(self.backend.DUE_PLANTS_BY_USER, (horizon,))
+            else:
+                cursor.execute(self.backend.DUE_PLANTS_BY_USERS, (horizon, self.backend.id_list(user_ids)))
+            
+            try:
+                for user_id, plants in groupby(map(self._plant, cursor), key=attrgetter('user_id')):
+                    yield user_id, list(plants)
+            finally:
+                cursor.close()
+    
+    def add_plant_photo(self, plant_id: int, file_id: str, caption: str = None) -> int:
+        def operation(cursor):
+            photo_id = self.backend.insert(
+                cursor, self.backend.INSERT_PHOTO, (plant_id, file_id, caption, self._db_time(datetime.now()))
             )
+            cursor.execute(self.backend.SET_PLANT_PHOTO, (file_id, plant_id))
+            owner = self._plant_owner(cursor, plant_id)
+            self._publish_change(cursor, 'plants', owner)
+            return photo_id, owner
         
-        conn.commit()
-        conn.close()
+        photo_id, owner = self._write(operation)
+        self._invalidate_plants(owner)
         return photo_id
     
-    def get_plant_photos(self, plant_id: int) -> List[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT id, file_id, caption, uploaded_at
-            FROM plant_photos
-            WHERE plant_id = {placeholder}
-            ORDER BY uploaded_at DESC
-        ''', (plant_id,))
-        
-        result = cursor.fetchall()
-        conn.close()
-        return result
+    def get_plant_photos(self, plant_id: int, limit: Optional[int] = None, offset: int = 0) -> List[Photo]:
+        """Fotos de la planta, de la más reciente a la más antigua; con `limit` solo esa página"""
+        if limit is None:
+            rows = self._fetchall(self.backend.GET_PLANT_PHOTOS, (plant_id,))
+        else:
+            rows = self._fetchall(self.backend.GET_PLANT_PHOTOS_PAGE, (plant_id, limit, offset))
+        return [Photo(photo_id, file_id, caption, self._from_db_time(uploaded_at))
+                for photo_id, file_id, caption, uploaded_at in rows]
+    
+    def get_photo_counts(self, user_id: int) -> List[Tuple]:
+        """(plant_id, nombre, número de fotos) de las plantas del usuario que tienen fotos"""
+        return self._fetchall(self.backend.GET_PHOTO_COUNTS, (user_id,))
     
     def create_group(self, user_id: int, name: str) -> int:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        def operation(cursor):
+            return self.backend.insert(
+                cursor, self.backend.INSERT_GROUP, (user_id, name, self._db_time(datetime.now()))
+            )
         
-        if self.use_postgres:
+        return self._write(operation)
+    
+    def get_user_groups(self, user_id: int) -> List[Group]:
+        return [Group._make(row) for row in self._fetchall(self.backend.GET_USER_GROUPS, (user_id,))]
+    
+    def assign_plant_to_group(self, plant_id: int, group_id: int):
+        def operation(cursor):
+            cursor.execute(self.backend.SET_PLANT_GROUP, (group_id, plant_id))
+            owner = self._plant_owner(cursor, plant_id)
+            self._publish_change(cursor, 'plants', owner)
+            return owner
+        
+        owner = self._write(operation)
+        self._invalidate_plants(owner)
+    
+    def get_plants_by_group(self, group_id: int) -> List[Plant]:
+        return self._plants(self._fetchall(self.backend.GET_PLANTS_BY_GROUP, (group_id,)))
+    
+    def get_user_settings(self, user_id: int) -> Optional[Settings]:
+        cached = self.settings_cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+        
+        generation = self.settings_cache.generation()
+        row = self._fetchone(self.backend.GET_USER_SETTINGS, (user_id,))
+        result = Settings._make(row) if row else None
+        self.settings_cache.set(user_id, result, generation)
+        return result
+    
+    def update_notification_settings(self, user_id: int, enabled: bool, time: str = None, timezone: str = None):
+        """Guarda los ajustes de notificación; si no se indica zona horaria se conserva la actual"""
+        def operation(cursor):
             cursor.execute(
-                'INSERT INTO plant_groups (user_id, name) VALUES (%s, %s) RETURNING id',
-                (user_id, name)
+                self.backend.UPSERT_NOTIFICATION_SETTINGS,
+                (user_id, 1 if enabled else 0, time or '09:00', timezone, timezone)
             )
-            group_id = cursor.fetchone()[0]
-        else:
+            self._publish_change(cursor, 'settings', user_id)
+        
+        self._write(operation)
+        self.settings_cache.invalidate(user_id)
+    
+    def claim_notification(self, user_id: int, due_bucket: str, plant_hash: str) -> bool:
+        """Registra un recordatorio antes de enviarlo; devuelve False si ya estaba registrado
+        (enviado antes de un reinicio o por otra instancia del bot)"""
+        def operation(cursor):
             cursor.execute(
-                'INSERT INTO plant_groups (user_id, name) VALUES (?, ?)',
-                (user_id, name)
+                self.backend.CLAIM_NOTIFICATION,
+                (user_id, due_bucket, plant_hash, self._db_time(datetime.now()))
             )
-            group_id = cursor.lastrowid
+            claimed = cursor.rowcount == 1
+            return claimed
         
-        conn.commit()
-        conn.close()
-        return group_id
+        claimed = self._write(operation)
+        return claimed
     
-    def get_user_groups(self, user_id: int) -> List[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def release_notification(self, user_id: int, due_bucket: str, plant_hash: str):
+        """Borra el registro de un recordatorio que no se pudo enviar, para que un reintento
+        o un reinicio vuelvan a mandarlo"""
+        def operation(cursor):
+            cursor.execute(self.backend.RELEASE_NOTIFICATION, (user_id, due_bucket, plant_hash))
         
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT id, name, 
-                (SELECT COUNT(*) FROM plants WHERE group_id = plant_groups.id) as plant_count
-            FROM plant_groups
-            WHERE user_id = {placeholder}
-            ORDER BY name
-        ''', (user_id,))
-        
-        result = cursor.fetchall()
-        conn.close()
-        return result
+        self._write(operation)
     
-    def assign_plant_to_group(self, plant_id: int, group_id: int):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(
-            f'UPDATE plants SET group_id = {placeholder} WHERE id = {placeholder}',
-            (group_id, plant_id)
-        )
-        
-        conn.commit()
-        conn.close()
+    def get_recent_notifications(self, since: datetime) -> List[Tuple]:
+        """(user_id, último envío) de los usuarios avisados desde `since`"""
+        rows = self._fetchall(self.backend.RECENT_NOTIFICATIONS, (self._db_time(since),))
+        return [(user_id, self._from_db_time(sent_at)) for user_id, sent_at in rows]
     
-    def get_plants_by_group(self, group_id: int) -> List[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(f'''
-            SELECT id, name, watering_frequency_days
-            FROM plants
-            WHERE group_id = {placeholder}
-            ORDER BY name
-        ''', (group_id,))
+    def purge_notification_log(self, before: datetime) -> int:
+        def operation(cursor):
+            cursor.execute(self.backend.PURGE_NOTIFICATION_LOG, (self._db_time(before),))
+            return cursor.rowcount
         
-        result = cursor.fetchall()
-        conn.close()
-        return result
+        return self._write(operation)
     
-    def get_user_settings(self, user_id: int) -> Optional[Tuple]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        cursor.execute(
-            f'SELECT notifications_enabled, notification_time FROM user_settings WHERE user_id = {placeholder}',
-            (user_id,)
-        )
-        
-        result = cursor.fetchone()
-        conn.close()
-        return result
+    def _db_time(self, value: datetime):
+        return self.backend.timestamp(value)
     
-    def update_notification_settings(self, user_id: int, enabled: bool, time: str = None):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute('''
-                INSERT INTO user_settings (user_id, notifications_enabled, notification_time) 
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id) 
-                DO UPDATE SET notifications_enabled = %s, notification_time = %s
-            ''', (user_id, 1 if enabled else 0, time or '09:00', 1 if enabled else 0, time or '09:00'))
-        else:
+    def _from_db_time(self, value) -> Optional[datetime]:
+        return self.backend.from_timestamp(value)
+    
+    def heartbeat_worker(self, worker_id: str, ttl: float) -> List[str]:
+        """Renueva el latido de un worker de notificaciones y devuelve los workers vivos"""
+        def operation(cursor):
+            now = datetime.now()
+            cursor.execute(self.backend.HEARTBEAT_WORKER, (worker_id, self._db_time(now + timedelta(seconds=ttl))))
+            cursor.execute(self.backend.PURGE_WORKERS, (self._db_time(now),))
+            cursor.execute(self.backend.LIVE_WORKERS)
+            return [row[0] for row in cursor.fetchall()]
+        
+        return self._write(operation)
+    
+    def acquire_shard_lease(self, shard: int, owner: str, ttl: float) -> bool:
+        """Toma (o renueva) la concesión de un shard si está libre, caducada o ya es nuestra"""
+        def operation(cursor):
+            now = datetime.now()
             cursor.execute(
-                'INSERT OR REPLACE INTO user_settings (user_id, notifications_enabled, notification_time) VALUES (?, ?, ?)',
-                (user_id, 1 if enabled else 0, time or '09:00')
+                self.backend.ACQUIRE_SHARD_LEASE,
+                (shard, owner, self._db_time(now + timedelta(seconds=ttl)), self._db_time(now))
             )
+            return cursor.rowcount == 1
         
-        conn.commit()
-        conn.close()
+        return self._write(operation)
+    
+    def get_shard_leases(self) -> List[Tuple]:
+        """(shard, owner, expires_at) de las concesiones vigentes"""
+        rows = self._fetchall(self.backend.SHARD_LEASES, (self._db_time(datetime.now()),))
+        return [(shard, owner, self._from_db_time(expires_at)) for shard, owner, expires_at in rows]
+    
+    def release_shard_leases(self, owner: str, shards: Optional[Sequence[int]] = None):
+        def operation(cursor):
+            if shards is None:
+                cursor.execute(self.backend.RELEASE_ALL_SHARDS, (owner,))
+                cursor.execute(self.backend.REMOVE_WORKER, (owner,))
+            else:
+                cursor.execute(self.backend.RELEASE_SHARDS, (owner, self.backend.id_list(shards)))
+        
+        self._write(operation)
     
     def get_all_users_for_notifications(self) -> List[int]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT DISTINCT user_id 
-            FROM user_settings 
-            WHERE notifications_enabled = 1
-        ''')
-        
-        result = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return result
+        return [row[0] for row in self._fetchall(self.backend.NOTIFIABLE_USERS)]
     
     def get_watering_stats(self, user_id: int) -> dict:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        placeholder = '%s' if self.use_postgres else '?'
-        
-        cursor.execute(
-            f'SELECT COUNT(*) FROM watering_log w JOIN plants p ON w.plant_id = p.id WHERE p.user_id = {placeholder}',
-            (user_id,)
-        )
-        total_waterings = cursor.fetchone()[0]
-        
-        cursor.execute(
-            f'SELECT COUNT(*) FROM plants WHERE user_id = {placeholder}',
-            (user_id,)
-        )
-        total_plants = cursor.fetchone()[0]
-        
-        cursor.execute(f'''
-            SELECT p.name, COUNT(w.id) as count
-            FROM plants p
-            LEFT JOIN watering_log w ON p.id = w.plant_id
-            WHERE p.user_id = {placeholder}
-            GROUP BY p.id, p.name
-            ORDER BY count DESC
-            LIMIT 1
-        ''', (user_id,))
-        most_watered = cursor.fetchone()
-        
-        cursor.execute(f'''
-            SELECT COUNT(DISTINCT DATE(watered_at))
-            FROM watering_log w
-            JOIN plants p ON w.plant_id = p.id
-            WHERE p.user_id = {placeholder}
-        ''', (user_id,))
-        days_active = cursor.fetchone()[0]
-        
-        conn.close()
+        """Estadísticas del usuario: una lectura por clave primaria de user_stats"""
+        row = self._fetchone(self.backend.GET_USER_STATS, (user_id,))
+        if row is None:
+            return {'total_waterings': 0, 'total_plants': 0, 'most_watered': None, 'days_active': 0}
         
+        total_waterings, total_plants, days_active, most_watered_name, most_watered_count = row
         return {
             'total_waterings': total_waterings,
             'total_plants': total_plants,
-            'most_watered': most_watered,
+            'most_watered': (most_watered_name, most_watered_count) if most_watered_name else None,
             'days_active': days_active
         }
+    
+    def get_watering_trends(self, user_id: int, periods: Sequence[int] = (7, 30, 365)) -> dict:
+        """Riegos y días activos en los últimos N días de cada periodo, desde watering_daily:
+        {7: {'waterings': ..., 'active_days': ...}, 30: {...}, ...}"""
+        today = date.today()
+        since = today - timedelta(days=max(periods) - 1)
+        rows = self._fetchall(self.backend.DAILY_WATERINGS_SINCE, (user_id, since.isoformat()))
+        trends = {}
+        for days in periods:
+            start = (today - timedelta(days=days - 1)).isoformat()
+            totals = [total for day, total in rows if day >= start]
+            trends[days] = {'waterings': sum(totals), 'active_days': len(totals)}
+        return trends
+    
+    def get_watering_streaks(self, user_id: int) -> Tuple[int, int]:
+        """(racha actual, racha más larga) en días seguidos con algún riego. La actual
+        sigue viva si el último riego fue hoy o ayer."""
+        current = longest = 0
+        previous = None
+        for (day,) in self._fetchall(self.backend.ACTIVE_DAYS, (user_id,)):
+            day = date.fromisoformat(day)
+            current = current + 1 if previous is not None and (day - previous).days == 1 else 1
+            longest = max(longest, current)
+            previous = day
+        if previous is None or (date.today() - previous).days > 1:
+            current = 0
+        return current, longest
+    
+    def get_busiest_weekday(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """(día de la semana con más riegos, 0 = lunes como date.weekday(), riegos) o None"""
+        row = self._fetchone(self.backend.BUSIEST_WEEKDAY, (user_id,))
+        if row is None:
+            return None
+        weekday, total = row
+        return (weekday + 6) % 7, total
+    
+    def rebuild_user_stats(self, user_ids: Optional[Sequence[int]] = None) -> int:
+        """Recalcula user_stats, watering_daily y plants.watering_count desde watering_log"""
+        with self._connection() as conn:
+            return user_stats.rebuild(self.backend, conn, list(user_ids) if user_ids is not None else None)
+    
+    def check_user_stats(self, user_ids: Optional[Sequence[int]] = None) -> List[Tuple]:
+        """(user_id, campo, guardado, real) de cada contador desajustado"""
+        with self._connection() as conn:
+            return user_stats.check(self.backend, conn, list(user_ids) if user_ids is not None else None)
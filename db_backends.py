@@ -0,0 +1,971 @@
+"""
+Backends de almacenamiento de Database: SQL y detalles propios de cada motor.
+
+Cada sentencia se escribe una sola vez como atributo de clase. Las comunes van en
+SQLBackend con parámetros '?'; PostgresBackend las convierte a '%s' al definirse la
+clase, así que en tiempo de ejecución solo se ejecutan textos fijos (sqlite3 reutiliza
+la sentencia preparada de su caché por conexión). Donde cada motor tiene una forma
+mejor de hacer algo (RETURNING, LATERAL, execute_values, = ANY frente a json_each...)
+cada backend define su propia versión.
+"""
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+from db_pool import ConnectionPool, ThreadLocalPool
+
+logger = logging.getLogger(__name__)
+
+# SQLite guarda las fechas como segundos enteros desde esta fecha: se comparan como números
+# y entran en los índices igual que los TIMESTAMP de PostgreSQL. Son la hora local del
+# servidor sin zona, como los datetime que usa el bot, así que no se aplica ningún desfase.
+SQLITE_EPOCH = datetime(1970, 1, 1)
+# Perfiles de PRAGMA para las conexiones SQLite (SQLITE_PROFILE); cada valor se puede
+# sobrescribir con SQLITE_<PRAGMA>, p. ej. SQLITE_MMAP_SIZE=0. 'default' deja los de SQLite.
+SQLITE_PROFILES = {
+    'default': {},
+    'wal': {
+        # Los lectores no se bloquean mientras alguien escribe
+        'journal_mode': 'WAL',
+        # Con WAL, NORMAL solo arriesga la última transacción ante un corte de luz
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # KiB
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',
+    },
+}
+# Canal de PostgreSQL por el que se avisa a los demás procesos de qué datos han cambiado
+CHANGES_CHANNEL = 'plant_changes'
+# Clave del advisory lock de PostgreSQL que serializa las migraciones
+SCHEMA_LOCK_KEY = 726_1001
+
+
+class SQLBackend:
+    """Sentencias comunes a ambos motores (parámetros '?')"""
+
+    name = None
+
+    # --- plantas ---
+    # Columnas de records.Plant, en su orden; todas las consultas de plantas las devuelven
+    _PLANT_COLUMNS = 'p.id, p.user_id, p.name, p.watering_frequency_days, p.last_watered_at, p.next_due_at, p.plant_type'
+    GET_USER_PLANTS = f'''
+        SELECT {_PLANT_COLUMNS}
+        FROM plants p
+        WHERE p.user_id = ?
+        ORDER BY p.name
+    '''
+    GET_PLANT_BY_NAME = f'''
+        SELECT {_PLANT_COLUMNS}
+        FROM plants p
+        WHERE p.user_id = ? AND p.name = ?
+    '''
+    GET_PLANT_OWNER = 'SELECT user_id FROM plants WHERE id = ?'
+    UPDATE_PLANT_FREQUENCY = 'UPDATE plants SET watering_frequency_days = ? WHERE id = ?'
+    DELETE_PLANT_WATERINGS = 'DELETE FROM watering_log WHERE plant_id = ?'
+    DELETE_PLANT = 'DELETE FROM plants WHERE id = ?'
+    GET_PLANTS_NEEDING_WATER = f'''
+        SELECT {_PLANT_COLUMNS}
+        FROM plants p
+        WHERE p.user_id = ?
+    '''
+    SET_PLANT_PHOTO = 'UPDATE plants SET photo_file_id = ? WHERE id = ?'
+    SET_PLANT_GROUP = 'UPDATE plants SET group_id = ? WHERE id = ?'
+
+    # --- riegos ---
+    UPDATE_WATERING_SUMMARY = '''
+        UPDATE plants
+        SET last_watered_at = ?,
+            watering_count = watering_count + 1,
+            next_due_at = {next_due_from_param}
+        WHERE id = ?
+    '''
+    APPLY_WATERING = '''
+        UPDATE plants
+        SET watering_frequency_days = ?,
+            last_watered_at = ?,
+            watering_count = watering_count + 1,
+            next_due_at = ?
+        WHERE id = ?
+    '''
+    LAST_WATERING = '''
+        SELECT id FROM watering_log
+        WHERE plant_id = ?
+        ORDER BY watered_at DESC, id DESC
+        LIMIT 1
+    '''
+    DELETE_WATERING = 'DELETE FROM watering_log WHERE id = ?'
+    UNDO_WATERING_SUMMARY = '''
+        UPDATE plants
+        SET last_watered_at = (SELECT MAX(watered_at) FROM watering_log WHERE plant_id = ?),
+            watering_count = watering_count - 1
+        WHERE id = ?
+    '''
+    RECOMPUTE_NEXT_DUE = 'UPDATE plants SET next_due_at = {next_due} WHERE id = ?'
+    # Los rellenos van por rangos de id (migrations.backfill_in_batches)
+    BACKFILL_NEXT_DUE = 'UPDATE plants SET next_due_at = {next_due} WHERE id > ? AND id <= ?'
+    BACKFILL_WATERING_USER = '''
+        UPDATE watering_log
+        SET user_id = (SELECT p.user_id FROM plants p WHERE p.id = watering_log.plant_id)
+        WHERE id > ? AND id <= ?
+    '''
+    # Historial por cursor (watered_at, id): el cursor es el límite del rango del índice
+    # (user_id, watered_at, id) o (plant_id, watered_at, id), así que la página 100 cuesta
+    # lo mismo que la primera. Hacia atrás los parámetros son [usuario | planta, usuario],
+    # desde, cursor (fecha, id), límite; hacia delante, ..., cursor, hasta, límite.
+    _HISTORY_PAGE = '''
+        SELECT w.id, p.name, w.watered_at
+        FROM watering_log w
+        JOIN plants p ON p.id = w.plant_id
+        WHERE {key} AND {bounds}
+        ORDER BY w.watered_at {order}, w.id {order}
+        LIMIT ?
+    '''
+    _USER_KEY = 'w.user_id = ?'
+    _PLANT_KEY = 'w.plant_id = ? AND p.user_id = ?'
+    _OLDER = '(w.watered_at, w.id) < (?, ?) AND w.watered_at >= ?'
+    _NEWER = '(w.watered_at, w.id) > (?, ?) AND w.watered_at < ?'
+    HISTORY_OLDER = _HISTORY_PAGE.format(key=_USER_KEY, bounds=_OLDER, order='DESC')
+    HISTORY_NEWER = _HISTORY_PAGE.format(key=_USER_KEY, bounds=_NEWER, order='ASC')
+    HISTORY_OLDER_FOR_PLANT = _HISTORY_PAGE.format(key=_PLANT_KEY, bounds=_OLDER, order='DESC')
+    HISTORY_NEWER_FOR_PLANT = _HISTORY_PAGE.format(key=_PLANT_KEY, bounds=_NEWER, order='ASC')
+
+    # --- vencimientos ---
+    _DUE_PLANTS = f'''
+        SELECT {_PLANT_COLUMNS}
+        FROM plants p
+        {{join}}
+        WHERE p.next_due_at < ? {{user_filter}}
+        ORDER BY p.user_id, p.next_due_at
+    '''
+    _NOTIFIABLE_JOIN = 'JOIN user_settings s ON s.user_id = p.user_id AND s.notifications_enabled = 1'
+    DUE_PLANTS = _DUE_PLANTS.format(join='', user_filter='')
+    DUE_PLANTS_FOR_USER = _DUE_PLANTS.format(join='', user_filter='AND p.user_id = ?')
+    DUE_PLANTS_NOTIFIABLE = _DUE_PLANTS.format(join=_NOTIFIABLE_JOIN, user_filter='')
+    DUE_PLANTS_NOTIFIABLE_FOR_USER = _DUE_PLANTS.format(join=_NOTIFIABLE_JOIN, user_filter='AND p.user_id = ?')
+
+    _NEXT_DUE_BY_USER = '''
+        SELECT s.user_id, MIN(p.next_due_at), s.notification_time, s.timezone
+        FROM plants p
+        JOIN user_settings s ON s.user_id = p.user_id AND s.notifications_enabled = 1
+        {where}
+        GROUP BY s.user_id
+    '''
+    NEXT_DUE_BY_USER = _NEXT_DUE_BY_USER.format(where='')
+    NEXT_DUE_FOR_USER = _NEXT_DUE_BY_USER.format(where='WHERE p.user_id = ?')
+    NEXT_DUE_FOR_USERS = _NEXT_DUE_BY_USER.format(where='WHERE p.user_id {in_list}')
+    NEXT_DUE_FOR_SHARDS = _NEXT_DUE_BY_USER.format(where='WHERE (p.user_id % ?) {in_list}')
+
+    # --- fotos y grupos ---
+    GET_PLANT_PHOTOS = '''
+        SELECT id, file_id, caption, uploaded_at
+        FROM plant_photos
+        WHERE plant_id = ?
+        ORDER BY uploaded_at DESC, id DESC
+    '''
+    GET_PLANT_PHOTOS_PAGE = GET_PLANT_PHOTOS + 'LIMIT ? OFFSET ?'
+    # Solo las plantas con fotos; agrupar por (name, id) sigue el orden de idx_plants_user_name
+    GET_PHOTO_COUNTS = '''
+        SELECT p.id, p.name, COUNT(*) as photo_count
+        FROM plants p
+        JOIN plant_photos ph ON ph.plant_id = p.id
+        WHERE p.user_id = ?
+        GROUP BY p.name, p.id
+        HAVING COUNT(*) > 0
+        ORDER BY p.name, p.id
+    '''
+    GET_USER_GROUPS = '''
+        SELECT id, name,
+            (SELECT COUNT(*) FROM plants WHERE group_id = plant_groups.id) as plant_count
+        FROM plant_groups
+        WHERE user_id = ?
+        ORDER BY name
+    '''
+    GET_PLANTS_BY_GROUP = f'''
+        SELECT {_PLANT_COLUMNS}
+        FROM plants p
+        WHERE p.group_id = ?
+        ORDER BY p.name
+    '''
+
+    # --- ajustes y notificaciones ---
+    GET_USER_SETTINGS = 'SELECT notifications_enabled, notification_time, timezone FROM user_settings WHERE user_id = ?'
+    UPSERT_NOTIFICATION_SETTINGS = '''
+        INSERT INTO user_settings (user_id, notifications_enabled, notification_time, timezone)
+        VALUES (?, ?, ?, COALESCE(?, 'UTC'))
+        ON CONFLICT (user_id)
+        DO UPDATE SET notifications_enabled = excluded.notifications_enabled,
+                      notification_time = excluded.notification_time,
+                      timezone = COALESCE(?, user_settings.timezone)
+    '''
+    CLAIM_NOTIFICATION = '''
+        INSERT INTO notification_log (user_id, due_bucket, plant_hash, sent_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, due_bucket, plant_hash) DO NOTHING
+    '''
+    RELEASE_NOTIFICATION = 'DELETE FROM notification_log WHERE user_id = ? AND due_bucket = ? AND plant_hash = ?'
+    RECENT_NOTIFICATIONS = '''
+        SELECT user_id, MAX(sent_at)
+        FROM notification_log
+        WHERE sent_at >= ?
+        GROUP BY user_id
+    '''
+    PURGE_NOTIFICATION_LOG = 'DELETE FROM notification_log WHERE sent_at < ?'
+    NOTIFIABLE_USERS = '''
+        SELECT DISTINCT user_id
+        FROM user_settings
+        WHERE notifications_enabled = 1
+    '''
+
+    # --- workers y shards ---
+    HEARTBEAT_WORKER = '''
+        INSERT INTO notification_workers (worker_id, expires_at)
+        VALUES (?, ?)
+        ON CONFLICT (worker_id) DO UPDATE SET expires_at = excluded.expires_at
+    '''
+    PURGE_WORKERS = 'DELETE FROM notification_workers WHERE expires_at < ?'
+    LIVE_WORKERS = 'SELECT worker_id FROM notification_workers ORDER BY worker_id'
+    ACQUIRE_SHARD_LEASE = '''
+        INSERT INTO shard_leases (shard, owner, expires_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (shard) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE shard_leases.owner = excluded.owner OR shard_leases.expires_at < ?
+    '''
+    SHARD_LEASES = 'SELECT shard, owner, expires_at FROM shard_leases WHERE expires_at >= ? ORDER BY shard'
+    RELEASE_ALL_SHARDS = 'DELETE FROM shard_leases WHERE owner = ?'
+    RELEASE_SHARDS = 'DELETE FROM shard_leases WHERE owner = ? AND shard {in_list}'
+    REMOVE_WORKER = 'DELETE FROM notification_workers WHERE worker_id = ?'
+
+    # --- estadísticas (user_stats, ver user_stats.py) ---
+    GET_USER_STATS = '''
+        SELECT s.total_waterings, s.total_plants, s.days_active, p.name, s.most_watered_count
+        FROM user_stats s
+        LEFT JOIN plants p ON p.id = s.most_watered_plant_id
+        WHERE s.user_id = ?
+    '''
+    BUMP_USER_PLANTS = '''
+        INSERT INTO user_stats (user_id, total_plants, most_watered_plant_id)
+        VALUES (?, 1, ?)
+        ON CONFLICT (user_id)
+        DO UPDATE SET total_plants = user_stats.total_plants + 1,
+                      most_watered_plant_id = COALESCE(user_stats.most_watered_plant_id,
+                                                       excluded.most_watered_plant_id)
+    '''
+    # Tras actualizar plants.watering_count: los riegos entran siempre con la fecha actual,
+    # así que un día es nuevo si es posterior al último día activo
+    _NEW_DAY = 'user_stats.last_active_day IS NULL OR user_stats.last_active_day < excluded.last_active_day'
+    _NEW_TOP = 'user_stats.most_watered_plant_id IS NULL OR excluded.most_watered_count > user_stats.most_watered_count'
+    BUMP_USER_WATERINGS = f'''
+        INSERT INTO user_stats (user_id, total_plants, total_waterings, days_active, last_active_day,
+                                most_watered_plant_id, most_watered_count)
+        SELECT p.user_id, 0, 1, 1, ?, p.id, p.watering_count
+        FROM plants p
+        WHERE p.id = ?
+        ON CONFLICT (user_id)
+        DO UPDATE SET total_waterings = user_stats.total_waterings + 1,
+                      days_active = user_stats.days_active + CASE WHEN {_NEW_DAY} THEN 1 ELSE 0 END,
+                      last_active_day = CASE WHEN {_NEW_DAY}
+                                             THEN excluded.last_active_day ELSE user_stats.last_active_day END,
+                      most_watered_plant_id = CASE WHEN {_NEW_TOP}
+                                                   THEN excluded.most_watered_plant_id
+                                                   ELSE user_stats.most_watered_plant_id END,
+                      most_watered_count = CASE WHEN {_NEW_TOP}
+                                                THEN excluded.most_watered_count ELSE user_stats.most_watered_count END
+    '''
+    # Recuento completo de un usuario a partir de plants y watering_log (reconstrucción,
+    # comprobación, borrar una planta y deshacer un riego)
+    _USER_STATS_RECOUNT = '''
+        SELECT u.user_id,
+            (SELECT COUNT(*) FROM plants p WHERE p.user_id = u.user_id),
+            (SELECT COUNT(*) FROM watering_log w JOIN plants p ON w.plant_id = p.id WHERE p.user_id = u.user_id),
+            (SELECT COUNT(DISTINCT {day})
+             FROM watering_log w JOIN plants p ON w.plant_id = p.id WHERE p.user_id = u.user_id),
+            (SELECT {last_day}
+             FROM watering_log w JOIN plants p ON w.plant_id = p.id WHERE p.user_id = u.user_id),
+            (SELECT p.id FROM plants p WHERE p.user_id = u.user_id ORDER BY p.watering_count DESC, p.id LIMIT 1),
+            COALESCE((SELECT MAX(p.watering_count) FROM plants p WHERE p.user_id = u.user_id), 0)
+        FROM (SELECT ? AS user_id) u
+        WHERE true  -- SQLite lo necesita para un INSERT ... SELECT con ON CONFLICT
+    '''
+    RECOUNT_USER_STATS = _USER_STATS_RECOUNT
+    REBUILD_USER_STATS = '''
+        INSERT INTO user_stats (user_id, total_plants, total_waterings, days_active, last_active_day,
+                                most_watered_plant_id, most_watered_count)
+    ''' + _USER_STATS_RECOUNT + '''
+        ON CONFLICT (user_id)
+        DO UPDATE SET total_plants = excluded.total_plants,
+                      total_waterings = excluded.total_waterings,
+                      days_active = excluded.days_active,
+                      last_active_day = excluded.last_active_day,
+                      most_watered_plant_id = excluded.most_watered_plant_id,
+                      most_watered_count = excluded.most_watered_count
+    '''
+    STORED_USER_STATS = '''
+        SELECT s.total_plants, s.total_waterings, s.days_active, s.last_active_day,
+               s.most_watered_count, p.user_id, p.watering_count
+        FROM user_stats s
+        LEFT JOIN plants p ON p.id = s.most_watered_plant_id
+        WHERE s.user_id = ?
+    '''
+    REBUILD_PLANT_COUNTS = '''
+        UPDATE plants
+        SET watering_count = (SELECT COUNT(*) FROM watering_log w WHERE w.plant_id = plants.id)
+        WHERE user_id = ?
+    '''
+    PLANT_COUNTS = '''
+        SELECT p.id, p.watering_count, (SELECT COUNT(*) FROM watering_log w WHERE w.plant_id = p.id)
+        FROM plants p
+        WHERE p.user_id = ?
+    '''
+    STATS_USERS = 'SELECT user_id FROM plants UNION SELECT user_id FROM user_stats ORDER BY 1'
+
+    # --- riegos por día (watering_daily) ---
+    BUMP_WATERING_DAILY = '''
+        INSERT INTO watering_daily (user_id, plant_id, day, waterings)
+        SELECT p.user_id, p.id, ?, 1
+        FROM plants p
+        WHERE p.id = ?
+        ON CONFLICT (user_id, plant_id, day) DO UPDATE SET waterings = watering_daily.waterings + 1
+    '''
+    # Antes de borrar el riego, que es de donde sale el día
+    UNDO_WATERING_DAILY = '''
+        UPDATE watering_daily
+        SET waterings = waterings - 1
+        WHERE user_id = ? AND plant_id = ?
+          AND day = (SELECT {day} FROM watering_log w WHERE w.id = ?)
+    '''
+    PURGE_EMPTY_WATERING_DAILY = 'DELETE FROM watering_daily WHERE user_id = ? AND plant_id = ? AND waterings <= 0'
+    DELETE_PLANT_WATERING_DAILY = 'DELETE FROM watering_daily WHERE user_id = ? AND plant_id = ?'
+    BACKFILL_WATERING_DAILY = '''
+        INSERT INTO watering_daily (user_id, plant_id, day, waterings)
+        SELECT p.user_id, w.plant_id, {day}, COUNT(*)
+        FROM watering_log w
+        JOIN plants p ON p.id = w.plant_id
+        WHERE w.plant_id > ? AND w.plant_id <= ?
+        GROUP BY p.user_id, w.plant_id, {day}
+        ON CONFLICT (user_id, plant_id, day) DO UPDATE SET waterings = excluded.waterings
+    '''
+    DELETE_USER_WATERING_DAILY = 'DELETE FROM watering_daily WHERE user_id = ?'
+    REBUILD_WATERING_DAILY = '''
+        INSERT INTO watering_daily (user_id, plant_id, day, waterings)
+        SELECT p.user_id, w.plant_id, {day}, COUNT(*)
+        FROM watering_log w
+        JOIN plants p ON p.id = w.plant_id
+        WHERE p.user_id = ?
+        GROUP BY p.user_id, w.plant_id, {day}
+    '''
+    WATERING_DAILY_FOR_USER = 'SELECT plant_id, day, waterings FROM watering_daily WHERE user_id = ?'
+    WATERING_DAILY_FROM_LOG = '''
+        SELECT w.plant_id, {day}, COUNT(*)
+        FROM watering_log w
+        JOIN plants p ON p.id = w.plant_id
+        WHERE p.user_id = ?
+        GROUP BY w.plant_id, {day}
+    '''
+    DAILY_WATERINGS_SINCE = '''
+        SELECT day, SUM(waterings)
+        FROM watering_daily
+        WHERE user_id = ? AND day >= ?
+        GROUP BY day
+        ORDER BY day
+    '''
+    ACTIVE_DAYS = 'SELECT DISTINCT day FROM watering_daily WHERE user_id = ? ORDER BY day'
+    BUSIEST_WEEKDAY = '''
+        SELECT {weekday} AS weekday, SUM(waterings) AS total
+        FROM watering_daily
+        WHERE user_id = ?
+        GROUP BY 1
+        ORDER BY total DESC, weekday
+        LIMIT 1
+    '''
+
+    # --- versión del esquema (migrations.py) ---
+    SCHEMA_VERSION = 'SELECT version FROM schema_version'
+    CREATE_SCHEMA_VERSION = 'CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'
+    INIT_SCHEMA_VERSION = 'INSERT INTO schema_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM schema_version)'
+    SET_SCHEMA_VERSION = 'UPDATE schema_version SET version = ? WHERE version < ?'
+
+    # Piezas que cada motor rellena en las sentencias de arriba
+    NEXT_DUE_SQL = None
+    NEXT_DUE_FROM_PARAM_SQL = None
+    IN_LIST_SQL = None
+    LAST_DAY_SQL = None
+    DAY_SQL = None
+    WEEKDAY_SQL = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name is None:
+            return
+        fragments = {
+            'next_due': cls.NEXT_DUE_SQL,
+            'next_due_from_param': cls.NEXT_DUE_FROM_PARAM_SQL,
+            'in_list': cls.IN_LIST_SQL,
+            'last_day': cls.LAST_DAY_SQL,
+            'day': cls.DAY_SQL,
+            'weekday': cls.WEEKDAY_SQL,
+        }
+        # Se resuelve una vez por clase: en ejecución solo se usan los textos ya compilados
+        for attr in cls.statement_names():
+            value = getattr(cls, attr)
+            if '{' in value:
+                value = value.format(**fragments)
+            setattr(cls, attr, cls._compile(value))
+
+    @classmethod
+    def statement_names(cls) -> List[str]:
+        """Nombres de las sentencias SQL completas del motor (sin fragmentos ni privadas)"""
+        return sorted(
+            attr for attr in dir(cls)
+            if attr.isupper() and not attr.startswith('_') and not attr.endswith('_SQL')
+            and isinstance(getattr(cls, attr), str)
+        )
+
+    @staticmethod
+    def _compile(statement: str) -> str:
+        return statement
+
+    # --- interfaz que implementa cada motor ---
+
+    def create_pool(self):
+        raise NotImplementedError
+
+    def connect(self):
+        raise NotImplementedError
+
+    def is_connection_error(self, error: Exception) -> bool:
+        raise NotImplementedError
+
+    def create_tables(self, cursor):
+        raise NotImplementedError
+
+    def add_column(self, cursor, table: str, column: str, definition: str) -> bool:
+        raise NotImplementedError
+
+    def is_undefined_table(self, error: Exception) -> bool:
+        raise NotImplementedError
+
+    def lock_schema(self, cursor):
+        """Impide que dos procesos apliquen migraciones a la vez (en SQLite basta con que sean idempotentes)"""
+
+    def unlock_schema(self, cursor):
+        pass
+
+    def timestamp(self, value: datetime):
+        """Valor con el que se guarda una fecha en este motor"""
+        raise NotImplementedError
+
+    def from_timestamp(self, value) -> Optional[datetime]:
+        """Fecha leída de este motor como datetime (None se queda en None)"""
+        raise NotImplementedError
+
+    def id_list(self, values: Sequence[int]):
+        """Parámetro para las sentencias con {in_list}"""
+        raise NotImplementedError
+
+    def begin_write(self, cursor):
+        pass
+
+    def insert(self, cursor, statement: str, params) -> int:
+        """Ejecuta un INSERT y devuelve el id de la fila creada"""
+        raise NotImplementedError
+
+    def execute_batch(self, cursor, statement: str, rows: list):
+        raise NotImplementedError
+
+    def publish_change(self, cursor, origin: str, scope: str, target: str):
+        raise NotImplementedError
+
+    def stream_cursor(self, conn, name: str, batch_size: int):
+        """Cursor que recorre el resultado sin cargarlo entero en memoria"""
+        return conn.cursor()
+
+
+class SQLiteBackend(SQLBackend):
+    name = 'sqlite'
+
+    NEXT_DUE_SQL = 'COALESCE(last_watered_at + watering_frequency_days * 86400, created_at)'
+    NEXT_DUE_FROM_PARAM_SQL = '? + watering_frequency_days * 86400'
+    # Una lista JSON como único parámetro: el texto de la sentencia no depende de cuántos ids haya
+    IN_LIST_SQL = 'IN (SELECT value FROM json_each(?))'
+    LAST_DAY_SQL = "DATE(MAX(w.watered_at), 'unixepoch')"
+    DAY_SQL = "DATE(w.watered_at, 'unixepoch')"
+    # 0 = domingo en ambos motores
+    WEEKDAY_SQL = "CAST(strftime('%w', day) AS INTEGER)"
+
+    INSERT_PLANT = '''
+        INSERT INTO plants (user_id, name, watering_frequency_days, plant_type, next_due_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    INSERT_WATERING = 'INSERT INTO watering_log (plant_id, user_id, watered_at) VALUES (?, ?, ?)'
+    INSERT_WATERINGS = INSERT_WATERING
+    APPLY_WATERINGS = '''
+        UPDATE plants
+        SET watering_frequency_days = ?,
+            last_watered_at = ?,
+            watering_count = watering_count + 1,
+            next_due_at = ?
+        WHERE id = ?
+    '''
+    INSERT_PHOTO = 'INSERT INTO plant_photos (plant_id, file_id, caption, uploaded_at) VALUES (?, ?, ?, ?)'
+    INSERT_GROUP = 'INSERT INTO plant_groups (user_id, name, created_at) VALUES (?, ?, ?)'
+    # BEGIN IMMEDIATE ya serializa a los escritores
+    LOCK_PLANT_BY_ID = '''
+        SELECT id, name, watering_frequency_days, last_watered_at
+        FROM plants
+        WHERE user_id = ? AND id = ?
+    '''
+    LOCK_PLANT_BY_NAME = '''
+        SELECT id, name, watering_frequency_days, last_watered_at
+        FROM plants
+        WHERE user_id = ? AND name = ?
+    '''
+    LOCK_PLANTS = 'SELECT id, user_id, name, watering_frequency_days, last_watered_at FROM plants WHERE id {in_list}'
+    LOCK_USER_PLANTS = '''
+        SELECT id, user_id, name, watering_frequency_days, last_watered_at
+        FROM plants WHERE id {in_list} AND user_id = ?
+    '''
+    BACKFILL_WATERING_SUMMARY = '''
+        UPDATE plants
+        SET last_watered_at = (SELECT MAX(watered_at) FROM watering_log WHERE plant_id = plants.id),
+            watering_count = (SELECT COUNT(*) FROM watering_log WHERE plant_id = plants.id)
+        WHERE id > ? AND id <= ?
+    '''
+    _DUE_PLANTS_BY_USER = f'''
+        SELECT {SQLBackend._PLANT_COLUMNS}
+        FROM user_settings s
+        JOIN plants p ON p.user_id = s.user_id AND p.next_due_at < ?
+        WHERE s.notifications_enabled = 1 {{user_filter}}
+        ORDER BY s.user_id, p.next_due_at
+    '''
+    DUE_PLANTS_BY_USER = _DUE_PLANTS_BY_USER.format(user_filter='')
+    DUE_PLANTS_BY_USERS = _DUE_PLANTS_BY_USER.format(user_filter='AND s.user_id {in_list}')
+    INSERT_CHANGE = 'INSERT INTO change_log (origin, scope, user_id, changed_at) VALUES (?, ?, ?, ?)'
+    CHANGE_CURSOR = 'SELECT COALESCE(MAX(id), 0) FROM change_log'
+    CHANGES_SINCE = 'SELECT id, origin, scope, user_id FROM change_log WHERE id > ? ORDER BY id LIMIT ?'
+    PURGE_CHANGE_LOG = 'DELETE FROM change_log WHERE changed_at < ?'
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.pragmas = self._pragmas()
+
+    def _pragmas(self) -> dict:
+        profile = os.getenv('SQLITE_PROFILE', 'wal')
+        if profile not in SQLITE_PROFILES:
+            logger.warning(f'Perfil SQLite desconocido "{profile}", se usa "wal"')
+            profile = 'wal'
+        pragmas = dict(SQLITE_PROFILES[profile])
+        for name in SQLITE_PROFILES['wal']:
+            value = os.getenv(f'SQLITE_{name.upper()}')
+            if value is not None:
+                pragmas[name] = value
+        logger.info(f'Perfil SQLite "{profile}": {pragmas}')
+        return pragmas
+
+    def create_pool(self):
+        return ThreadLocalPool(self.connect)
+
+    def connect(self):
+        # Cada hilo usa solo la suya, pero el pool la cierra desde otro hilo al terminar
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def is_connection_error(self, error: Exception) -> bool:
+        return isinstance(error, sqlite3.ProgrammingError)
+
+    def timestamp(self, value: datetime):
+        return int((value - SQLITE_EPOCH).total_seconds())
+
+    def from_timestamp(self, value) -> Optional[datetime]:
+        return None if value is None else SQLITE_EPOCH + timedelta(seconds=value)
+
+    def id_list(self, values: Sequence[int]):
+        return json.dumps(list(values))
+
+    def begin_write(self, cursor):
+        # Toma el bloqueo de escritura desde el principio en vez de al primer UPDATE
+        cursor.execute('BEGIN IMMEDIATE')
+
+    def insert(self, cursor, statement: str, params) -> int:
+        cursor.execute(statement, params)
+        return cursor.lastrowid
+
+    def execute_batch(self, cursor, statement: str, rows: list):
+        cursor.executemany(statement, rows)
+
+    def publish_change(self, cursor, origin: str, scope: str, target: str):
+        # Sin LISTEN/NOTIFY, los demás procesos sondean change_log
+        cursor.execute(self.INSERT_CHANGE, (origin, scope, target, self.timestamp(datetime.now())))
+
+    def add_column(self, cursor, table: str, column: str, definition: str) -> bool:
+        try:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def is_undefined_table(self, error: Exception) -> bool:
+        return isinstance(error, sqlite3.OperationalError) and 'no such table' in str(error)
+
+    def maintain(self, conn):
+        conn.execute('PRAGMA optimize')
+        if str(self.pragmas.get('journal_mode', '')).upper() == 'WAL':
+            busy, frames, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+            logger.info(f'Checkpoint del WAL: {checkpointed}/{frames} páginas copiadas (ocupado={busy})')
+
+    def create_tables(self, cursor):
+        # Segundos desde SQLITE_EPOCH en hora local, como timestamp()
+        now = "(CAST(strftime('%s', 'now', 'localtime') AS INTEGER))"
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS plants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                watering_frequency_days INTEGER NOT NULL,
+                plant_type TEXT DEFAULT 'moderada',
+                seasonal_adjustment INTEGER DEFAULT 1,
+                custom_dryness_level INTEGER DEFAULT 50,
+                last_watered_at TIMESTAMP,
+                watering_count INTEGER NOT NULL DEFAULT 0,
+                next_due_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT {now}
+            )
+        ''')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS watering_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plant_id INTEGER NOT NULL,
+                user_id INTEGER,
+                watered_at TIMESTAMP DEFAULT {now},
+                FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
+            )
+        ''')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS plant_photos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plant_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                caption TEXT,
+                uploaded_at TIMESTAMP DEFAULT {now},
+                FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
+            )
+        ''')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS plant_groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT {now}
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                notifications_enabled INTEGER DEFAULT 1,
+                notification_time TEXT DEFAULT '09:00',
+                timezone TEXT DEFAULT 'UTC'
+            )
+        ''')
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS notification_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                due_bucket TEXT NOT NULL,
+                plant_hash TEXT NOT NULL,
+                sent_at TIMESTAMP DEFAULT {now},
+                UNIQUE (user_id, due_bucket, plant_hash)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_workers (
+                worker_id TEXT PRIMARY KEY,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shard_leases (
+                shard INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                changed_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+
+class PostgresBackend(SQLBackend):
+    name = 'postgres'
+
+    NEXT_DUE_SQL = "COALESCE(last_watered_at + watering_frequency_days * INTERVAL '1 day', created_at)"
+    NEXT_DUE_FROM_PARAM_SQL = "? + watering_frequency_days * INTERVAL '1 day'"
+    IN_LIST_SQL = '= ANY(?)'
+    LAST_DAY_SQL = "TO_CHAR(MAX(w.watered_at), 'YYYY-MM-DD')"
+    DAY_SQL = "TO_CHAR(w.watered_at, 'YYYY-MM-DD')"
+    WEEKDAY_SQL = 'CAST(EXTRACT(DOW FROM CAST(day AS DATE)) AS INTEGER)'
+
+    INSERT_PLANT = '''
+        INSERT INTO plants (user_id, name, watering_frequency_days, plant_type, next_due_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?) RETURNING id
+    '''
+    INSERT_WATERING = 'INSERT INTO watering_log (plant_id, user_id, watered_at) VALUES (?, ?, ?) RETURNING id'
+    # Plantillas de execute_values: todas las filas en una sola sentencia
+    INSERT_WATERINGS = 'INSERT INTO watering_log (plant_id, user_id, watered_at) VALUES %s'
+    APPLY_WATERINGS = '''
+        UPDATE plants p
+        SET watering_frequency_days = v.frequency,
+            last_watered_at = v.watered_at,
+            watering_count = p.watering_count + 1,
+            next_due_at = v.next_due_at
+        FROM (VALUES %s) AS v(frequency, watered_at, next_due_at, id)
+        WHERE p.id = v.id
+    '''
+    INSERT_PHOTO = '''
+        INSERT INTO plant_photos (plant_id, file_id, caption, uploaded_at)
+        VALUES (?, ?, ?, ?) RETURNING id
+    '''
+    INSERT_GROUP = 'INSERT INTO plant_groups (user_id, name, created_at) VALUES (?, ?, ?) RETURNING id'
+    # Dos toques seguidos se serializan en el FOR UPDATE y el segundo ve el riego del primero
+    LOCK_PLANT_BY_ID = '''
+        SELECT id, name, watering_frequency_days, last_watered_at
+        FROM plants
+        WHERE user_id = ? AND id = ?
+        FOR UPDATE
+    '''
+    LOCK_PLANT_BY_NAME = '''
+        SELECT id, name, watering_frequency_days, last_watered_at
+        FROM plants
+        WHERE user_id = ? AND name = ?
+        FOR UPDATE
+    '''
+    LOCK_PLANTS = '''
+        SELECT id, user_id, name, watering_frequency_days, last_watered_at
+        FROM plants WHERE id {in_list}
+        ORDER BY id FOR UPDATE
+    '''
+    LOCK_USER_PLANTS = '''
+        SELECT id, user_id, name, watering_frequency_days, last_watered_at
+        FROM plants WHERE id {in_list} AND user_id = ?
+        ORDER BY id FOR UPDATE
+    '''
+    BACKFILL_WATERING_SUMMARY = '''
+        UPDATE plants p
+        SET last_watered_at = w.last_watered, watering_count = w.total
+        FROM (
+            SELECT plant_id, MAX(watered_at) AS last_watered, COUNT(*) AS total
+            FROM watering_log
+            WHERE plant_id > ? AND plant_id <= ?
+            GROUP BY plant_id
+        ) w
+        WHERE w.plant_id = p.id
+    '''
+    # LATERAL recorre el índice (user_id, next_due_at) de cada usuario notificable y
+    # el orden por usuario sale del índice de user_settings (incremental sort)
+    _DUE_PLANTS_BY_USER = '''
+        SELECT d.id, s.user_id, d.name, d.watering_frequency_days, d.last_watered_at, d.next_due_at, d.plant_type
+        FROM user_settings s
+        CROSS JOIN LATERAL (
+            SELECT p.id, p.name, p.watering_frequency_days, p.last_watered_at, p.next_due_at, p.plant_type
+            FROM plants p
+            WHERE p.user_id = s.user_id AND p.next_due_at < ?
+        ) d
+        WHERE s.notifications_enabled = 1 {user_filter}
+        ORDER BY s.user_id, d.next_due_at
+    '''
+    DUE_PLANTS_BY_USER = _DUE_PLANTS_BY_USER.format(user_filter='')
+    DUE_PLANTS_BY_USERS = _DUE_PLANTS_BY_USER.format(user_filter='AND s.user_id {in_list}')
+    NOTIFY_CHANGE = 'SELECT pg_notify(?, ?)'
+    LOCK_SCHEMA = 'SELECT pg_advisory_lock(?)'
+    UNLOCK_SCHEMA = 'SELECT pg_advisory_unlock(?)'
+    COLUMN_EXISTS = '''
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = ? AND column_name = ?
+    '''
+
+    def __init__(self, database_url: str):
+        import psycopg2
+        from psycopg2.extras import RealDictCursor, execute_values
+        self.psycopg2 = psycopg2
+        self.RealDictCursor = RealDictCursor
+        self._execute_values = execute_values
+        self.database_url = database_url
+
+    @staticmethod
+    def _compile(statement: str) -> str:
+        # Las plantillas de execute_values ya traen su '%s'
+        if 'VALUES %s' in statement:
+            return statement
+        return statement.replace('%', '%%').replace('?', '%s')
+
+    def create_pool(self):
+        pool = ConnectionPool(
+            self.connect,
+            min_size=int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+            max_size=int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            max_idle=float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            check_after=float(os.getenv('DB_POOL_CHECK_AFTER', 30)),
+        )
+        logger.info(f'Pool de conexiones PostgreSQL: min={pool.min_size}, max={pool.max_size}')
+        return pool
+
+    def connect(self):
+        return self.psycopg2.connect(self.database_url)
+
+    def is_connection_error(self, error: Exception) -> bool:
+        return isinstance(error, (self.psycopg2.OperationalError, self.psycopg2.InterfaceError))
+
+    def timestamp(self, value: datetime):
+        return value
+
+    def from_timestamp(self, value) -> Optional[datetime]:
+        return value
+
+    def id_list(self, values: Sequence[int]):
+        return list(values)
+
+    def insert(self, cursor, statement: str, params) -> int:
+        cursor.execute(statement, params)
+        return cursor.fetchone()[0]
+
+    def execute_batch(self, cursor, statement: str, rows: list):
+        self._execute_values(cursor, statement, rows)
+
+    def publish_change(self, cursor, origin: str, scope: str, target: str):
+        # El NOTIFY solo se entrega si la transacción se confirma
+        cursor.execute(self.NOTIFY_CHANGE, (CHANGES_CHANNEL, f'{origin}:{scope}:{target}'))
+
+    def stream_cursor(self, conn, name: str, batch_size: int):
+        cursor = conn.cursor(name=name)
+        cursor.itersize = batch_size
+        return cursor
+
+    def add_column(self, cursor, table: str, column: str, definition: str) -> bool:
+        cursor.execute(self.COLUMN_EXISTS, (table, column))
+        if cursor.fetchone():
+            return False
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+
+    def is_undefined_table(self, error: Exception) -> bool:
+        return getattr(error, 'pgcode', None) == '42P01'
+
+    def lock_schema(self, cursor):
+        # De sesión y no de transacción: los rellenos por lotes confirman varias veces
+        cursor.execute(self.LOCK_SCHEMA, (SCHEMA_LOCK_KEY,))
+
+    def unlock_schema(self, cursor):
+        cursor.execute(self.UNLOCK_SCHEMA, (SCHEMA_LOCK_KEY,))
+
+    def maintain(self, conn):
+        pass
+
+    def create_tables(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plants (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                name TEXT NOT NULL,
+                watering_frequency_days INTEGER NOT NULL,
+                plant_type TEXT DEFAULT 'moderada',
+                seasonal_adjustment BOOLEAN DEFAULT TRUE,
+                custom_dryness_level INTEGER DEFAULT 50,
+                group_id INTEGER,
+                photo_file_id TEXT,
+                last_watered_at TIMESTAMP,
+                watering_count INTEGER NOT NULL DEFAULT 0,
+                next_due_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS watering_log (
+                id SERIAL PRIMARY KEY,
+                plant_id INTEGER NOT NULL,
+                user_id BIGINT,
+                watered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plant_photos (
+                id SERIAL PRIMARY KEY,
+                plant_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                caption TEXT,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (plant_id) REFERENCES plants (id) ON DELETE CASCADE
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plant_groups (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                name TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id BIGINT PRIMARY KEY,
+                notifications_enabled INTEGER DEFAULT 1,
+                notification_time TEXT DEFAULT '09:00',
+                timezone TEXT DEFAULT 'UTC'
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_log (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                due_bucket TEXT NOT NULL,
+                plant_hash TEXT NOT NULL,
+                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (user_id, due_bucket, plant_hash)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_workers (
+                worker_id TEXT PRIMARY KEY,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shard_leases (
+                shard INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+
+def create_backend(database_url: Optional[str], db_path: str) -> SQLBackend:
+    if database_url:
+        return PostgresBackend(database_url)
+    return SQLiteBackend(db_path)
@@ -0,0 +1,276 @@
+"""
+Pools de conexiones reutilizables para Database
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+def _ping(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    finally:
+        cursor.close()
+    conn.rollback()
+
+
+class ConnectionPool:
+    """Pool thread-safe de conexiones de larga duración (PostgreSQL).
+
+    Las conexiones se entregan en orden LIFO para reutilizar siempre la más
+    reciente; las que pasan más de `max_idle` segundos sin uso se cierran
+    mientras haya más de `min_size` abiertas, y las que llevan más de
+    `check_after` segundos inactivas se verifican con `SELECT 1` antes de
+    entregarse.
+    """
+
+    def __init__(self, connect, min_size: int = 1, max_size: int = 10, timeout: float = 30.0,
+                 max_idle: float = 300.0, check_after: float = 30.0, check=_ping):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f'Tamaños de pool inválidos: min={min_size}, max={max_size}')
+
+        self._connect = connect
+        self._check = check
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, último uso)
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            'opens': 0,
+            'closes': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'discards': 0,
+            'health_check_failures': 0,
+        }
+
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            conn = self._open()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['opens'] += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f'Error cerrando conexión del pool: {e}')
+        with self._cond:
+            self._stats['closes'] += 1
+
+    def _prune_idle(self, now: float) -> list:
+        # Se llama con el lock tomado; devuelve las conexiones a cerrar fuera de él
+        expired = []
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            expired.append(conn)
+        return expired
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        conn = None
+        last_used = None
+
+        with self._cond:
+            self._stats['checkouts'] += 1
+            while True:
+                if self._closed:
+                    raise PoolError('El pool de conexiones está cerrado')
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                now = time.monotonic()
+                if waited_since is None:
+                    waited_since = now
+                    self._stats['waits'] += 1
+                if now >= deadline:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += now - waited_since
+                    raise PoolTimeout(f'No hay conexiones libres tras {self.timeout}s (max_size={self.max_size})')
+                self._cond.wait(deadline - now)
+
+            if waited_since is not None:
+                self._stats['wait_time'] += time.monotonic() - waited_since
+            expired = self._prune_idle(time.monotonic())
+
+        for old in expired:
+            self._close(old)
+
+        if conn is None:
+            return self._open()
+
+        if getattr(conn, 'closed', 0) or (time.monotonic() - last_used > self.check_after and not self._healthy(conn)):
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            self._close(conn)
+            return self._open()
+
+        return conn
+
+    def _healthy(self, conn) -> bool:
+        try:
+            self._check(conn)
+            return True
+        except Exception as e:
+            logger.warning(f'Conexión del pool descartada por health check: {e}')
+            return False
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard:
+            if getattr(conn, 'closed', 0):
+                discard = True
+            else:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                if discard:
+                    self._stats['discards'] += 1
+                expired = [conn]
+            else:
+                now = time.monotonic()
+                self._idle.append((conn, now))
+                expired = self._prune_idle(now)
+            self._cond.notify()
+
+        for old in expired:
+            self._close(old)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['min_size'] = self.min_size
+            stats['max_size'] = self.max_size
+        stats['wait_time'] = round(stats['wait_time'], 4)
+        return stats
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+
+class ThreadLocalPool:
+    """Una conexión persistente por hilo (SQLite).
+
+    SQLite no gana nada compartiendo conexiones entre hilos, pero abrir el
+    fichero en cada consulta sí cuesta: cada hilo conserva la suya hasta que
+    se descarta por error o se cierra el pool.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._closed = False
+        self._stats = {
+            'opens': 0,
+            'closes': 0,
+            'checkouts': 0,
+            'discards': 0,
+        }
+
+    def getconn(self):
+        if self._closed:
+            raise PoolError('El pool de conexiones está cerrado')
+
+        conn = getattr(self._local, 'conn', None)
+        with self._lock:
+            self._stats['checkouts'] += 1
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.add(conn)
+                self._stats['opens'] += 1
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        if discard:
+            if getattr(self._local, 'conn', None) is conn:
+                self._local.conn = None
+            with self._lock:
+                self._connections.discard(conn)
+                self._stats['discards'] += 1
+                self._stats['closes'] += 1
+            try:
+                conn.close()
+            except Exception as e:
+                logger.debug(f'Error cerrando conexión SQLite: {e}')
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._connections)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            connections = list(self._connections)
+            self._connections.clear()
+            self._stats['closes'] += len(connections)
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.debug(f'Error cerrando conexión SQLite: {e}')
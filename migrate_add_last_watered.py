@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Script de migración para rellenar last_watered_at, watering_count y next_due_at en plants
+
+El bot ya lo hace automáticamente la primera vez que arranca con la columna
+nueva; este script permite lanzarlo a mano (o repetirlo si los datos se
+descuadraron) sobre SQLite o PostgreSQL según DATABASE_URL.
+"""
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+from database import Database
+
+print("Conectando a la base de datos...")
+db = Database()
+
+print("Recalculando último riego, número de riegos y próximo riego de cada planta...")
+db.backfill_watering_summary()
+db.close()
+
+print("\n✅ Migración completada exitosamente!")
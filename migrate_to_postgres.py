@@ -1,141 +1,381 @@
 #!/usr/bin/env python3
 """
 Script para migrar datos de SQLite a PostgreSQL (Supabase)
-Ejecutar solo una vez después de configurar Supabase
+
+Lee cada tabla de SQLite por bloques en orden de clave (nunca la tabla entera en
+memoria) y los escribe con execute_values (o COPY con --copy). Cada bloque se
+confirma junto con su punto de control en sqlite_import_state, así que si se corta
+se puede continuar con --resume sin repetir ni perder filas. Al final compara el
+número de filas y una suma de comprobación de cada tabla en ambos lados.
+
+Uso:
+  python migrate_to_postgres.py [--sqlite plants.db] [--chunk-size 5000] [--resume] [--copy]
+  python migrate_to_postgres.py --verify-only
 """
 
-import sqlite3
+import argparse
+import hashlib
+import io
 import os
+import sqlite3
 import sys
+import time
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from db_backends import SQLITE_EPOCH
+
 load_dotenv()
 
-DATABASE_URL = os.getenv('DATABASE_URL')
+# (tabla, clave) en orden de dependencias: los riegos y fotos apuntan a plantas
+TABLES = [
+    ('plant_groups', 'id'),
+    ('plants', 'id'),
+    ('watering_log', 'id'),
+    ('plant_photos', 'id'),
+    ('user_settings', 'user_id'),
+]
+# Tablas con id SERIAL cuya secuencia hay que adelantar tras insertar ids explícitos
+SERIAL_TABLES = ['plant_groups', 'plants', 'watering_log', 'plant_photos']
+PROGRESS_INTERVAL = 5  # segundos entre líneas de progreso
 
-if not DATABASE_URL:
-    print("❌ Error: DATABASE_URL no está configurada en el archivo .env")
-    print("Por favor, añade la URL de Supabase en el archivo .env")
-    sys.exit(1)
 
-try:
-    import psycopg2
-except ImportError:
-    print("❌ Error: psycopg2 no está instalado")
-    print("Ejecuta: pip install psycopg2-binary")
-    sys.exit(1)
+def pg_columns(pg_cursor, table: str) -> dict:
+    """{columna: tipo} de una tabla de PostgreSQL"""
+    pg_cursor.execute('''
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    ''', (table,))
+    return dict(pg_cursor.fetchall())
 
-SQLITE_DB = 'plants.db'
 
-if not os.path.exists(SQLITE_DB):
-    print(f"❌ Error: No se encuentra el archivo {SQLITE_DB}")
-    print("No hay datos para migrar. Puedes empezar a usar Supabase directamente.")
-    sys.exit(0)
+def sqlite_columns(sqlite_conn, table: str) -> list:
+    return [row[1] for row in sqlite_conn.execute(f'PRAGMA table_info({table})')]
 
-print("🌱 Iniciando migración de SQLite a PostgreSQL (Supabase)...")
-print(f"📂 Origen: {SQLITE_DB}")
-print(f"🔗 Destino: Supabase PostgreSQL\n")
 
-sqlite_conn = sqlite3.connect(SQLITE_DB)
-sqlite_cursor = sqlite_conn.cursor()
+def common_columns(sqlite_conn, pg_cursor, table: str) -> tuple:
+    """Columnas de SQLite que también existen en PostgreSQL, y sus tipos allí"""
+    target = pg_columns(pg_cursor, table)
+    columns = [c for c in sqlite_columns(sqlite_conn, table) if c in target]
+    return columns, [target[c] for c in columns]
 
-pg_conn = psycopg2.connect(DATABASE_URL)
-pg_cursor = pg_conn.cursor()
 
-print("✅ Conexiones establecidas\n")
+def sqlite_timestamp(value):
+    """Fecha de SQLite como datetime: segundos desde SQLITE_EPOCH o, en una base sin
+    migrar, texto ISO"""
+    if isinstance(value, (int, float)):
+        return SQLITE_EPOCH + timedelta(seconds=value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
 
-print("📋 Migrando plantas...")
-sqlite_cursor.execute('SELECT id, user_id, name, watering_frequency_days, group_id, photo_file_id, created_at FROM plants')
-plants = sqlite_cursor.fetchall()
 
-for plant in plants:
-    plant_id, user_id, name, freq, group_id, photo_id, created_at = plant
-    pg_cursor.execute('''
-        INSERT INTO plants (id, user_id, name, watering_frequency_days, group_id, photo_file_id, created_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    ''', (plant_id, user_id, name, freq, group_id, photo_id, created_at))
+def convert_row(row, types) -> tuple:
+    # SQLite guarda los booleanos como 0/1 y las fechas como segundos; el resto lo
+    # convierte PostgreSQL desde el texto
+    return tuple(
+        value if value is None
+        else bool(value) if kind == 'boolean'
+        else sqlite_timestamp(value) if kind.startswith('timestamp')
+        else value
+        for value, kind in zip(row, types)
+    )
 
-print(f"   ✓ {len(plants)} plantas migradas")
 
-print("💧 Migrando historial de riego...")
-sqlite_cursor.execute('SELECT id, plant_id, watered_at FROM watering_log')
-waterings = sqlite_cursor.fetchall()
+def normalize(value, kind) -> str:
+    """Representación común de un valor de SQLite o de PostgreSQL para la suma de comprobación"""
+    if value is None:
+        return ''
+    if kind.startswith('timestamp'):
+        return sqlite_timestamp(value).isoformat(sep=' ')
+    if kind == 'boolean':
+        return str(int(bool(value)))
+    return str(value)
 
-for watering in waterings:
-    watering_id, plant_id, watered_at = watering
-    pg_cursor.execute('''
-        INSERT INTO watering_log (id, plant_id, watered_at)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    ''', (watering_id, plant_id, watered_at))
 
-print(f"   ✓ {len(waterings)} registros de riego migrados")
+def backfill_missing(sqlite_conn, pg_conn, backend, migrations) -> list:
+    """Rellena en PostgreSQL las columnas derivadas que un plants.db sin migrar no tiene
+    (y que por eso no se copiaron). Devuelve las columnas rellenadas."""
+    plants = sqlite_columns(sqlite_conn, 'plants')
+    waterings = sqlite_columns(sqlite_conn, 'watering_log')
+    # En orden: next_due_at sale de last_watered_at
+    backfills = [
+        ('plants.last_watered_at', 'last_watered_at' in plants, backend.BACKFILL_WATERING_SUMMARY, 'plants'),
+        ('plants.next_due_at', 'next_due_at' in plants, backend.BACKFILL_NEXT_DUE, 'plants'),
+        ('watering_log.user_id', 'user_id' in waterings, backend.BACKFILL_WATERING_USER, 'watering_log'),
+    ]
+    filled = []
+    for column, copied, statement, table in backfills:
+        if not copied:
+            migrations.backfill_in_batches(backend, pg_conn, statement, table=table)
+            filled.append(column)
+    return filled
 
-print("📸 Migrando fotos de plantas...")
-sqlite_cursor.execute('SELECT id, plant_id, file_id, caption, uploaded_at FROM plant_photos')
-photos = sqlite_cursor.fetchall()
 
-for photo in photos:
-    photo_id, plant_id, file_id, caption, uploaded_at = photo
-    pg_cursor.execute('''
-        INSERT INTO plant_photos (id, plant_id, file_id, caption, uploaded_at)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    ''', (photo_id, plant_id, file_id, caption, uploaded_at))
+def read_chunks(fetch, chunk_size: int, last_key):
+    """Genera bloques de filas leídas por clave (keyset) a partir de `last_key`"""
+    while True:
+        rows = fetch(last_key, chunk_size)
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][0]
 
-print(f"   ✓ {len(photos)} fotos migradas")
 
-print("📁 Migrando grupos de plantas...")
-sqlite_cursor.execute('SELECT id, user_id, name, created_at FROM plant_groups')
-groups = sqlite_cursor.fetchall()
+def sqlite_fetcher(sqlite_conn, table: str, key: str, columns: list, upper=None):
+    select = ', '.join([key] + [c for c in columns if c != key])
+    limit = '' if upper is None else f' AND {key} <= {int(upper)}'
 
-for group in groups:
-    group_id, user_id, name, created_at = group
-    pg_cursor.execute('''
-        INSERT INTO plant_groups (id, user_id, name, created_at)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-    ''', (group_id, user_id, name, created_at))
+    def fetch(last_key, size):
+        return sqlite_conn.execute(
+            f'SELECT {select} FROM {table} WHERE {key} > ?{limit} ORDER BY {key} LIMIT ?',
+            (last_key, size)
+        ).fetchall()
+    return fetch
+
+
+def pg_fetcher(pg_conn, table: str, key: str, columns: list, upper):
+    select = ', '.join([key] + [c for c in columns if c != key])
+
+    def fetch(last_key, size):
+        with pg_conn.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {select} FROM {table} WHERE {key} > %s AND {key} <= %s ORDER BY {key} LIMIT %s',
+                (last_key, upper, size)
+            )
+            return cursor.fetchall()
+    return fetch
 
-print(f"   ✓ {len(groups)} grupos migrados")
 
-print("⚙️  Migrando configuración de usuarios...")
-sqlite_cursor.execute('SELECT user_id, notifications_enabled, notification_time, timezone FROM user_settings')
-settings = sqlite_cursor.fetchall()
+def write_values(pg_cursor, execute_values, table: str, key: str, columns: list, rows: list):
+    conflict = f'ON CONFLICT ({key}) DO NOTHING'
+    execute_values(
+        pg_cursor,
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES %s {conflict}',
+        rows, page_size=len(rows)
+    )
 
-for setting in settings:
-    user_id, notif_enabled, notif_time, timezone = setting
+
+def copy_value(value) -> str:
+    # Formato de texto de COPY: \N es NULL y se escapan los separadores
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def write_copy(pg_cursor, table: str, columns: list, rows: list):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    pg_cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', buffer)
+
+
+def ensure_state_table(pg_conn):
+    with pg_conn.cursor() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sqlite_import_state (
+                table_name TEXT PRIMARY KEY,
+                last_key BIGINT NOT NULL,
+                rows BIGINT NOT NULL,
+                finished BOOLEAN NOT NULL DEFAULT FALSE
+            )
+        ''')
+    pg_conn.commit()
+
+
+def load_state(pg_conn) -> dict:
+    with pg_conn.cursor() as cursor:
+        cursor.execute('SELECT table_name, last_key, rows, finished FROM sqlite_import_state')
+        return {table: (last_key, rows, finished) for table, last_key, rows, finished in cursor.fetchall()}
+
+
+def save_state(pg_cursor, table: str, last_key, rows: int, finished: bool = False):
     pg_cursor.execute('''
-        INSERT INTO user_settings (user_id, notifications_enabled, notification_time, timezone)
+        INSERT INTO sqlite_import_state (table_name, last_key, rows, finished)
         VALUES (%s, %s, %s, %s)
-        ON CONFLICT (user_id) DO UPDATE 
-        SET notifications_enabled = %s, notification_time = %s, timezone = %s
-    ''', (user_id, notif_enabled, notif_time, timezone, notif_enabled, notif_time, timezone))
-
-print(f"   ✓ {len(settings)} configuraciones migradas")
-
-print("\n🔄 Actualizando secuencias de IDs...")
-pg_cursor.execute("SELECT setval('plants_id_seq', (SELECT MAX(id) FROM plants))")
-pg_cursor.execute("SELECT setval('watering_log_id_seq', (SELECT MAX(id) FROM watering_log))")
-pg_cursor.execute("SELECT setval('plant_photos_id_seq', (SELECT MAX(id) FROM plant_photos))")
-pg_cursor.execute("SELECT setval('plant_groups_id_seq', (SELECT MAX(id) FROM plant_groups))")
-print("   ✓ Secuencias actualizadas")
-
-pg_conn.commit()
-
-sqlite_conn.close()
-pg_conn.close()
-
-print("\n✅ ¡Migración completada exitosamente!")
-print("\n📊 Resumen:")
-print(f"   • {len(plants)} plantas")
-print(f"   • {len(waterings)} registros de riego")
-print(f"   • {len(photos)} fotos")
-print(f"   • {len(groups)} grupos")
-print(f"   • {len(settings)} configuraciones de usuario")
-
-print("\n🎉 Ahora puedes:")
-print("   1. Verificar los datos en el dashboard de Supabase")
-print("   2. Desplegar el bot en Render con la variable DATABASE_URL configurada")
-print("   3. Opcionalmente, hacer backup de plants.db y eliminarlo")
+        ON CONFLICT (table_name) DO UPDATE
+        SET last_key = excluded.last_key, rows = excluded.rows, finished = excluded.finished
+    ''', (table, last_key, rows, finished))
+
+
+def migrate_table(sqlite_conn, pg_conn, execute_values, table: str, key: str, args, state: dict) -> int:
+    """Copia una tabla por bloques y devuelve las filas escritas en esta ejecución"""
+    with pg_conn.cursor() as cursor:
+        columns, types = common_columns(sqlite_conn, cursor, table)
+    ordered = [key] + [c for c in columns if c != key]
+    types = [types[columns.index(c)] for c in ordered]
+
+    last_key, done, finished = state.get(table, (-1, 0, False)) if args.resume else (-1, 0, False)
+    if finished:
+        print(f"   ✓ {table}: ya migrada ({done} filas)")
+        return 0
+    total = sqlite_conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {key} > ?', (last_key,)).fetchone()[0] + done
+    if done:
+        print(f"   ↻ {table}: se continúa tras {key}={last_key} ({done}/{total} filas)")
+
+    start = last_report = time.monotonic()
+    migrated_now = 0
+    for rows in read_chunks(sqlite_fetcher(sqlite_conn, table, key, ordered), args.chunk_size, last_key):
+        rows = [convert_row(row, types) for row in rows]
+        with pg_conn.cursor() as cursor:
+            if args.copy:
+                write_copy(cursor, table, ordered, rows)
+            else:
+                write_values(cursor, execute_values, table, key, ordered, rows)
+            last_key = rows[-1][0]
+            done += len(rows)
+            # El punto de control va en la misma transacción que el bloque
+            save_state(cursor, table, last_key, done)
+        pg_conn.commit()
+        migrated_now += len(rows)
+
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            rate = migrated_now / (now - start)
+            print(f"     {table}: {done}/{total} filas ({rate:,.0f} filas/s)")
+            last_report = now
+
+    with pg_conn.cursor() as cursor:
+        save_state(cursor, table, last_key, done, finished=True)
+    pg_conn.commit()
+    elapsed = time.monotonic() - start
+    rate = migrated_now / elapsed if elapsed > 0 else 0
+    print(f"   ✓ {table}: {done} filas ({rate:,.0f} filas/s)")
+    return migrated_now
+
+
+def checksum(fetch, types, chunk_size: int) -> tuple:
+    digest = hashlib.sha256()
+    count = 0
+    for rows in read_chunks(fetch, chunk_size, -1):
+        for row in rows:
+            digest.update('\x1f'.join(normalize(v, k) for v, k in zip(row, types)).encode())
+            digest.update(b'\x1e')
+            count += 1
+    return count, digest.hexdigest()
+
+
+def verify(sqlite_conn, pg_conn, args) -> bool:
+    """Compara filas y suma de comprobación de cada tabla (en PostgreSQL, solo hasta la
+    última clave de SQLite: las filas que el bot haya creado después no cuentan)"""
+    print("\n🔍 Verificando...")
+    ok = True
+    for table, key in TABLES:
+        with pg_conn.cursor() as cursor:
+            columns, types = common_columns(sqlite_conn, cursor, table)
+        ordered = [key] + [c for c in columns if c != key]
+        types = [types[columns.index(c)] for c in ordered]
+        upper = sqlite_conn.execute(f'SELECT COALESCE(MAX({key}), 0) FROM {table}').fetchone()[0]
+
+        source = checksum(sqlite_fetcher(sqlite_conn, table, key, ordered, upper), types, args.chunk_size)
+        target = checksum(pg_fetcher(pg_conn, table, key, ordered, upper), types, args.chunk_size)
+        pg_conn.rollback()
+        if source == target:
+            print(f"   ✓ {table}: {source[0]} filas, checksum {source[1][:12]}")
+        else:
+            ok = False
+            print(f"   ❌ {table}: SQLite {source[0]} filas ({source[1][:12]}), "
+                  f"PostgreSQL {target[0]} filas ({target[1][:12]})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migra los datos de SQLite a PostgreSQL (Supabase)')
+    parser.add_argument('--sqlite', default='plants.db', help='fichero SQLite de origen')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='filas por bloque')
+    parser.add_argument('--resume', action='store_true', help='continúa desde el último punto de control')
+    parser.add_argument('--copy', action='store_true',
+                        help='usa COPY (más rápido; solo con tablas de destino vacías)')
+    parser.add_argument('--verify-only', action='store_true', help='solo compara origen y destino')
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        print("❌ Error: DATABASE_URL no está configurada en el archivo .env")
+        print("Por favor, añade la URL de Supabase en el archivo .env")
+        sys.exit(1)
+
+    try:
+        import psycopg2
+        from psycopg2.extras import execute_values
+    except ImportError:
+        print("❌ Error: psycopg2 no está instalado")
+        print("Ejecuta: pip install psycopg2-binary")
+        sys.exit(1)
+
+    if not os.path.exists(args.sqlite):
+        print(f"❌ Error: No se encuentra el archivo {args.sqlite}")
+        print("No hay datos para migrar. Puedes empezar a usar Supabase directamente.")
+        sys.exit(0)
+
+    import migrations
+    import user_stats
+    from db_backends import PostgresBackend
+
+    print("🌱 Iniciando migración de SQLite a PostgreSQL (Supabase)...")
+    print(f"📂 Origen: {args.sqlite}")
+    print("🔗 Destino: Supabase PostgreSQL\n")
+
+    sqlite_conn = sqlite3.connect(args.sqlite)
+    pg_conn = psycopg2.connect(database_url)
+    # Los textos de SQLite son UTF-8; COPY los envía tal cual
+    pg_conn.set_client_encoding('UTF8')
+    print("✅ Conexiones establecidas\n")
+
+    # Crea o actualiza las tablas de destino con las mismas migraciones que el bot
+    backend = PostgresBackend(database_url)
+    version = migrations.migrate(backend, pg_conn)
+    print(f"📐 Esquema de destino en la versión {version}\n")
+
+    if not args.verify_only:
+        ensure_state_table(pg_conn)
+        state = load_state(pg_conn)
+        if state and not args.resume:
+            print("⚠ Hay una migración anterior registrada; se empieza de cero (usa --resume para continuar)\n")
+
+        migrated = 0
+        start = time.monotonic()
+        for table, key in TABLES:
+            migrated += migrate_table(sqlite_conn, pg_conn, execute_values, table, key, args, state)
+
+        print("\n🔄 Actualizando secuencias de IDs...")
+        with pg_conn.cursor() as cursor:
+            for table in SERIAL_TABLES:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT MAX(id) FROM {table}), 1))"
+                )
+        pg_conn.commit()
+        print("   ✓ Secuencias actualizadas")
+
+        filled = backfill_missing(sqlite_conn, pg_conn, backend, migrations)
+        if filled:
+            print(f"\n🧮 Columnas que faltaban en el origen, recalculadas: {', '.join(filled)}")
+
+        # user_stats y watering_daily no se copian: se recalculan desde las plantas y riegos ya migrados
+        print("\n📈 Recalculando estadísticas por usuario...")
+        users = user_stats.rebuild(backend, pg_conn)
+        print(f"   ✓ {users} usuarios")
+
+        elapsed = time.monotonic() - start
+        print(f"\n📊 {migrated} filas en {elapsed:.1f}s ({migrated / elapsed if elapsed else 0:,.0f} filas/s)")
+
+    ok = verify(sqlite_conn, pg_conn, args)
+    sqlite_conn.close()
+    pg_conn.close()
+
+    if not ok:
+        print("\n❌ Origen y destino no coinciden; revisa las tablas marcadas")
+        sys.exit(1)
+
+    print("\n✅ ¡Migración completada exitosamente!")
+    print("\n🎉 Ahora puedes:")
+    print("   1. Verificar los datos en el dashboard de Supabase")
+    print("   2. Desplegar el bot en Render con la variable DATABASE_URL configurada")
+    print("   3. Opcionalmente, hacer backup de plants.db y eliminarlo")
+
+
+if __name__ == '__main__':
+    main()
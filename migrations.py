@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Migraciones del esquema con versión, para SQLite y PostgreSQL
+
+La tabla schema_version guarda la última migración aplicada. Al arrancar, si el
+esquema está al día, solo se lee esa fila. Si no, se aplican las migraciones
+pendientes en orden y se anota cada una al terminarla. Todas son idempotentes
+(IF NOT EXISTS, columnas que se comprueban antes de añadirlas...), así que una
+base de datos anterior a schema_version empieza desde 0 sin problemas.
+
+Los rellenos de tablas grandes van por rangos de id con un commit por lote
+(MIGRATION_BATCH_SIZE, MIGRATION_BATCH_PAUSE) para no bloquear al bot mientras tanto.
+
+Uso: python migrations.py [--status]
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', 5000))
+# Segundos de respiro entre lotes para que las escrituras del bot no esperen
+BATCH_PAUSE = float(os.getenv('MIGRATION_BATCH_PAUSE', 0))
+# Columnas de fecha de cada tabla, que en SQLite pasan de texto ISO a segundos (migración 10)
+TIMESTAMP_COLUMNS = {
+    'plants': ('last_watered_at', 'next_due_at', 'created_at'),
+    'watering_log': ('watered_at',),
+    'plant_photos': ('uploaded_at',),
+    'plant_groups': ('created_at',),
+    'notification_log': ('sent_at',),
+    'notification_workers': ('expires_at',),
+    'shard_leases': ('expires_at',),
+    'change_log': ('changed_at',),
+}
+# Las que rellenaba el DEFAULT CURRENT_TIMESTAMP de SQLite, que es UTC; el resto se guardaba
+# con datetime.now(), en hora local como las fechas de ahora
+UTC_TIMESTAMP_COLUMNS = {('plants', 'created_at'), ('plant_photos', 'uploaded_at'), ('plant_groups', 'created_at')}
+
+
+def backfill_in_batches(backend, conn, statement: str, table: str = 'plants', batch_size: int = None) -> int:
+    """Ejecuta `statement` (con parámetros id > ? AND id <= ?) por rangos de id de `table`,
+    confirmando tras cada rango. Devuelve el número de lotes."""
+    batch_size = batch_size or BATCH_SIZE
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM {table}')
+    low, high = cursor.fetchone()
+    conn.commit()
+    batches = 0
+    start = low - 1
+    while start < high:
+        cursor.execute(statement, (start, start + batch_size))
+        conn.commit()
+        batches += 1
+        start += batch_size
+        if batches % 20 == 0:
+            logger.info(f'  {table}: {min(start, high)}/{high}')
+        if BATCH_PAUSE:
+            time.sleep(BATCH_PAUSE)
+    return batches
+
+
+def _base_tables(backend, conn, cursor):
+    backend.create_tables(cursor)
+
+
+def _plant_columns(backend, conn, cursor):
+    seasonal = 'BOOLEAN DEFAULT TRUE' if backend.name == 'postgres' else 'INTEGER DEFAULT 1'
+    backend.add_column(cursor, 'plants', 'group_id', 'INTEGER')
+    backend.add_column(cursor, 'plants', 'photo_file_id', 'TEXT')
+    backend.add_column(cursor, 'plants', 'plant_type', "TEXT DEFAULT 'moderada'")
+    backend.add_column(cursor, 'plants', 'seasonal_adjustment', seasonal)
+    backend.add_column(cursor, 'plants', 'custom_dryness_level', 'INTEGER DEFAULT 50')
+
+
+def _watering_summary(backend, conn, cursor):
+    # Columnas desnormalizadas: se rellenan una vez desde watering_log
+    backend.add_column(cursor, 'plants', 'last_watered_at', 'TIMESTAMP')
+    backend.add_column(cursor, 'plants', 'watering_count', 'INTEGER NOT NULL DEFAULT 0')
+    conn.commit()
+    backfill_in_batches(backend, conn, backend.BACKFILL_WATERING_SUMMARY)
+
+
+def _next_due(backend, conn, cursor):
+    backend.add_column(cursor, 'plants', 'next_due_at', 'TIMESTAMP')
+    conn.commit()
+    backfill_in_batches(backend, conn, backend.BACKFILL_NEXT_DUE)
+
+
+def _due_indexes(backend, conn, cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plants_user_next_due ON plants(user_id, next_due_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plants_next_due ON plants(next_due_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notification_log_sent_at ON notification_log(sent_at)')
+
+
+def _query_indexes(backend, conn, cursor):
+    # Índices compuestos para las consultas frecuentes (check_query_plans.py comprueba que se usan)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plants_user_name ON plants(user_id, name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plants_group_name ON plants(group_id, name)')
+    # Último riego, MAX/COUNT por planta e historial sin leer la tabla (id desempata los deshacer)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_watering_log_plant_watered ON watering_log(plant_id, watered_at, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plant_photos_plant_uploaded ON plant_photos(plant_id, uploaded_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plant_groups_user_name ON plant_groups(user_id, name)')
+    # Son prefijos de los compuestos de arriba: solo costaban escrituras
+    cursor.execute('DROP INDEX IF EXISTS idx_plants_user_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_watering_log_plant_id')
+
+
+def _user_stats(backend, conn, cursor):
+    import user_stats
+
+    user_id = 'BIGINT' if backend.name == 'postgres' else 'INTEGER'
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id {user_id} PRIMARY KEY,
+            total_plants INTEGER NOT NULL DEFAULT 0,
+            total_waterings INTEGER NOT NULL DEFAULT 0,
+            days_active INTEGER NOT NULL DEFAULT 0,
+            last_active_day TEXT,
+            most_watered_plant_id INTEGER,
+            most_watered_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.commit()
+    # watering_daily aún no existe: la crea y la rellena la migración 8
+    user_stats.rebuild(backend, conn, daily=False)
+
+
+def _watering_daily(backend, conn, cursor):
+    user_id = 'BIGINT' if backend.name == 'postgres' else 'INTEGER'
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS watering_daily (
+            user_id {user_id} NOT NULL,
+            plant_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            waterings INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, plant_id, day)
+        )
+    ''')
+    # Tendencias y rachas por usuario y día sin pasar por la tabla
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_watering_daily_user_day ON watering_daily(user_id, day, waterings)')
+    conn.commit()
+    backfill_in_batches(backend, conn, backend.BACKFILL_WATERING_DAILY)
+
+
+def _watering_user(backend, conn, cursor):
+    # Copia del dueño de la planta en cada riego para paginar el historial por índice
+    user_id = 'BIGINT' if backend.name == 'postgres' else 'INTEGER'
+    backend.add_column(cursor, 'watering_log', 'user_id', user_id)
+    conn.commit()
+    backfill_in_batches(backend, conn, backend.BACKFILL_WATERING_USER, table='watering_log')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_watering_log_user_watered ON watering_log(user_id, watered_at, id)'
+    )
+
+
+def _epoch_seconds(table: str, column: str) -> str:
+    """Expresión que pasa una fecha en texto a segundos en hora local"""
+    modifier = ", 'localtime'" if (table, column) in UTC_TIMESTAMP_COLUMNS else ''
+    return f"CAST(strftime('%s', {column}{modifier}) AS INTEGER)"
+
+
+def _epoch_timestamps(backend, conn, cursor):
+    # PostgreSQL ya guarda TIMESTAMP; en SQLite solo se tocan las filas que siguen en texto
+    if backend.name != 'sqlite':
+        return
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+        columns = [column for column in columns if column in existing]
+        if not columns:
+            continue
+        converted = {column: _epoch_seconds(table, column) for column in columns}
+        if table == 'plants' and {'next_due_at', 'created_at', 'last_watered_at'} <= set(columns):
+            # Sin riegos, next_due_at es created_at, que la migración 4 pudo copiar en UTC
+            converted['next_due_at'] = (
+                f"CASE WHEN last_watered_at IS NULL AND typeof(created_at) = 'text' "
+                f"THEN {_epoch_seconds(table, 'created_at')} ELSE {converted['next_due_at']} END"
+            )
+        assignments = ', '.join(
+            f"{column} = CASE WHEN typeof({column}) = 'text' THEN {converted[column]} ELSE {column} END"
+            for column in columns
+        )
+        pending = ' OR '.join(f"typeof({column}) = 'text'" for column in columns)
+        if 'id' in existing:
+            statement = f'UPDATE {table} SET {assignments} WHERE id > ? AND id <= ? AND ({pending})'
+            backfill_in_batches(backend, conn, statement, table=table)
+        else:
+            cursor.execute(f'UPDATE {table} SET {assignments} WHERE {pending}')
+            conn.commit()
+
+
+def _change_log_index(backend, conn, cursor):
+    # change_log solo existe en SQLite; la purga por antigüedad no debe recorrer la tabla entera
+    if backend.name != 'sqlite':
+        return
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log(changed_at)')
+
+
+def _notifiable_index(backend, conn, cursor):
+    # Los recorridos de usuarios con avisos activados salen ya en orden de user_id
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_user_settings_notifiable ON user_settings(notifications_enabled, user_id)'
+    )
+
+
+# (versión, descripción, función); solo se añaden al final, nunca se reordenan
+MIGRATIONS = [
+    (1, 'tablas base', _base_tables),
+    (2, 'columnas de grupos, fotos y tipo de planta', _plant_columns),
+    (3, 'último riego y número de riegos en plants', _watering_summary),
+    (4, 'próximo riego (next_due_at)', _next_due),
+    (5, 'índices de vencimientos y notificaciones', _due_indexes),
+    (6, 'índices compuestos de las consultas frecuentes', _query_indexes),
+    (7, 'estadísticas por usuario (user_stats)', _user_stats),
+    (8, 'riegos por usuario, planta y día (watering_daily)', _watering_daily),
+    (9, 'dueño en watering_log para paginar el historial', _watering_user),
+    (10, 'fechas de SQLite en segundos enteros', _epoch_timestamps),
+    (11, 'índice de change_log por fecha', _change_log_index),
+    (12, 'índice de usuarios con avisos activados', _notifiable_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+EPOCH_TIMESTAMPS_VERSION = 10
+
+
+def current_version(backend, conn) -> int:
+    """Versión aplicada; 0 si la base de datos aún no tiene schema_version"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(backend.SCHEMA_VERSION)
+        row = cursor.fetchone()
+    except Exception as e:
+        conn.rollback()
+        if backend.is_undefined_table(e):
+            return 0
+        raise
+    conn.rollback()
+    return row[0] if row else 0
+
+
+def migrate(backend, conn) -> int:
+    """Aplica las migraciones pendientes y devuelve la versión final"""
+    version = current_version(backend, conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    cursor = conn.cursor()
+    backend.lock_schema(cursor)
+    try:
+        cursor.execute(backend.CREATE_SCHEMA_VERSION)
+        cursor.execute(backend.INIT_SCHEMA_VERSION)
+        conn.commit()
+        # Otro proceso pudo migrar mientras esperábamos el bloqueo
+        version = current_version(backend, conn)
+        if version < EPOCH_TIMESTAMPS_VERSION:
+            # Las migraciones usan las sentencias de hoy, que en SQLite esperan las fechas en
+            # segundos: una base anterior las convierte antes de nada (la 10 ya no encuentra texto)
+            _epoch_timestamps(backend, conn, cursor)
+        for number, description, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f'Aplicando migración {number}: {description}...')
+            start = time.monotonic()
+            apply(backend, conn, cursor)
+            cursor.execute(backend.SET_SCHEMA_VERSION, (number, number))
+            conn.commit()
+            version = number
+            logger.info(f'Migración {number} aplicada en {time.monotonic() - start:.1f}s')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        backend.unlock_schema(cursor)
+        conn.commit()
+    return version
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Migraciones del esquema')
+    parser.add_argument('--status', action='store_true', help='solo muestra la versión actual')
+    args = parser.parse_args()
+
+    from db_backends import create_backend
+
+    backend = create_backend(os.getenv('DATABASE_URL'), 'plants.db')
+    conn = backend.connect()
+    try:
+        version = current_version(backend, conn)
+        print(f'Versión del esquema: {version} (última: {LATEST_VERSION})')
+        if not args.status and version < LATEST_VERSION:
+            print(f'✅ Esquema actualizado a la versión {migrate(backend, conn)}')
+    finally:
+        conn.close()
@@ -0,0 +1,47 @@
+"""
+Worker de recordatorios independiente del polling de Telegram.
+
+Se pueden lanzar tantas instancias como se quiera (y BOT_NOTIFICATIONS=0 en el
+bot para que este no envíe): se reparten los usuarios por `user_id %
+NOTIFICATION_SHARDS` con concesiones en la base de datos y, si una instancia
+muere, las demás recogen sus shards cuando caducan (SHARD_LEASE_TTL).
+"""
+import asyncio
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from bot import PlantBot
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(bot: PlantBot):
+    bot.start_change_listener()
+    async with bot.application.bot:
+        await bot.send_notifications()
+
+
+def main():
+    load_dotenv()
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+
+    if not token:
+        print('Error: No se encontró TELEGRAM_BOT_TOKEN en las variables de entorno.')
+        return
+
+    bot = PlantBot(token)
+    logger.info(f'Worker de notificaciones {bot.leases.owner} con {bot.leases.shard_count} shards')
+    try:
+        asyncio.run(run_worker(bot))
+    except KeyboardInterrupt:
+        logger.info('Worker detenido por usuario')
+    except Exception as e:
+        logger.error(f'Error fatal: {e}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
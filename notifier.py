@@ -0,0 +1,210 @@
+"""
+Envío de recordatorios a Telegram con concurrencia acotada y límites de velocidad
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from telegram.error import Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Cubo de fichas: permite ráfagas de `capacity` mensajes y `rate` mensajes/s sostenidos"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float):
+        """Detiene el cubo (p. ej. tras un RetryAfter de Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return now >= self._paused_until and self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SendRun:
+    """Contadores y envíos en vuelo de una tanda (un cubo del planificador)"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.tasks = set()
+        self.stats = {
+            'submitted': 0,
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'blocked': 0,
+        }
+
+
+# Tanda de la tarea actual: cada cubo corre en su propia tarea asyncio, que copia el
+# contexto, así que los cubos simultáneos no comparten contadores ni envíos en vuelo
+_current_run: contextvars.ContextVar[Optional[SendRun]] = contextvars.ContextVar('send_run', default=None)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class SendPipeline:
+    """Cola de salida de mensajes hacia Telegram.
+
+    `submit` espera solo a que haya hueco (como mucho `concurrency` envíos en
+    vuelo) y lanza el envío en segundo plano. Cada envío pasa por un cubo de
+    fichas global (~30 msg/s, el límite de Telegram para un bot) y otro por
+    chat; un RetryAfter pausa el cubo global el tiempo indicado y se reintenta.
+    Si el usuario bloqueó el bot se le desactivan las notificaciones.
+
+    Los envíos se agrupan en tandas (`SendRun`) por tarea asyncio: `finish_run`
+    espera solo a los envíos de la tanda de la tarea que lo llama, de modo que
+    los cubos que se procesan a la vez no se mezclan en los contadores.
+    """
+
+    def __init__(self, bot, db, concurrency: int = None, rate: float = None,
+                 per_chat_rate: float = None, max_retries: int = None):
+        self.bot = bot
+        self.db = db
+        self.concurrency = concurrency or int(os.getenv('NOTIFY_CONCURRENCY', 10))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('NOTIFY_MAX_RETRIES', 3))
+        self.per_chat_rate = per_chat_rate or float(os.getenv('NOTIFY_CHAT_RATE', 1))
+        self._global = TokenBucket(rate or float(os.getenv('NOTIFY_RATE', 30)))
+        self._chats: Dict[int, TokenBucket] = {}
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+
+    @staticmethod
+    def _run() -> SendRun:
+        run = _current_run.get()
+        if run is None:
+            run = SendRun()
+            _current_run.set(run)
+        return run
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    async def submit(self, chat_id: int, text: str, **kwargs) -> asyncio.Task:
+        """Encola un mensaje; vuelve en cuanto hay hueco, sin esperar a que se envíe.
+
+        Devuelve la tarea del envío, cuyo resultado es False si el mensaje no llegó
+        (se agotaron los reintentos o hubo un error) y True si llegó o no hay que
+        repetirlo (el usuario bloqueó el bot).
+        """
+        run = self._run()
+        await self._slots.acquire()
+        run.stats['submitted'] += 1
+        task = asyncio.create_task(self._send(run.stats, chat_id, text, kwargs))
+        for tasks in (self._tasks, run.tasks):
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        return task
+
+    async def _send(self, stats: dict, chat_id: int, text: str, kwargs: dict) -> bool:
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._chat_bucket(chat_id).acquire()
+                await self._global.acquire()
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    stats['sent'] += 1
+                    return True
+                except RetryAfter as e:
+                    wait = _retry_after_seconds(e)
+                    stats['rate_limited'] += 1
+                    logger.warning(f'Telegram pide esperar {wait}s (chat {chat_id})')
+                    self._global.pause(wait)
+                except Forbidden as e:
+                    stats['blocked'] += 1
+                    logger.info(f'Usuario {chat_id} bloqueó el bot, se desactivan sus notificaciones: {e}')
+                    await self._disable_notifications(chat_id)
+                    return True
+                except (TimedOut, NetworkError) as e:
+                    logger.warning(f'Error de red enviando a {chat_id} (intento {attempt + 1}): {e}')
+                    # Tras el último intento no hay nada que esperar: se libera el hueco ya
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(min(2 ** attempt, 30))
+                except Exception as e:
+                    stats['failed'] += 1
+                    logger.error(f'Error sending notification to {chat_id}: {e}')
+                    return False
+
+                if attempt < self.max_retries:
+                    stats['retries'] += 1
+
+            stats['failed'] += 1
+            logger.error(f'Se agotaron los reintentos enviando a {chat_id}')
+            return False
+        finally:
+            self._slots.release()
+
+    async def _disable_notifications(self, user_id: int):
+        try:
+            settings = await self.db.get_user_settings(user_id)
+            time_setting = settings.notification_time if settings else None
+            await self.db.update_notification_settings(user_id, False, time_setting)
+        except Exception as e:
+            logger.error(f'No se pudieron desactivar las notificaciones de {user_id}: {e}')
+
+    @staticmethod
+    async def _join(tasks: set):
+        while tasks:
+            await asyncio.gather(*list(tasks), return_exceptions=True)
+
+    async def join(self):
+        """Espera a todos los envíos en curso, de cualquier tanda"""
+        await self._join(self._tasks)
+
+    async def finish_run(self, label: str = '') -> dict:
+        """Espera a los envíos de la tanda de esta tarea, registra sus contadores y la cierra"""
+        run = self._run()
+        _current_run.set(None)
+        await self._join(run.tasks)
+        elapsed = time.monotonic() - run.started
+        stats = dict(run.stats)
+        stats['elapsed'] = round(elapsed, 2)
+        stats['per_second'] = round(stats['sent'] / elapsed, 2) if elapsed > 0 else 0.0
+        logger.info(
+            f'Recordatorios {label}: {stats["sent"]}/{stats["submitted"]} enviados, '
+            f'{stats["failed"]} fallidos, {stats["blocked"]} bloqueados, '
+            f'{stats["rate_limited"]} limitados, {stats["retries"]} reintentos '
+            f'en {stats["elapsed"]}s ({stats["per_second"]} msg/s)'
+        )
+        self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.idle}
+        return stats
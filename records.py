@@ -0,0 +1,45 @@
+"""
+Filas que devuelve Database, con nombre y tipo
+
+Son NamedTuple: ocupan lo mismo que una tupla (sin __dict__ por fila) y se siguen
+pudiendo desempaquetar, pero cada campo se lee por su nombre. Las fechas llegan ya
+como datetime en ambos motores (ver SQLBackend.from_timestamp), así que quien las
+usa no tiene que volver a interpretarlas.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+
+class Plant(NamedTuple):
+    id: int
+    user_id: int
+    name: str
+    watering_frequency_days: int
+    last_watered_at: Optional[datetime]
+    next_due_at: Optional[datetime]
+    plant_type: Optional[str]
+
+
+class Watering(NamedTuple):
+    id: int
+    plant_name: str
+    watered_at: datetime
+
+
+class Photo(NamedTuple):
+    id: int
+    file_id: str
+    caption: Optional[str]
+    uploaded_at: datetime
+
+
+class Group(NamedTuple):
+    id: int
+    name: str
+    plant_count: int
+
+
+class Settings(NamedTuple):
+    notifications_enabled: int
+    notification_time: Optional[str]
+    timezone: Optional[str]
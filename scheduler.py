@@ -0,0 +1,302 @@
+"""
+Planificador de recordatorios de riego basado en una cola de prioridad
+"""
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+from datetime import datetime, timedelta, time as dt_time, timezone as dt_timezone
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NOTIFICATION_TIME = '09:00'
+# Días que se conservan en notification_log
+NOTIFICATION_LOG_RETENTION = timedelta(days=7)
+
+
+def parse_notification_time(value: Optional[str]) -> dt_time:
+    """Convierte 'HH:MM' en una hora; lanza ValueError si no es válida"""
+    hour, minute = (value or DEFAULT_NOTIFICATION_TIME).split(':')
+    return dt_time(int(hour), int(minute))
+
+
+def get_zone(name: Optional[str]):
+    try:
+        return ZoneInfo(name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f'Zona horaria desconocida "{name}", se usa UTC')
+        return dt_timezone.utc
+
+
+def plant_set_hash(plants) -> str:
+    return hashlib.sha1(','.join(str(plant_id) for plant_id in sorted(plant.id for plant in plants)).encode()).hexdigest()[:16]
+
+
+def reminder_time(next_due: datetime, notification_time: Optional[str], timezone: Optional[str],
+                  now: datetime, last_sent: Optional[datetime] = None, catch_up: bool = False) -> datetime:
+    """Momento (UTC) del próximo recordatorio: la hora elegida por el usuario, en su zona
+    horaria, el día en que vence su primera planta (o el siguiente si ese día ya se le
+    avisó). Si esa hora ya pasó hoy se pasa a mañana, salvo con `catch_up`, que se usa al
+    arrancar para enviar enseguida el aviso que un reinicio impidió mandar."""
+    zone = get_zone(timezone)
+    try:
+        at = parse_notification_time(notification_time)
+    except ValueError:
+        at = parse_notification_time(DEFAULT_NOTIFICATION_TIME)
+
+    # Las fechas sin zona de la BD están en la hora local del servidor
+    day = max(next_due.astimezone(zone).date(), now.astimezone(zone).date())
+    if last_sent is not None:
+        day = max(day, last_sent.astimezone(zone).date() + timedelta(days=1))
+
+    fire_at = datetime.combine(day, at, tzinfo=zone)
+    if fire_at < now and not catch_up:
+        fire_at = datetime.combine(day + timedelta(days=1), at, tzinfo=zone)
+    return fire_at.astimezone(dt_timezone.utc)
+
+
+class ReminderScheduler:
+    """Recordatorios agrupados por minuto UTC.
+
+    Cada usuario está en el cubo del minuto UTC que corresponde a su
+    `notification_time` y `timezone`; `_buckets` es el índice minuto ->
+    usuarios y el min-heap guarda los minutos con algún usuario, así que
+    saber quién recibe aviso en un minuto es una consulta a un dict y cada
+    vuelta solo trabaja con los cubos que vencen. Cada cubo se procesa en
+    su propia tarea, de modo que los envíos se reparten a lo largo del día.
+    `deliver(user_id, plants)` puede devolver la tarea del envío: si su resultado
+    es False se borra el registro del aviso y el usuario se reintenta más tarde.
+
+    Con varias instancias, `set_shards` limita el planificador a los usuarios
+    cuyo `user_id % shard_count` está en los shards que tiene concedidos, y la
+    planificación se reconstruye cada `rebuild_interval` segundos para recoger
+    los cambios hechos desde otras instancias.
+    """
+
+    def __init__(self, db, deliver, flush=None, max_sleep: float = 3600, chunk_size: int = 1000,
+                 rebuild_interval: float = None):
+        self.db = db
+        self.deliver = deliver
+        self.flush = flush
+        self.max_sleep = max_sleep
+        self.chunk_size = chunk_size
+        self.rebuild_interval = rebuild_interval or float(os.getenv('NOTIFICATION_REBUILD_INTERVAL', 900))
+        self.shard_count: Optional[int] = None
+        self.shards: frozenset = frozenset()
+        self._rebuild_pending = False
+        self._heap: List[datetime] = []
+        self._buckets: Dict[datetime, Set[int]] = {}
+        self._user_bucket: Dict[int, datetime] = {}
+        self._last_sent: Dict[int, datetime] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._user_bucket)
+
+    def owns(self, user_id: int) -> bool:
+        return self.shard_count is None or user_id % self.shard_count in self.shards
+
+    def set_shards(self, shard_count: int, shards):
+        """Cambia los shards que atiende esta instancia; la planificación se reconstruye
+        en la siguiente vuelta de `run`"""
+        self.shard_count = shard_count
+        self.shards = frozenset(shards)
+        self._rebuild_pending = True
+        self._wakeup.set()
+
+    def notify_change(self, user_id: Optional[int]):
+        """Aviso de un cambio hecho por otro proceso (None = de todos los usuarios)"""
+        if user_id is None:
+            self._rebuild_pending = True
+            self._wakeup.set()
+        elif self.owns(user_id):
+            task = asyncio.create_task(self._refresh_remote(user_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _refresh_remote(self, user_id: int):
+        try:
+            await self.refresh_user(user_id)
+        except Exception as e:
+            logger.error(f'Error replanificando al usuario {user_id}: {e}')
+
+    def users_at(self, minute: datetime) -> Set[int]:
+        return set(self._buckets.get(minute, ()))
+
+    def schedule(self, user_id: int, fire_at: Optional[datetime]):
+        """Programa (o cancela con None) el próximo recordatorio de un usuario"""
+        old = self._user_bucket.pop(user_id, None)
+        if old is not None:
+            users = self._buckets.get(old)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    # La entrada del heap queda huérfana y se ignora al salir
+                    del self._buckets[old]
+
+        if fire_at is None:
+            return
+
+        minute = fire_at.replace(second=0, microsecond=0)
+        self._user_bucket[user_id] = minute
+        users = self._buckets.get(minute)
+        if users is None:
+            self._buckets[minute] = {user_id}
+            heapq.heappush(self._heap, minute)
+            if self._heap[0] == minute:
+                self._wakeup.set()
+        else:
+            users.add(user_id)
+
+    def next_fire_time(self) -> Optional[datetime]:
+        while self._heap and self._heap[0] not in self._buckets:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[Tuple[datetime, Set[int]]]:
+        due = []
+        while self._heap and self._heap[0] <= now:
+            minute = heapq.heappop(self._heap)
+            users = self._buckets.pop(minute, None)
+            if users:
+                for user_id in users:
+                    del self._user_bucket[user_id]
+                due.append((minute, users))
+        return due
+
+    def _fire_time(self, row, now: datetime, catch_up: bool = False) -> Optional[datetime]:
+        user_id, next_due, notification_time, timezone = row
+        if next_due is None:
+            return None
+        return reminder_time(next_due, notification_time, timezone, now, self._last_sent.get(user_id), catch_up)
+
+    async def rebuild(self, catch_up: bool = False):
+        """Reconstruye la planificación desde la BD, incluidos los avisos ya enviados.
+        Con `catch_up` (solo al arrancar) los avisos de hoy cuya hora ya pasó se mandan
+        enseguida; en las demás reconstrucciones pasan a su siguiente hora."""
+        now = datetime.now(dt_timezone.utc)
+        local_now = datetime.now()
+        await self.db.purge_notification_log(local_now - NOTIFICATION_LOG_RETENTION)
+        for user_id, sent_at in await self.db.get_recent_notifications(local_now - timedelta(days=2)):
+            self._last_sent[user_id] = sent_at.astimezone(dt_timezone.utc)
+
+        self._rebuild_pending = False
+        if self.shard_count is None:
+            rows = await self.db.get_next_due_by_user()
+        else:
+            rows = await self.db.get_next_due_by_user(shard_count=self.shard_count, shards=sorted(self.shards))
+        self._heap = []
+        self._buckets = {}
+        self._user_bucket = {}
+        for row in rows:
+            self.schedule(row[0], self._fire_time(row, now, catch_up=catch_up))
+        self._wakeup.set()
+        self._rebuilt_at = datetime.now(dt_timezone.utc)
+        logger.info(
+            f'Planificador de recordatorios reconstruido: {len(self._user_bucket)} usuarios '
+            f'en {len(self._buckets)} franjas de un minuto'
+        )
+
+    async def refresh_user(self, user_id: int):
+        """Recalcula el recordatorio de un usuario tras un cambio en sus plantas o ajustes"""
+        if not self.owns(user_id):
+            return
+        rows = await self.db.get_next_due_by_user(user_id)
+        fire_at = self._fire_time(rows[0], datetime.now(dt_timezone.utc)) if rows else None
+        self.schedule(user_id, fire_at)
+
+    async def refresh_users(self, user_ids: List[int]):
+        user_ids = [user_id for user_id in user_ids if self.owns(user_id)]
+        if not user_ids:
+            return
+        rows = await self.db.get_next_due_by_user(user_ids=user_ids)
+        now = datetime.now(dt_timezone.utc)
+        fire_times = {row[0]: self._fire_time(row, now) for row in rows}
+        for user_id in user_ids:
+            self.schedule(user_id, fire_times.get(user_id))
+
+    async def _process_bucket(self, minute: datetime, users: Set[int]):
+        logger.info(f'Procesando franja {minute:%H:%M} UTC con {len(users)} usuarios')
+        # Si el shard se cedió mientras tanto, lo atiende ya su nuevo dueño
+        users = sorted(user_id for user_id in users if self.owns(user_id))
+        due_bucket = minute.date().isoformat()
+        for start in range(0, len(users), self.chunk_size):
+            chunk = users[start:start + self.chunk_size]
+            sends = []
+            try:
+                # Una sola consulta por lote de usuarios en lugar de una por usuario
+                async for user_id, plants in self.db.stream('iter_due_plants_by_user', user_ids=chunk):
+                    # Un reintento no repite el aviso a quien ya lo recibió
+                    if self._last_sent.get(user_id, minute - timedelta(days=1)) > minute - timedelta(hours=12):
+                        continue
+                    # El registro en notification_log evita duplicados entre reinicios o instancias
+                    plant_hash = plant_set_hash(plants)
+                    claimed = await self.db.claim_notification(user_id, due_bucket, plant_hash)
+                    if claimed:
+                        sends.append((user_id, plant_hash, await self.deliver(user_id, plants)))
+                    self._last_sent[user_id] = minute
+                await self.refresh_users(chunk)
+                failed = await self._confirm_sends(due_bucket, sends)
+            except Exception as e:
+                logger.error(f'Error procesando recordatorios de la franja {minute:%H:%M}: {e}')
+                await self._confirm_sends(due_bucket, sends)
+                # Se reintenta más tarde en lugar de perder a los usuarios del lote
+                failed = chunk
+            retry_at = datetime.now(dt_timezone.utc) + timedelta(minutes=5)
+            for user_id in failed:
+                self.schedule(user_id, retry_at)
+        
+        if self.flush is not None:
+            await self.flush(f'{minute:%H:%M} UTC')
+
+    async def _confirm_sends(self, due_bucket: str, sends: List[Tuple]) -> List[int]:
+        """Espera al resultado de los envíos del lote y libera el registro de los que no
+        llegaron, para que el reintento (o un reinicio) los vuelva a mandar; devuelve sus usuarios"""
+        failed = []
+        for user_id, plant_hash, outcome in sends:
+            try:
+                delivered = await outcome if asyncio.isfuture(outcome) else outcome is not False
+            except Exception as e:
+                logger.error(f'Error enviando el recordatorio a {user_id}: {e}')
+                delivered = False
+            if delivered:
+                continue
+            failed.append(user_id)
+            self._last_sent.pop(user_id, None)
+            try:
+                await self.db.release_notification(user_id, due_bucket, plant_hash)
+            except Exception as e:
+                logger.error(f'No se pudo liberar el recordatorio de {user_id}: {e}')
+        return failed
+
+    async def run(self):
+        # Con shards, al arrancar aún no hay ninguno concedido: la recuperación de los avisos
+        # perdidos por el reinicio se hace en la primera reconstrucción que ya tiene usuarios
+        caught_up = self.shard_count is None or bool(self.shards)
+        await self.rebuild(catch_up=True)
+
+        while True:
+            now = datetime.now(dt_timezone.utc)
+            # Los cubos que ya tocan salen antes de reconstruir, que los pasaría a mañana
+            for minute, users in self.pop_due(now):
+                task = asyncio.create_task(self._process_bucket(minute, users))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if self._rebuild_pending or (now - self._rebuilt_at).total_seconds() >= self.rebuild_interval:
+                await self.rebuild(catch_up=not caught_up)
+                caught_up = caught_up or bool(self.shards)
+
+            next_fire = self.next_fire_time()
+            timeout = min(self.max_sleep, self.rebuild_interval)
+            if next_fire is not None:
+                timeout = min(timeout, max((next_fire - datetime.now(dt_timezone.utc)).total_seconds(), 0))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
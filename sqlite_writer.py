@@ -0,0 +1,139 @@
+"""
+Escritor único para SQLite con commits agrupados
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class SQLiteWriter:
+    """Hilo que hace todas las escrituras de SQLite con una sola conexión.
+
+    Las operaciones (`operation(cursor) -> resultado`) llegan por una cola y
+    se agrupan en una transacción hasta juntar `max_batch` o pasar
+    `max_delay` segundos desde la primera, así un pico de escrituras paga un
+    solo fsync en lugar de uno por fila y nadie compite por el bloqueo de la
+    base de datos. Cada operación va en su propio SAVEPOINT: si falla se
+    deshace solo ella y su Future recibe la excepción; las demás se
+    confirman juntas y sus Futures se resuelven tras el COMMIT.
+    """
+
+    def __init__(self, connect, max_batch: int = 100, max_delay: float = 0.005):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._stats = {
+            'operations': 0,
+            'batches': 0,
+            'failed': 0,
+            'largest_batch': 0,
+        }
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._started = threading.Event()
+        self._closed = False
+        self._thread.start()
+        self._started.wait()
+
+    def submit(self, operation) -> Future:
+        if self._closed:
+            raise RuntimeError('El escritor de SQLite está cerrado')
+        future = Future()
+        self._queue.put((operation, future))
+        return future
+
+    def execute(self, operation):
+        return self.submit(operation).result()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        # Las transacciones las abre y cierra el propio escritor
+        conn.isolation_level = None
+        self._started.set()
+        try:
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    break
+                self._commit_batch(conn, self._collect(first))
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch: list):
+        cursor = conn.cursor()
+        outcomes = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for operation, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute('SAVEPOINT op')
+                try:
+                    result = operation(cursor)
+                    cursor.execute('RELEASE op')
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO op')
+                    cursor.execute('RELEASE op')
+                    outcomes.append((future, None, e))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            logger.error(f'Error confirmando un lote de {len(batch)} escrituras: {e}')
+            try:
+                cursor.execute('ROLLBACK')
+            except Exception:
+                pass
+            for operation, future in batch:
+                if not future.done():
+                    if not future.running():
+                        future.set_running_or_notify_cancel()
+                    future.set_exception(e)
+            with self._lock:
+                self._stats['failed'] += len(batch)
+            return
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['operations'] += len(outcomes)
+            self._stats['failed'] += sum(1 for _, _, error in outcomes if error is not None)
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(outcomes))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['avg_batch'] = round(stats['operations'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
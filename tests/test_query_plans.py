@@ -0,0 +1,30 @@
+"""
+Los planes de todas las sentencias del backend: sin recorridos completos ni ordenaciones
+temporales fuera de ALLOWED, y ninguna sentencia sin caso en check_query_plans.build_cases.
+
+SQLite se comprueba siempre; PostgreSQL solo si DATABASE_URL está definida (la siembra
+se hace dentro de una transacción que se deshace).
+"""
+import os
+
+import pytest
+
+from check_query_plans import check_plans
+from database import Database
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def db(request, tmp_path, monkeypatch):
+    if request.param == 'postgres':
+        if not os.getenv('DATABASE_URL'):
+            pytest.skip('DATABASE_URL no está definida')
+        database = Database()
+    else:
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+        database = Database(str(tmp_path / 'plans.db'))
+    yield database
+    database.close()
+
+
+def test_query_plans(db):
+    assert check_plans(db) == []
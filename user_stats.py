@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Contadores por usuario para /estadisticas (tabla user_stats)
+
+Cada escritura que cambia las estadísticas las actualiza en su misma transacción:
+añadir una planta suma una planta y cada riego suma un riego, un día activo si es
+de un día nuevo y, si hace falta, cambia la planta más regada (plants.watering_count
+es el contador por planta). Borrar una planta o deshacer un riego pueden quitar un
+día activo o la planta más regada, así que recuentan a ese usuario. Así
+/estadisticas lee una sola fila por clave primaria.
+
+watering_daily guarda cuántas veces se regó cada planta cada día. Se mantiene en las
+mismas transacciones y de ella salen las tendencias, rachas y el día de la semana
+con más riegos sin recorrer watering_log.
+
+Si los contadores se desajustan (datos tocados a mano, una importación...), este
+script los comprueba o los reconstruye desde plants y watering_log.
+
+Uso: python user_stats.py [--check] [--user USER_ID ...]
+"""
+import logging
+import os
+import time
+
+import migrations
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('total_plants', 'total_waterings', 'days_active', 'last_active_day', 'most_watered_count')
+
+
+def stats_users(backend, conn) -> list:
+    """Usuarios con plantas o con fila en user_stats"""
+    cursor = conn.cursor()
+    cursor.execute(backend.STATS_USERS)
+    users = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    return users
+
+
+def rebuild(backend, conn, user_ids=None, batch_size: int = None, daily: bool = True) -> int:
+    """Recalcula plants.watering_count, user_stats y (si `daily`) watering_daily de los
+    usuarios indicados (todos por defecto), confirmando por lotes. Devuelve el número de
+    usuarios recalculados."""
+    batch_size = batch_size or migrations.BATCH_SIZE
+    if user_ids is None:
+        user_ids = stats_users(backend, conn)
+    cursor = conn.cursor()
+    for start in range(0, len(user_ids), batch_size):
+        batch = [(user_id,) for user_id in user_ids[start:start + batch_size]]
+        cursor.executemany(backend.REBUILD_PLANT_COUNTS, batch)
+        cursor.executemany(backend.REBUILD_USER_STATS, batch)
+        if daily:
+            cursor.executemany(backend.DELETE_USER_WATERING_DAILY, batch)
+            cursor.executemany(backend.REBUILD_WATERING_DAILY, batch)
+        conn.commit()
+        logger.info(f'  user_stats: {min(start + batch_size, len(user_ids))}/{len(user_ids)}')
+        if migrations.BATCH_PAUSE:
+            time.sleep(migrations.BATCH_PAUSE)
+    return len(user_ids)
+
+
+def check(backend, conn, user_ids=None) -> list:
+    """Compara los contadores guardados con un recuento desde watering_log.
+    Devuelve una lista de (user_id, campo, guardado, real) con las diferencias."""
+    if user_ids is None:
+        user_ids = stats_users(backend, conn)
+    cursor = conn.cursor()
+    problems = []
+    for user_id in user_ids:
+        cursor.execute(backend.PLANT_COUNTS, (user_id,))
+        for plant_id, stored, actual in cursor.fetchall():
+            if stored != actual:
+                problems.append((user_id, f'watering_count de la planta {plant_id}', stored, actual))
+
+        cursor.execute(backend.WATERING_DAILY_FOR_USER, (user_id,))
+        stored_days = {(plant_id, day): total for plant_id, day, total in cursor.fetchall()}
+        cursor.execute(backend.WATERING_DAILY_FROM_LOG, (user_id,))
+        actual_days = {(plant_id, day): total for plant_id, day, total in cursor.fetchall()}
+        for plant_id, day in sorted(stored_days.keys() | actual_days.keys()):
+            stored, actual = stored_days.get((plant_id, day), 0), actual_days.get((plant_id, day), 0)
+            if stored != actual:
+                problems.append((user_id, f'watering_daily de la planta {plant_id} el {day}', stored, actual))
+
+        cursor.execute(backend.RECOUNT_USER_STATS, (user_id,))
+        _, plants, waterings, days, last_day, _, top = cursor.fetchone()
+        actual = dict(zip(FIELDS, (plants, waterings, days, last_day, top)))
+        cursor.execute(backend.STORED_USER_STATS, (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            problems.append((user_id, 'user_stats', None, 'sin fila'))
+            continue
+        stored = dict(zip(FIELDS, row[:5]))
+        for field in FIELDS:
+            if stored[field] != actual[field]:
+                problems.append((user_id, field, stored[field], actual[field]))
+        # La planta más regada puede ser cualquiera de las empatadas, pero tiene que ser suya
+        top_owner, top_count = row[5], row[6]
+        if actual['total_plants'] and (top_owner != user_id or top_count != actual['most_watered_count']):
+            problems.append((user_id, 'riegos de most_watered_plant_id', top_count, actual['most_watered_count']))
+    conn.rollback()
+    return problems
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Comprueba o reconstruye las estadísticas por usuario')
+    parser.add_argument('--check', action='store_true', help='solo compara, sin modificar nada')
+    parser.add_argument('--user', type=int, nargs='+', help='limita la operación a estos usuarios')
+    args = parser.parse_args()
+
+    from db_backends import create_backend
+
+    backend = create_backend(os.getenv('DATABASE_URL'), 'plants.db')
+    conn = backend.connect()
+    try:
+        migrations.migrate(backend, conn)
+        if args.check:
+            problems = check(backend, conn, args.user)
+            for user_id, field, stored, actual in problems:
+                print(f'❌ usuario {user_id}: {field} = {stored}, debería ser {actual}')
+            print(f'{len(problems)} diferencias')
+            raise SystemExit(1 if problems else 0)
+        start = time.monotonic()
+        users = rebuild(backend, conn, args.user)
+        print(f'✅ Estadísticas reconstruidas para {users} usuarios en {time.monotonic() - start:.1f}s')
+    finally:
+        conn.close()